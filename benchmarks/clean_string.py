@@ -0,0 +1,54 @@
+"""Micro-benchmark of clean_string against the original regex-only version
+
+Run from the repository root with: python -m benchmarks.clean_string
+"""
+import re
+from glob import glob
+from os.path import join
+from timeit import timeit
+from xml.etree.ElementTree import iterparse
+
+from hdx.utilities.loader import load_json
+
+from iati.normalise import clean_stripped_string, clean_string
+
+
+def original_clean_string(s):
+    s = re.sub(r"(\W)\1+", r"\1", s.strip())
+    s = re.sub(r"\s", " ", s)
+    s = re.sub(r"^\W?([\w &]*)[^a-zA-Z0-9_\.]?$", r"\1", s)
+    return s.strip()
+
+
+def get_strings():
+    strings = list()
+    for filename in ("IATIOrganisationIdentifier.json", "Region.json"):
+        for entry in load_json(join("data", filename))["data"]:
+            strings.append(entry["code"])
+            strings.append(entry["name"])
+    for path in glob(join("tests", "fixtures", "**", "*.xml"), recursive=True):
+        for _, element in iterparse(path):
+            if element.tag == "narrative" and element.text:
+                strings.append(element.text)
+            ref = element.get("ref")
+            if ref:
+                strings.append(ref)
+            element.clear()
+    return strings
+
+
+def main(repeat=5):
+    strings = get_strings()
+    print(f"{len(strings)} strings ({len(set(strings))} unique)")
+    for name, function in (
+        ("original", original_clean_string),
+        ("clean_string", clean_string),
+    ):
+        clean_stripped_string.cache_clear()
+        seconds = timeit(lambda: [function(s) for s in strings], number=repeat)
+        print(f"{name}: {seconds / repeat * 1000:.1f}ms per pass")
+    print(clean_stripped_string.cache_info())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark of get_date_with_fallback against the original dateutil-only
+version on the transaction and activity dates of the fixture XML
+
+Run from the repository root with: python -m benchmarks.dates
+"""
+import warnings
+from glob import glob
+from os.path import join
+from timeit import timeit
+from xml.etree.ElementTree import iterparse
+
+from dateutil.parser import ParserError
+from hdx.utilities.dateparse import parse_date
+
+from iati.utilities import get_date_with_fallback, parse_iati_date
+
+
+def original_get_date_with_fallback(date1, date2):
+    output_date = date1
+    if output_date:
+        try:
+            output_date = parse_date(output_date)
+        except ParserError:
+            output_date = None
+    if not output_date:
+        output_date = date2
+        if output_date:
+            try:
+                output_date = parse_date(output_date)
+            except ParserError:
+                output_date = None
+        else:
+            output_date = None
+    return output_date
+
+
+def get_date_pairs():
+    """Returns the pairs of dates passed to get_date_with_fallback for each
+    transaction (transaction and value dates both ways round) and activity
+    (actual and planned start dates)"""
+    pairs = list()
+    for path in glob(join("tests", "fixtures", "*", "input", "dportal.xml")):
+        for _, element in iterparse(path):
+            if element.tag == "transaction":
+                date = element.find("transaction-date")
+                date = None if date is None else date.get("iso-date")
+                value = element.find("value")
+                value_date = None if value is None else value.get("value-date")
+                pairs.append((date, value_date))
+                pairs.append((value_date, date))
+            elif element.tag == "iati-activity":
+                dates = {
+                    date.get("type"): date.get("iso-date")
+                    for date in element.iterfind("activity-date")
+                }
+                pairs.append((dates.get("2"), dates.get("1")))
+                element.clear()
+    return pairs
+
+
+def main(repeat=3):
+    pairs = get_date_pairs()
+    print(f"{len(pairs)} date pairs")
+    for name, function in (
+        ("original", original_get_date_with_fallback),
+        ("get_date_with_fallback", get_date_with_fallback),
+    ):
+        parse_iati_date.cache_clear()
+        seconds = timeit(
+            lambda: [function(date1, date2) for date1, date2 in pairs], number=repeat
+        )
+        print(f"{name}: {seconds / repeat * 1000:.1f}ms per pass")
+    print(parse_iati_date.cache_info())
+
+
+if __name__ == "__main__":
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        main()
@@ -0,0 +1,114 @@
+"""Memory benchmark of flattened coded items and organisations against the
+original per-call dynamic types
+
+The sectors, countries, regions and orgs of the covid fixture activities and
+their transactions are flattened repeatedly until those of 10,000 activities
+are held. Each implementation runs in a fresh process so that RSS increases
+can be compared.
+
+Run from the repository root with: python -m benchmarks.flatten_memory
+"""
+import subprocess
+import sys
+import tracemalloc
+from os.path import join
+
+import diterator
+from diterator.wrappers import CodedItem, NarrativeText, Organisation
+
+from iati.smallnarrativetext import SmallNarrativeText
+from iati.utilities import flatten
+
+NO_ACTIVITIES = 10000
+DPORTAL_PATH = join("tests", "fixtures", "covid", "input", "dportal.xml")
+
+
+def original_flatten(obj):
+    if isinstance(obj, list):
+        return [original_flatten(x) for x in obj]
+    elif isinstance(obj, dict):
+        return {k: original_flatten(v) for k, v in obj.items()}
+    elif isinstance(obj, NarrativeText):
+        return SmallNarrativeText(obj)
+    elif isinstance(obj, CodedItem):
+        return type(
+            "",
+            (object,),
+            {
+                "code": obj.code,
+                "type": obj.type,
+                "vocabulary": obj.vocabulary,
+                "percentage": obj.percentage,
+            },
+        )()
+    elif isinstance(obj, Organisation):
+        return type(
+            "",
+            (object,),
+            {
+                "name": original_flatten(obj.name),
+                "ref": obj.ref,
+                "role": obj.role,
+                "type": obj.type,
+            },
+        )()
+    else:
+        return obj
+
+
+def get_rss():
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * 4096
+
+
+def read_activities():
+    """Returns the wrapped items of each fixture activity that get flattened"""
+    activities = list()
+    for dactivity in diterator.XMLIterator(DPORTAL_PATH):
+        items = [
+            dactivity.reporting_org,
+            dactivity.sectors,
+            dactivity.recipient_countries,
+            dactivity.recipient_regions,
+            dactivity.participating_orgs,
+        ]
+        for dtransaction in dactivity.transactions:
+            items.append(dtransaction.sectors)
+            items.append(dtransaction.provider_org)
+            items.append(dtransaction.receiver_org)
+            items.append(dtransaction.recipient_countries)
+            items.append(dtransaction.recipient_regions)
+        activities.append(items)
+    return activities
+
+
+def measure(name):
+    function = original_flatten if name == "original" else flatten
+    activities = read_activities()
+    rss = get_rss()
+    tracemalloc.start()
+    held = list()
+    while len(held) < NO_ACTIVITIES:
+        for items in activities[: NO_ACTIVITIES - len(held)]:
+            held.append([function(item) for item in items])
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss = get_rss() - rss
+    print(
+        f"{name}: RSS +{rss / 1048576:.1f}MB, "
+        f"traced {traced / 1048576:.1f}MB per {NO_ACTIVITIES} activities"
+    )
+
+
+def main():
+    for name in ("original", "flatten"):
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.flatten_memory", name], check=True
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        measure(sys.argv[1])
+    else:
+        main()
@@ -0,0 +1,108 @@
+"""Benchmark of the text checks with keyword matchers against the original
+per-keyword scans of freshly lowercased narratives
+
+The title and description of an activity are checked once for the activity
+and again for each of its transactions, as the food security checks do when
+deciding whether to skip a transaction, so the benchmark uses activities with
+long multilingual titles and descriptions and many transactions.
+
+Run from the repository root with: python -m benchmarks.keywords
+"""
+import random
+from timeit import timeit
+
+from hdx.utilities.dateparse import parse_date
+from hdx.utilities.errors_onexit import ErrorsOnExit
+
+from iati import checks
+from iati.smallnarrativetext import SmallNarrativeText
+
+WORDS = {
+    "en": "the programme supports households affected by drought and conflict with cash transfers",
+    "fr": "le programme soutient les ménages touchés par la sécheresse et les conflits",
+    "es": "el programa apoya a los hogares afectados por la sequía y el conflicto",
+    "ar": "يدعم البرنامج الأسر المتضررة من الجفاف والنزاع بالتحويلات النقدية",
+    "uk": "програма підтримує домогосподарства постраждалі від посухи та конфлікту",
+}
+
+
+def original_has_desired_text(terms, narrativetext):
+    for lang, text in narrativetext.narratives.items():
+        if any(x in text.lower() for x in terms):
+            return True
+    return False
+
+
+def original_is_irrelevant_text(relevant_words, title_or_desc):
+    if not relevant_words:
+        return False
+    if not title_or_desc:
+        return False
+    for lang, text in title_or_desc.narratives.items():
+        text_lower = text.lower()
+        for word in relevant_words:
+            if word in text_lower:
+                return False
+    return True
+
+
+def make_narrative(words):
+    narrativetext = SmallNarrativeText.__new__(SmallNarrativeText)
+    narrativetext.narratives = {
+        lang: " ".join(random.choices(language_words, k=words)).upper()
+        for lang, language_words in (
+            (lang, text.split()) for lang, text in WORDS.items()
+        )
+    }
+    narrativetext.defaulttext = narrativetext.narratives["en"]
+    return narrativetext
+
+
+def get_activities(no_activities=200, no_transactions=20):
+    random.seed(0)
+    return [
+        (make_narrative(20), make_narrative(400), no_transactions)
+        for _ in range(no_activities)
+    ]
+
+
+def original_checks(activities):
+    for title, description, no_transactions in activities:
+        for _ in range(no_transactions + 1):
+            original_has_desired_text(("food security", "food insecurity"), title)
+            original_has_desired_text(
+                ("food security", "food insecurity"), description
+            )
+            original_is_irrelevant_text(("ukraine", "ukrainian"), title)
+            original_is_irrelevant_text(("ukraine", "ukrainian"), description)
+
+
+def matcher_checks(activities, foodsecurity_checks, ukraine_checks):
+    for title, description, no_transactions in activities:
+        for _ in range(no_transactions + 1):
+            foodsecurity_checks.has_desired_text(title)
+            foodsecurity_checks.has_desired_text(description)
+            ukraine_checks.is_irrelevant_text(title)
+            ukraine_checks.is_irrelevant_text(description)
+
+
+def main(repeat=3):
+    today = parse_date("2022-12-05")
+    foodsecurity_checks = checks["foodsecurity"](today, None, ErrorsOnExit())
+    ukraine_checks = checks["ukraine"](today, None, ErrorsOnExit())
+    activities = get_activities()
+    seconds = timeit(lambda: original_checks(activities), number=repeat)
+    print(f"original: {seconds / repeat * 1000:.1f}ms per pass")
+    # Fresh narratives each pass so the cost of lowercasing them once is counted
+    seconds = 0
+    for _ in range(repeat):
+        activities = get_activities()
+        seconds += timeit(
+            lambda: matcher_checks(activities, foodsecurity_checks, ukraine_checks),
+            number=1,
+        )
+    print(f"keyword matchers: {seconds / repeat * 1000:.1f}ms per pass")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""Throughput and memory benchmark of the pipeline on synthetic activities
+
+Synthetic D-Portal XML of the chosen scale is generated alongside the
+reference data of the covid fixture. The covid theme is then run end to end
+with start, whose run report gives the time and memory of each stage, and its
+components are run stage by stage on the same activities: parsing, the
+checks, small activity creation, the Lookups org passes, CalculateSplits and
+Activity.process. Each run is in a process of its own so that peak memory is
+not carried over.
+
+Results are compared with the baseline stored for the scale in a baselines
+file. A stage that takes longer or raises the peak memory of its process by
+more than its baseline by more than the tolerance is a regression, in which
+case the exit code is 1. Memory is compared on each stage's growth of the
+peak rather than on the peak so far, which carries over from earlier stages.
+Baselines depend on the machine, so they are not kept in the repository: the
+baselines file is ~/.iati_benchmarks/baselines.json on the machine that checks
+for regressions unless --baselines is given. Generate or regenerate its
+baseline for a scale there with --update. The lookup tables are built from
+sheets that are downloaded, so a reference data cache folder lets runs after
+the first start offline.
+
+Run from the repository root with:
+python -m benchmarks.pipeline --scale small --cache_dir benchmark_cache --update
+python -m benchmarks.pipeline --scale small --cache_dir benchmark_cache
+"""
+import argparse
+import json
+import logging
+import platform
+import sys
+import warnings
+from os import listdir, makedirs, symlink
+from os.path import abspath, dirname, expanduser, join
+
+import diterator
+from hdx.api.configuration import Configuration
+from hdx.utilities.dateparse import parse_date
+from hdx.utilities.downloader import Download
+from hdx.utilities.errors_onexit import ErrorsOnExit
+from hdx.utilities.path import temp_dir
+from hdx.utilities.retriever import Retrieve
+
+from iati import checks
+from iati.accumulators import Flows, Transactions
+from iati.calculatesplits import CalculateSplits
+from iati.lookups import Lookups
+from iati.main import setup_reference_data, start
+from iati.prefilter import prefilter_activity
+from iati.processing import ProcessCounts, process_activity
+from iati.referencecache import ReferenceCache
+from iati.runreport import REPORT_FILENAME, RunReport
+from iati.smalldactivity import create_small_dactivity
+from iati.utilities import forked_process_map
+
+from .synthetic import SyntheticActivities, add_arguments, get_kwargs
+
+BASELINES_PATH = join(expanduser("~"), ".iati_benchmarks", "baselines.json")
+REFERENCE_DIR = join("tests", "fixtures", "covid", "input")
+CONFIGURATION_PATH = join("tests", "config", "project_configuration.yml")
+TODAY = "2022-12-05"
+# Memory growth below which a stage is not compared
+MIN_MB = 10
+STARTDATE = "2020-01-01"
+SCALES = {
+    "small": {"no_activities": 1000},
+    "medium": {"no_activities": 10000},
+    "large": {"no_activities": 100000, "no_orgs": 5000},
+}
+
+
+def call(function, *args):
+    return function(*args)
+
+
+def get_retriever(downloader, input_dir, folder):
+    return Retrieve(downloader, folder, input_dir, folder, save=False, use_saved=True)
+
+
+def make_input_dir(folder, parameters):
+    """Links the reference data of the covid fixture into a folder with
+    synthetic D-Portal XML"""
+    input_dir = join(folder, "input")
+    makedirs(input_dir)
+    for filename in listdir(REFERENCE_DIR):
+        if filename != "dportal.xml":
+            symlink(abspath(join(REFERENCE_DIR, filename)), join(input_dir, filename))
+    SyntheticActivities(**parameters).write(join(input_dir, "dportal.xml"))
+    return input_dir
+
+
+def run_end_to_end(configuration, input_dir, folder, reference_cache, workers):
+    output_dir = join(folder, "output")
+    makedirs(output_dir)
+    with Download(user_agent="benchmark") as downloader:
+        Lookups.clear()
+        start(
+            configuration,
+            TODAY,
+            get_retriever(downloader, input_dir, folder),
+            output_dir,
+            dportal_params=None,
+            whattorun="covid",
+            startdate=STARTDATE,
+            saveprefiltered=False,
+            errors_on_exit=ErrorsOnExit(),
+            workers=workers,
+            reference_cache=reference_cache,
+        )
+    with open(join(output_dir, REPORT_FILENAME)) as file:
+        return json.load(file)
+
+
+def run_components(configuration, input_dir, folder, reference_cache, profile_dir):
+    report = RunReport("components", profile_dir=profile_dir)
+    with Download(user_agent="benchmark") as downloader:
+        Lookups.clear()
+        with report.stage("reference_data", None):
+            theme_sector_lookups = setup_reference_data(
+                configuration,
+                get_retriever(downloader, input_dir, folder),
+                ("covid",),
+                reference_cache,
+            )
+    Lookups.checks = checks["covid"](
+        parse_date(TODAY), parse_date(STARTDATE), ErrorsOnExit()
+    )
+    Lookups.sector_lookups = theme_sector_lookups["covid"]
+    with report.stage("parse") as stage:
+        dactivities = list(diterator.XMLIterator(join(input_dir, "dportal.xml")))
+        stage.items = len(dactivities)
+    with report.stage("checks") as stage:
+        dactivities = [
+            dactivity
+            for dactivity in dactivities
+            if prefilter_activity(dactivity) is not None
+        ]
+        stage.items = stage_items = len(dactivities)
+    with report.stage("small_activities") as stage:
+        dactivities = [create_small_dactivity(dactivity) for dactivity in dactivities]
+        stage.items = stage_items
+    with report.stage("lookups") as stage:
+        Lookups.add_reporting_orgs(dactivities)
+        Lookups.add_participating_orgs(dactivities)
+        stage.items = stage_items
+    with report.stage("calculate_splits") as stage:
+        for dactivity in dactivities:
+            country_splits = CalculateSplits.make_country_or_region_splits(dactivity)
+            sector_splits = CalculateSplits.make_sector_splits(dactivity)
+            for dtransaction in dactivity.transactions:
+                CalculateSplits.make_country_or_region_splits(
+                    dtransaction, country_splits
+                )
+                CalculateSplits.make_sector_splits(dtransaction, sector_splits)
+        stage.items = stage_items
+    with report.stage("activity_process") as stage:
+        flows = Flows()
+        transactions = Transactions()
+        counts = ProcessCounts()
+        for dactivity in dactivities:
+            process_activity(dactivity, flows, transactions, counts)
+        stage.items = stage_items
+    return report.to_dict()
+
+
+def get_stages(report):
+    """Stage results by stage name with the whole run as total"""
+    stages = {
+        stage["name"]: {
+            key: stage.get(key)
+            for key in ("wall_seconds", "items_per_second", "rss_growth_mb")
+        }
+        for stage in report["stages"]
+    }
+    growths = [stage["rss_growth_mb"] for stage in stages.values()]
+    stages["total"] = {
+        "wall_seconds": report["wall_seconds"],
+        "items_per_second": None,
+        "rss_growth_mb": None if None in growths else round(sum(growths), 1),
+    }
+    return stages
+
+
+def run(parameters, workers=1, cache_dir=None, offline=False, profile_dir=None):
+    Configuration._create(
+        hdx_read_only=True,
+        hdx_site="prod",
+        user_agent="benchmark",
+        project_config_yaml=CONFIGURATION_PATH,
+    )
+    configuration = Configuration.read()
+    if cache_dir:
+        reference_cache = ReferenceCache(cache_dir, offline=offline)
+    else:
+        reference_cache = None
+    with temp_dir("IATIBenchmark", delete_if_exists=True) as folder:
+        input_dir = make_input_dir(folder, parameters)
+        end_to_end, components = forked_process_map(
+            call,
+            [
+                (
+                    run_end_to_end,
+                    configuration,
+                    input_dir,
+                    join(folder, "end_to_end"),
+                    reference_cache,
+                    workers,
+                ),
+                (
+                    run_components,
+                    configuration,
+                    input_dir,
+                    join(folder, "components"),
+                    reference_cache,
+                    profile_dir,
+                ),
+            ],
+            1,
+        )
+    return {
+        "end_to_end": get_stages(end_to_end),
+        "components": get_stages(components),
+    }
+
+
+def compare(results, baseline, tolerance, min_seconds, min_mb=MIN_MB):
+    """Returns the regressions of the results against the baseline. Stages
+    taking less than min_seconds in the baseline are too noisy to compare
+    and memory growth is compared against at least min_mb."""
+    regressions = list()
+    for section, stages in results.items():
+        baseline_stages = baseline.get(section, dict())
+        for name, stage in stages.items():
+            baseline_stage = baseline_stages.get(name)
+            if baseline_stage is None:
+                continue
+            limit = 1 + tolerance
+            seconds = stage["wall_seconds"]
+            baseline_seconds = baseline_stage["wall_seconds"]
+            if baseline_seconds >= min_seconds and seconds > baseline_seconds * limit:
+                regressions.append(
+                    f"{section} {name} took {seconds:.2f}s against {baseline_seconds:.2f}s"
+                )
+            growth = stage["rss_growth_mb"]
+            baseline_growth = baseline_stage.get("rss_growth_mb")
+            if growth is None or baseline_growth is None:
+                continue
+            if growth > max(baseline_growth, min_mb) * limit:
+                regressions.append(
+                    f"{section} {name} grew memory by {growth:.0f}MB "
+                    f"against {baseline_growth:.0f}MB"
+                )
+    return regressions
+
+
+def print_results(results, baseline):
+    for section, stages in results.items():
+        print(f"{section}:")
+        baseline_stages = baseline.get(section, dict())
+        for name, stage in stages.items():
+            line = f"  {name:<24}{stage['wall_seconds']:>9.2f}s"
+            items_per_second = stage["items_per_second"]
+            if items_per_second is not None:
+                line += f"{items_per_second:>12.0f}/s"
+            else:
+                line += " " * 14
+            line += f"{stage['rss_growth_mb'] or 0:>+9.0f}MB"
+            baseline_stage = baseline_stages.get(name)
+            if baseline_stage:
+                line += f"  (baseline {baseline_stage['wall_seconds']:.2f}s"
+                line += f" {baseline_stage.get('rss_growth_mb') or 0:+.0f}MB)"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IATI pipeline benchmark")
+    parser.add_argument("--scale", default="small", choices=SCALES)
+    add_arguments(parser)
+    parser.add_argument("--workers", default=1, type=int)
+    parser.add_argument("--cache_dir", default=None, help="Reference data cache")
+    parser.add_argument("--offline", default=False, action="store_true")
+    parser.add_argument("--profile_dir", default=None, help="Profile components")
+    parser.add_argument("--tolerance", default=0.25, type=float)
+    parser.add_argument("--min_seconds", default=0.1, type=float)
+    parser.add_argument("--min_mb", default=MIN_MB, type=float)
+    parser.add_argument("--update", default=False, action="store_true")
+    parser.add_argument(
+        "--baselines", default=BASELINES_PATH, help="Baselines of this machine"
+    )
+    args = parser.parse_args()
+    parameters = get_kwargs(args, SCALES[args.scale])
+    key = args.scale if args.workers == 1 else f"{args.scale}_{args.workers}_workers"
+    try:
+        with open(args.baselines) as file:
+            baselines = json.load(file)
+    except FileNotFoundError:
+        baselines = dict()
+    baseline = baselines.get(key, dict())
+    if baseline and baseline["parameters"] != parameters:
+        print(f"Baseline {key} is for other parameters: {baseline['parameters']}")
+        baseline = dict()
+    if not baseline:
+        print(f"No baseline {key} in {args.baselines}. Generate one with --update")
+    results = run(
+        parameters, args.workers, args.cache_dir, args.offline, args.profile_dir
+    )
+    print(f"{key}: {parameters}")
+    print_results(results, baseline)
+    if args.update:
+        baselines[key] = {
+            "parameters": parameters,
+            "machine": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "processor": platform.machine(),
+            },
+            **results,
+        }
+        makedirs(dirname(abspath(args.baselines)), exist_ok=True)
+        with open(args.baselines, "w") as file:
+            json.dump(baselines, file, indent=2)
+            file.write("\n")
+        print(f"Updated baseline {key} in {args.baselines}")
+        return
+    regressions = compare(
+        results, baseline, args.tolerance, args.min_seconds, args.min_mb
+    )
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        main()
@@ -0,0 +1,212 @@
+"""Synthetic D-Portal XML at configurable scale
+
+Activities are generated with the shape of those D-Portal returns for the
+covid query: a COVID-19 title so that they pass the covid checks, reporting
+and participating orgs drawn from a pool of the given cardinality, and
+transactions with their own recipient countries or regions, sectors and
+provider and receiver orgs. Values are in USD so that no exchange rates need
+to be looked up. The same arguments and seed always give the same file.
+
+Run from the repository root with:
+python -m benchmarks.synthetic dportal.xml --activities 1000
+"""
+import argparse
+from random import Random
+from xml.sax.saxutils import escape
+
+# fmt: off
+# Countries and regions with humanitarian response plans or appeals
+COUNTRIES = (
+    "AF", "BF", "BI", "CD", "CF", "CM", "CO", "ET", "HN", "HT", "IQ", "LB",
+    "LY", "ML", "MM", "MZ", "NE", "NG", "PK", "PS", "SD", "SO", "SS", "SV",
+    "SY", "TD", "UA", "VE", "YE", "ZW", "BD", "KE", "UG", "TR", "JO",
+)
+REGIONS = ("289", "298", "498", "589", "619", "789", "998")
+# DAC 5 digit purpose codes across the sector groups
+SECTORS = (
+    "11220", "12191", "12220", "12240", "12250", "12262", "12264", "13020",
+    "14030", "15110", "15170", "16010", "16050", "23110", "31120", "31161",
+    "32130", "41010", "43060", "52010", "72010", "72040", "72050", "73010",
+    "74020", "99810",
+)
+ORG_TYPES = ("10", "21", "22", "23", "40", "60", "70", "80")
+# Disbursements and expenditure outnumber commitments and incoming funds
+TRANSACTION_TYPES = ("2", "3", "4", "3", "4", "1", "3", "4")
+WORDS = (
+    "response", "emergency", "health", "support", "community", "recovery",
+    "food", "water", "sanitation", "hygiene", "protection", "education",
+    "livelihoods", "shelter", "cash", "assistance", "vulnerable", "households",
+    "pandemic", "vaccine", "distribution", "capacity", "resilience", "district",
+    "programme", "project", "services", "children", "women", "displaced",
+    "refugees", "nutrition", "coordination", "logistics", "training", "rural",
+)
+# fmt: on
+
+
+class SyntheticActivities:
+    def __init__(
+        self,
+        no_activities=1000,
+        transactions_per_activity=10,
+        countries_per_transaction=2,
+        sectors_per_transaction=2,
+        no_orgs=200,
+        narrative_words=30,
+        seed=0,
+    ):
+        self.no_activities = no_activities
+        self.transactions_per_activity = transactions_per_activity
+        self.countries_per_transaction = countries_per_transaction
+        self.sectors_per_transaction = sectors_per_transaction
+        self.narrative_words = narrative_words
+        self.random = Random(seed)
+        self.orgs = [self.make_org(i) for i in range(no_orgs)]
+
+    def make_org(self, i):
+        """Every fifth org has no ref so that it is looked up by name"""
+        ref = "" if i % 5 == 4 else f"XM-SYNTH-{i:05d}"
+        name = " ".join(self.random.choices(WORDS, k=3)).title()
+        return ref, f"{name} {i}", self.random.choice(ORG_TYPES)
+
+    def get_narrative(self, no_words):
+        return escape(" ".join(self.random.choices(WORDS, k=no_words)))
+
+    def get_date(self):
+        return (
+            f"{self.random.randint(2020, 2022)}-{self.random.randint(1, 12):02d}-"
+            f"{self.random.randint(1, 28):02d}"
+        )
+
+    def get_org_element(self, tag, attributes=""):
+        ref, name, org_type = self.random.choice(self.orgs)
+        if ref:
+            attributes = f' ref="{ref}"{attributes}'
+        return (
+            f'<{tag}{attributes} type="{org_type}">'
+            f"<narrative>{escape(name)}</narrative></{tag}>"
+        )
+
+    def get_percentages(self, no_items):
+        percentage = round(100 / no_items, 2)
+        return [percentage] * no_items
+
+    def get_transaction(self):
+        random = self.random
+        date = self.get_date()
+        lines = [
+            "<transaction>",
+            f'<transaction-type code="{random.choice(TRANSACTION_TYPES)}"/>',
+            f'<transaction-date iso-date="{date}"/>',
+            f'<value currency="USD" value-date="{date}">'
+            f"{random.randint(1000, 5000000)}</value>",
+            f"<description><narrative>"
+            f"{self.get_narrative(max(self.narrative_words // 3, 1))}"
+            f"</narrative></description>",
+            self.get_org_element("provider-org"),
+            self.get_org_element("receiver-org"),
+        ]
+        no_countries = self.countries_per_transaction
+        if no_countries:
+            codes = random.sample(COUNTRIES + REGIONS, no_countries)
+            for code, percentage in zip(codes, self.get_percentages(no_countries)):
+                if code.isdigit():
+                    lines.append(
+                        f'<recipient-region code="{code}" vocabulary="1" '
+                        f'percentage="{percentage}"/>'
+                    )
+                else:
+                    lines.append(
+                        f'<recipient-country code="{code}" '
+                        f'percentage="{percentage}"/>'
+                    )
+        no_sectors = self.sectors_per_transaction
+        if no_sectors:
+            codes = random.sample(SECTORS, no_sectors)
+            for code, percentage in zip(codes, self.get_percentages(no_sectors)):
+                lines.append(
+                    f'<sector code="{code}" vocabulary="1" percentage="{percentage}"/>'
+                )
+        lines.append("</transaction>")
+        return "\n".join(lines)
+
+    def get_activity(self, i):
+        random = self.random
+        ref, name, org_type = random.choice(self.orgs)
+        reporting_ref = ref or f"XM-SYNTH-R{i % len(self.orgs):05d}"
+        humanitarian = random.choice(("0", "1"))
+        lines = [
+            f'<iati-activity default-currency="USD" hierarchy="1" '
+            f'humanitarian="{humanitarian}" '
+            f'last-updated-datetime="{self.get_date()}T12:00:00">',
+            f"<iati-identifier>{reporting_ref}-{i:07d}</iati-identifier>",
+            f'<reporting-org ref="{reporting_ref}" type="{org_type}">'
+            f"<narrative>{escape(name)}</narrative></reporting-org>",
+            f"<title><narrative>COVID-19 "
+            f"{self.get_narrative(max(self.narrative_words // 5, 1))}"
+            f"</narrative></title>",
+            f'<description type="1"><narrative>'
+            f"{self.get_narrative(self.narrative_words)}</narrative></description>",
+            self.get_org_element("participating-org", ' role="1"'),
+            self.get_org_element("participating-org", ' role="2"'),
+            self.get_org_element("participating-org", ' role="4"'),
+            '<activity-status code="2"/>',
+            '<activity-date iso-date="2020-03-01" type="1"/>',
+            '<activity-date iso-date="2020-03-15" type="2"/>',
+            '<activity-date iso-date="2023-12-31" type="3"/>',
+            '<default-flow-type code="10"/>',
+            '<default-finance-type code="110"/>',
+            '<default-aid-type code="C01" vocabulary="1"/>',
+        ]
+        for _ in range(self.transactions_per_activity):
+            lines.append(self.get_transaction())
+        lines.append("</iati-activity>")
+        return "\n".join(lines)
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            file.write('<iati-activities version="2.03">\n')
+            for i in range(self.no_activities):
+                file.write(self.get_activity(i))
+                file.write("\n")
+            file.write("</iati-activities>\n")
+
+
+def add_arguments(parser):
+    parser.add_argument("-a", "--activities", default=None, type=int)
+    parser.add_argument("-t", "--transactions", default=None, type=int)
+    parser.add_argument("-c", "--countries", default=None, type=int)
+    parser.add_argument("-s", "--sectors", default=None, type=int)
+    parser.add_argument("-o", "--orgs", default=None, type=int)
+    parser.add_argument("-w", "--words", default=None, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+
+
+def get_kwargs(args, kwargs=None):
+    """Keyword arguments of SyntheticActivities from the parsed arguments
+    overriding those given"""
+    kwargs = dict(kwargs or {})
+    for name, key in (
+        ("activities", "no_activities"),
+        ("transactions", "transactions_per_activity"),
+        ("countries", "countries_per_transaction"),
+        ("sectors", "sectors_per_transaction"),
+        ("orgs", "no_orgs"),
+        ("words", "narrative_words"),
+    ):
+        value = getattr(args, name)
+        if value is not None:
+            kwargs[key] = value
+    kwargs["seed"] = args.seed
+    return kwargs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic D-Portal XML")
+    parser.add_argument("path", help="Output XML file")
+    add_arguments(parser)
+    args = parser.parse_args()
+    SyntheticActivities(**get_kwargs(args)).write(args.path)
+
+
+if __name__ == "__main__":
+    main()
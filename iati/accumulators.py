@@ -0,0 +1,317 @@
+import pickle
+from array import array
+from heapq import merge
+from operator import itemgetter
+from sys import getsizeof
+from tempfile import TemporaryFile
+
+
+# Approximate bytes for the list and dict entries of a dictionary encoded value
+VALUE_OVERHEAD = 120
+# Number of rows pickled together in a sorted run file
+RUN_BATCH_SIZE = 1000
+
+
+class Flow:
+    __slots__ = ["row", "value", "values"]
+
+    def __init__(self, keep_values):
+        self.row = None
+        self.value = 0
+        self.values = list() if keep_values else None
+
+    def add(self, value):
+        self.value = self.value + value
+        if self.values is not None:
+            self.values.append(value)
+
+
+class Flows:
+    """Flows accumulator keyed by (reporting org name, provider name, receiver
+    name, humanitarian, strict, direction).
+
+    Accumulators built from different shards of activities are merged in
+    activity order. Float addition isn't associative so shard accumulators keep
+    the individual values which are replayed one by one into the merged totals,
+    giving the same totals as accumulating all activities in one place.
+    """
+
+    def __init__(self, keep_values=False):
+        self.keep_values = keep_values
+        self.flows = dict()
+
+    def __len__(self):
+        return len(self.flows)
+
+    def get(self, key):
+        flow = self.flows.get(key)
+        if flow is None:
+            flow = Flow(self.keep_values)
+            self.flows[key] = flow
+        return flow
+
+    def merge(self, other):
+        for key, other_flow in other.flows.items():
+            flow = self.get(key)
+            if flow.row is None:
+                flow.row = other_flow.row
+            for value in other_flow.values:
+                flow.add(value)
+
+    def get_rows(self):
+        return [
+            self.flows[key].row + [int(round(self.flows[key].value))]
+            for key in sorted(self.flows)
+        ]
+
+
+class DictionaryColumn:
+    """Column of dictionary encoded values. Each distinct value is held once and
+    rows hold its code."""
+
+    def __init__(self):
+        self.values = list()
+        self.index = dict()
+        self.codes = array("I")
+        self.values_size = 0
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+    def encode(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = len(self.values)
+            self.index[value] = code
+            self.values.append(value)
+            self.values_size += getsizeof(value) + VALUE_OVERHEAD
+        return code
+
+    def append(self, value):
+        self.codes.append(self.encode(value))
+
+    def extend(self, other):
+        codes = [self.encode(value) for value in other.values]
+        self.codes.extend(codes[code] for code in other.codes)
+
+    def get_sort_keys(self):
+        """Returns a key per row that orders rows as their values would"""
+        order = sorted(range(len(self.values)), key=self.values.__getitem__)
+        ranks = [0] * len(order)
+        for rank, code in enumerate(order):
+            ranks[code] = rank
+        return [ranks[code] for code in self.codes]
+
+    def get_size(self):
+        return self.values_size + self.codes.itemsize * len(self.codes)
+
+
+class IntColumn:
+    """Column of int64 values which falls back to a list if a value doesn't
+    fit"""
+
+    def __init__(self):
+        self.values = array("q")
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def append(self, value):
+        try:
+            self.values.append(value)
+        except (OverflowError, TypeError):
+            self.values = list(self.values)
+            self.values.append(value)
+
+    def extend(self, other):
+        if isinstance(self.values, array) and not isinstance(other.values, array):
+            self.values = list(self.values)
+        self.values.extend(other.values)
+
+    def get_sort_keys(self):
+        return self.values
+
+    def get_size(self):
+        if isinstance(self.values, array):
+            return self.values.itemsize * len(self.values)
+        return sum(getsizeof(value) + 8 for value in self.values)
+
+
+class Transactions:
+    """Columnar accumulator of split transaction rows (month, org id, org name,
+    org type, sector, country, humanitarian, strict, transaction type, activity
+    id, net money, total money).
+
+    Strings are dictionary encoded so each org, sector, country etc. is held
+    once however many rows refer to it.
+    """
+
+    int_columns = (6, 7, 10, 11)
+    # Rows are sorted by every column except org id and total money
+    sort_columns = (0, 2, 3, 4, 5, 6, 7, 8, 9, 10)
+
+    def __init__(self):
+        self.columns = [
+            IntColumn() if i in self.int_columns else DictionaryColumn()
+            for i in range(12)
+        ]
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def append(self, row):
+        for column, value in zip(self.columns, row):
+            column.append(value)
+
+    def extend(self, other):
+        for column, other_column in zip(self.columns, other.columns):
+            column.extend(other_column)
+
+    def get_row(self, i):
+        return [column[i] for column in self.columns]
+
+    def get_size(self):
+        """Returns an estimate of the memory used in bytes"""
+        return sum(column.get_size() for column in self.columns)
+
+    def get_sorted_order(self):
+        order = list(range(len(self.columns[0])))
+        try:
+            # Stable sorts from the least to the most significant column give
+            # the same order as sorting by a tuple of the columns
+            for i in reversed(self.sort_columns):
+                order.sort(key=self.columns[i].get_sort_keys().__getitem__)
+        except TypeError:
+            # Values in a column that can't all be compared with each other
+            # might still be compared row by row as before
+            columns = [self.columns[i] for i in self.sort_columns]
+            order = list(range(len(self.columns[0])))
+            order.sort(key=lambda j: tuple(column[j] for column in columns))
+        return order
+
+    def get_sorted_rows(self):
+        """Returns a lazy view of the rows in sorted order"""
+        return TransactionRows(self, memoryview(array("L", self.get_sorted_order())))
+
+
+class TransactionRows:
+    """Sequence of rows from a Transactions accumulator which are only built
+    when accessed"""
+
+    def __init__(self, transactions, order):
+        self.transactions = transactions
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return TransactionRows(self.transactions, self.order[i])
+        return self.transactions.get_row(self.order[i])
+
+    def __iter__(self):
+        get_row = self.transactions.get_row
+        for i in self.order:
+            yield get_row(i)
+
+
+class SpillingTransactions(Transactions):
+    """Transactions accumulator with bounded memory. Once the rows held exceed
+    max_rows or their estimated size exceeds max_bytes, they are sorted and
+    spilled to a temporary run file in spill_dir. The sorted rows are a k-way
+    merge of the runs with the rows still held.
+
+    Runs hold consecutive rows and the merge takes equal rows from earlier runs
+    first so the order is the same as sorting all the rows at once.
+    """
+
+    check_every = 1024
+
+    def __init__(self, max_rows=None, max_bytes=None, spill_dir=None):
+        super().__init__()
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.runs = list()
+        self.no_spilled_rows = 0
+
+    def __len__(self):
+        return self.no_spilled_rows + len(self.columns[0])
+
+    def is_over_budget(self):
+        no_rows = len(self.columns[0])
+        if self.max_rows and no_rows >= self.max_rows:
+            return True
+        if self.max_bytes and self.get_size() >= self.max_bytes:
+            return True
+        return False
+
+    def append(self, row):
+        super().append(row)
+        # Estimating the size takes longer than appending so is done every so
+        # often
+        no_rows = len(self.columns[0])
+        if self.max_rows and no_rows >= self.max_rows:
+            self.spill()
+        elif self.max_bytes and no_rows % self.check_every == 0:
+            if self.get_size() >= self.max_bytes:
+                self.spill()
+
+    def extend(self, other):
+        super().extend(other)
+        if self.is_over_budget():
+            self.spill()
+
+    def spill(self):
+        run = TemporaryFile(dir=self.spill_dir)
+        rows = super().get_sorted_rows()
+        for start in range(0, len(rows), RUN_BATCH_SIZE):
+            batch = list(rows[start : start + RUN_BATCH_SIZE])
+            pickle.dump(batch, run, pickle.HIGHEST_PROTOCOL)
+        self.runs.append(run)
+        self.no_spilled_rows += len(rows)
+        del rows
+        self.columns = Transactions().columns
+
+    @staticmethod
+    def read_run(run):
+        run.seek(0)
+        try:
+            while True:
+                yield from pickle.load(run)
+        except EOFError:
+            pass
+        run.close()
+
+    def get_sorted_rows(self):
+        """Returns the rows in sorted order. If rows were spilled, they can only
+        be iterated once."""
+        if not self.runs:
+            return super().get_sorted_rows()
+        iterables = [self.read_run(run) for run in self.runs]
+        iterables.append(super().get_sorted_rows())
+        self.runs = list()
+        return MergedRows(
+            merge(*iterables, key=itemgetter(*self.sort_columns)), len(self)
+        )
+
+
+class MergedRows:
+    """Iterable of merged sorted rows of known length"""
+
+    def __init__(self, rows, no_rows):
+        self.rows = rows
+        self.no_rows = no_rows
+
+    def __len__(self):
+        return self.no_rows
+
+    def __iter__(self):
+        return self.rows
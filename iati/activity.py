@@ -103,10 +103,10 @@ class Activity:
                 transaction.get_direction(),
             )
             # ignore internal transactions or unknown reporting orgs
-            cur_output = out_flows.get(key, dict())
-            cur_output["value"] = cur_output.get("value", 0) + transaction.usd_value
-            if "row" not in cur_output:
-                cur_output["row"] = [
+            cur_output = out_flows.get(key)
+            cur_output.add(transaction.usd_value)
+            if cur_output.row is None:
+                cur_output.row = [
                     self.org["id"],
                     self.org["name"],
                     self.org["type"],
@@ -120,7 +120,6 @@ class Activity:
                     transaction.is_strict,
                     transaction.get_direction(),
                 ]
-            out_flows[key] = cur_output
 
     def generate_split_transactions(self, out_transactions, transaction):
         # Make the splits for the transaction (default to activity splits)
@@ -131,51 +130,61 @@ class Activity:
             self.sector_splits
         )
 
-        # Apply the country and sector percentage splits to the transaction
-        # generate multiple split transactions
-        for country, country_percentage in country_splits.items():
-            for sector, sector_percentage in sector_splits.items():
+        # Apply the sector exclusions and look up names once per sector and
+        # country rather than once per split
+        is_strict = transaction.is_strict
+        exclude_split_transaction = Lookups.checks.exclude_split_transaction
+        get_sector_group_name = Lookups.sector_lookups.get_sector_group_name
+        sector_rows = [
+            (get_sector_group_name(sector), sector_percentage)
+            for sector, sector_percentage in sector_splits.items()
+            if not exclude_split_transaction(is_strict, sector, vocabulary_code)
+        ]
+        if not sector_rows:
+            return
+        country_rows = [
+            (Lookups.get_country_region_name(country), country_percentage)
+            for country, country_percentage in country_splits.items()
+        ]
+        month = transaction.transaction_date.strftime("%Y-%m")
+        org_id = self.org["id"]
+        org_name = self.org["name"]
+        org_type = self.org["type"]
+        is_humanitarian = transaction.is_humanitarian
+        classification = transaction.get_classification()
+        identifier = self.identifier
+        usd_value = transaction.usd_value
+        net_value = transaction.net_value
 
-                if Lookups.checks.exclude_split_transaction(
-                    transaction.is_strict, sector, vocabulary_code
-                ):
+        # Apply the country and sector percentage splits to the transaction
+        # generate multiple split transactions. The country percentage is
+        # applied first as before so that rounding is unchanged.
+        append = out_transactions.append
+        for country_name, country_percentage in country_rows:
+            usd_country_value = usd_value * country_percentage
+            net_country_value = net_value * country_percentage
+            for sector_name, sector_percentage in sector_rows:
+                total_money = int(round(usd_country_value * sector_percentage))
+                if total_money == 0:
                     continue
-                sector_name = Lookups.sector_lookups.get_sector_group_name(sector)
-                country_name = Lookups.get_country_region_name(country)
-
-                #
-                # Add to transactions
-                #
-
-                total_money = int(
-                    round(
-                        transaction.usd_value * country_percentage * sector_percentage
-                    )
+                net_money = int(round(net_country_value * sector_percentage))
+                # add to transactions
+                append(
+                    [
+                        month,
+                        org_id,
+                        org_name,
+                        org_type,
+                        sector_name,
+                        country_name,
+                        is_humanitarian,
+                        is_strict,
+                        classification,
+                        identifier,
+                        net_money,
+                        total_money,
+                    ]
                 )
-                net_money = int(
-                    round(
-                        transaction.net_value * country_percentage * sector_percentage
-                    )
-                )
-
-                if total_money != 0:
-                    # add to transactions
-                    out_transactions.append(
-                        [
-                            transaction.transaction_date.strftime("%Y-%m"),
-                            self.org["id"],
-                            self.org["name"],
-                            self.org["type"],
-                            sector_name,
-                            country_name,
-                            transaction.is_humanitarian,
-                            transaction.is_strict,
-                            transaction.get_classification(),
-                            self.identifier,
-                            net_money,
-                            total_money,
-                        ]
-                    )
 
     def get_funder_implementer(self):
         funder = None
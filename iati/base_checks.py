@@ -1,7 +1,12 @@
 from .exclusions import Exclusions
+from .keywordmatcher import KeywordMatcher
 
 
 class BaseChecks(Exclusions):
+    def __init__(self, today, start_date, errors_on_exit):
+        super().__init__(today, start_date, errors_on_exit)
+        self.desired_words = KeywordMatcher()
+
     # Prefilters either full activities and transactions that cannot be valued
     # Does not filter transactions oteh than those that cannot be valued as that must
     # happen after factoring new money
@@ -18,6 +23,24 @@ class BaseChecks(Exclusions):
                 do_checks = False
         return self._exclude_activity(do_checks, dactivity)
 
+    def is_theme_activity(self, dactivity):
+        """Check, without the theme's D-Portal query, if an activity from a
+        local file belongs to the theme. This only approximates the query.
+        Themes whose prefiltering checks for relevant sectors, countries or
+        text leave it to prefiltering. Otherwise the activity or one of its
+        transactions must be strict."""
+        if self.relevant_sectors or self.relevant_countries or self.relevant_words:
+            return True
+        activity_is_strict = self.get_activity_is_strict(dactivity)
+        if activity_is_strict:
+            return True
+        for dtransaction in dactivity.transactions:
+            if self.get_transaction_is_strict(
+                dactivity, activity_is_strict, dtransaction
+            ):
+                return True
+        return False
+
     def has_desired_scope(self, dactivity):
         return False
 
@@ -59,7 +82,9 @@ class BaseChecks(Exclusions):
         return False
 
     def has_desired_text(self, narrativetext):
-        return False
+        """Check a dict of different-language text for any of the desired words
+        (case-insensitive)"""
+        return self.desired_words.matches(narrativetext)
 
     def should_skip_transaction(self, dactivity, dtransaction, transaction_date):
         if not self.is_date_in_range(transaction_date):
@@ -1,20 +1,52 @@
 class BaseSectorLookups:
-    def __init__(self, retriever, configuration, sector_data="default"):
+    # Vocabulary used when any sector of an activity or transaction has it and
+    # the vocabulary used otherwise. Prefer 3-digit codes to 5-digit.
+    preferred_vocabulary = "2"
+    other_vocabulary = "1"
+
+    def __init__(self, retriever, configuration, sector_data="default", cache=None):
         self.default_sector = configuration["default_sector"]
-        sector_info = retriever.download_json(configuration["sector_data"][sector_data])
-        self.sector_info = sector_info
+        url = configuration["sector_data"][sector_data]
+        if cache is None:
+            self.sector_info = self.read_sector_info(retriever, url)
+        else:
+            self.sector_info = cache.load(
+                f"sectors_{sector_data}",
+                (url,),
+                lambda: self.read_sector_info(retriever, url),
+            )
+        self.sector_group_names = self.build_sector_group_names()
+
+    @staticmethod
+    def read_sector_info(retriever, url):
+        return retriever.download_json(url)
+
+    def build_sector_group_names(self):
+        """Map from sector codes to group names. Codes of more than 3 digits
+        are added as they are looked up."""
+        return {
+            code: info["dac-group"]
+            for code, info in self.sector_info.items()
+            if len(code) <= 3
+        }
+
+    def resolve_sector_group_name(self, code):
+        info = self.sector_info.get(code[:3])
+        if info is None:
+            return self.default_sector
+        return info["dac-group"]
 
     def get_sector_group_name(self, code):
         """Look up a group name for a 3- or 5-digit sector code."""
-        code = code[:3]
-        if code in self.sector_info:
-            return self.sector_info[code]["dac-group"]
-        else:
-            return self.default_sector
+        name = self.sector_group_names.get(code)
+        if name is None:
+            name = self.resolve_sector_group_name(code)
+            self.sector_group_names[code] = name
+        return name
 
-    @staticmethod
-    def get_vocabulary_code(sectors):
-        # Prefer 3-digit codes to 5-digit
-        if "2" in [sector.vocabulary for sector in sectors]:
-            return "2"
-        return "1"
+    def get_vocabulary_code(self, sectors):
+        preferred_vocabulary = self.preferred_vocabulary
+        for sector in sectors:
+            if sector.vocabulary == preferred_vocabulary:
+                return preferred_vocabulary
+        return self.other_vocabulary
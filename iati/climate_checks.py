@@ -2,6 +2,12 @@ from .base_checks import BaseChecks
 
 
 class ClimateChecks(BaseChecks):
+    def __init__(self, today, start_date, errors_on_exit):
+        super().__init__(today, start_date, errors_on_exit)
+
+        # Check for the string "climate finance" in text
+        self.desired_words.add("climate finance")
+
     def has_desired_marker(self, dactivity):
         for marker in dactivity.policy_markers:
             if marker.vocabulary != "1":
@@ -11,10 +17,3 @@ class ClimateChecks(BaseChecks):
             if marker.significance in ("1", "2", "3", "4"):
                 return True
         return False
-
-    def has_desired_text(self, narrativetext):
-        """Check a dict of different-language text for the string "climate finance" (case-insensitive)"""
-        for lang, text in narrativetext.narratives.items():
-            if "climate finance" in text.lower():
-                return True
-        return False
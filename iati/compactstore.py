@@ -0,0 +1,238 @@
+"""Compact on-disk store for prefiltered small activities
+
+Each record holds only the fields that SmallDActivity and SmallDTransaction
+carry, encoded as plain tuples so they can be pickled and streamed back without
+rebuilding DOM nodes. Transaction sectors, countries and regions identical to
+those of their activity are stored once, at activity level.
+"""
+import pickle
+from collections import deque
+
+from .smallcodeditem import SmallCodedItem
+from .smalldactivity import SmallDActivity
+from .smalldtransaction import SmallDTransaction
+from .smallnarrativetext import SmallNarrativeText
+from .smallorganisation import SmallOrganisation
+
+MAGIC = b"IATICOMPACT1\n"
+INHERITED = None
+
+
+def encode_narrative(narrativetext):
+    if narrativetext is None:
+        return None
+    return narrativetext.defaulttext, narrativetext.narratives
+
+
+def decode_narrative(record):
+    if record is None:
+        return None
+    narrativetext = SmallNarrativeText.__new__(SmallNarrativeText)
+    narrativetext.defaulttext, narrativetext.narratives = record
+    return narrativetext
+
+
+def encode_coded_items(items):
+    return tuple(
+        (item.code, item.type, item.vocabulary, item.percentage) for item in items
+    )
+
+
+def decode_coded_items(record):
+    return [SmallCodedItem.get(*item) for item in record]
+
+
+def encode_organisation(org):
+    if org is None:
+        return None
+    return encode_narrative(org.name), org.ref, org.role, org.type
+
+
+def decode_organisation(record):
+    if record is None:
+        return None
+    name, ref, role, org_type = record
+    return SmallOrganisation(decode_narrative(name), ref, role, org_type)
+
+
+def encode_inheritable(items, activity_record):
+    record = encode_coded_items(items)
+    if record == activity_record:
+        return INHERITED
+    return record
+
+
+def decode_inheritable(record, activity_items):
+    if record is INHERITED:
+        return activity_items
+    return decode_coded_items(record)
+
+
+def encode_transaction(dtransaction, activity_records):
+    sectors, countries, regions = activity_records
+    return (
+        dtransaction.transaction_date,
+        dtransaction.type,
+        dtransaction.valuation_date,
+        dtransaction.currency,
+        dtransaction.value,
+        dtransaction.humanitarian,
+        encode_inheritable(dtransaction.sectors, sectors),
+        dtransaction.is_strict,
+        encode_organisation(dtransaction.provider_org),
+        encode_organisation(dtransaction.receiver_org),
+        encode_inheritable(dtransaction.recipient_countries, countries),
+        encode_inheritable(dtransaction.recipient_regions, regions),
+        dtransaction.should_skip_transaction,
+    )
+
+
+def decode_transaction(record, dactivity):
+    dtransaction = SmallDTransaction.__new__(SmallDTransaction)
+    (
+        dtransaction.transaction_date,
+        dtransaction.type,
+        dtransaction.valuation_date,
+        dtransaction.currency,
+        dtransaction.value,
+        dtransaction.humanitarian,
+        sectors,
+        dtransaction.is_strict,
+        provider_org,
+        receiver_org,
+        countries,
+        regions,
+        dtransaction.should_skip_transaction,
+    ) = record
+    dtransaction.sectors = decode_inheritable(sectors, dactivity.sectors)
+    dtransaction.provider_org = decode_organisation(provider_org)
+    dtransaction.receiver_org = decode_organisation(receiver_org)
+    dtransaction.recipient_countries = decode_inheritable(
+        countries, dactivity.recipient_countries
+    )
+    dtransaction.recipient_regions = decode_inheritable(
+        regions, dactivity.recipient_regions
+    )
+    return dtransaction
+
+
+def encode_activity(dactivity):
+    sectors = encode_coded_items(dactivity.sectors)
+    countries = encode_coded_items(dactivity.recipient_countries)
+    regions = encode_coded_items(dactivity.recipient_regions)
+    activity_records = (sectors, countries, regions)
+    return (
+        dactivity.identifier,
+        encode_organisation(dactivity.reporting_org),
+        sectors,
+        dactivity.humanitarian,
+        countries,
+        regions,
+        tuple(encode_organisation(org) for org in dactivity.participating_orgs),
+        tuple(
+            encode_transaction(dtransaction, activity_records)
+            for dtransaction in dactivity.transactions
+        ),
+    )
+
+
+def decode_activity(record):
+    dactivity = SmallDActivity.__new__(SmallDActivity)
+    (
+        dactivity.identifier,
+        reporting_org,
+        sectors,
+        dactivity.humanitarian,
+        countries,
+        regions,
+        participating_orgs,
+        transactions,
+    ) = record
+    dactivity.reporting_org = decode_organisation(reporting_org)
+    dactivity.sectors = decode_coded_items(sectors)
+    dactivity.recipient_countries = decode_coded_items(countries)
+    dactivity.recipient_regions = decode_coded_items(regions)
+    dactivity.participating_orgs = [
+        decode_organisation(org) for org in participating_orgs
+    ]
+    # Same grouping as diterator's Activity.participating_orgs_by_role
+    participating_orgs_by_role = dict()
+    for org in dactivity.participating_orgs:
+        participating_orgs_by_role.setdefault(org.role, []).append(org)
+    dactivity.participating_orgs_by_role = participating_orgs_by_role
+    dactivity.transactions = [
+        decode_transaction(transaction, dactivity) for transaction in transactions
+    ]
+    return dactivity
+
+
+class CompactWriter:
+    """Appends small activities to a compact store file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.no_activities = 0
+
+    def write(self, dactivity):
+        # Each record is pickled independently so it can be read back in turn
+        pickle.dump(encode_activity(dactivity), self.file, pickle.HIGHEST_PROTOCOL)
+        self.no_activities += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CompactReader:
+    """Streams small activities back from a compact store file. Each
+    iteration rereads the file from the start."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def records(self):
+        with open(self.path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a compact activity store!")
+            while True:
+                try:
+                    yield pickle.load(file)
+                except EOFError:
+                    return
+
+    def __iter__(self):
+        for record in self.records():
+            yield decode_activity(record)
+
+    def activities(self):
+        return iter(self)
+
+
+class MemoryStore:
+    """Keeps small activities in memory in place of a compact store file.
+    Iterating leaves the store intact while activities and records hand over
+    each activity, releasing it from the store."""
+
+    def __init__(self):
+        self.dactivities = deque()
+
+    def write(self, dactivity):
+        self.dactivities.append(dactivity)
+
+    def __iter__(self):
+        return iter(self.dactivities)
+
+    def activities(self):
+        while self.dactivities:
+            yield self.dactivities.popleft()
+
+    def records(self):
+        for dactivity in self.activities():
+            yield encode_activity(dactivity)
@@ -33,16 +33,12 @@ class CovidChecks(BaseChecks):
 
         self.add_tag_check(check_tag)
 
+        # Check for the string "COVID-19" in text
+        self.desired_words.add("covid-19")
+
     def has_desired_sector(self, dactivity):
         """Check if the DAC COVID-19 sector code is present"""
         for sector in dactivity.sectors:
             if sector.vocabulary == "1" and sector.code == "12264":
                 return True
         return False
-
-    def has_desired_text(self, narrativetext):
-        """Check a dict of different-language text for the string "COVID-19" (case-insensitive)"""
-        for lang, text in narrativetext.narratives.items():
-            if "covid-19" in text.lower():
-                return True
-        return False
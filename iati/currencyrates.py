@@ -0,0 +1,155 @@
+"""Historic currency conversion through Currency
+
+Transactions are valued with Currency.get_historic_value_in_usd so that its
+fallbacks are kept: primary historic, then secondary historic, then current
+rates which may in turn fall back on the static file. Currency already keeps
+each primary rate it finds, and a rate it fell back to is looked up again on
+the next call, so rates are not memoized here.
+
+Currency is only set up with Currency.setup. Its secondary current and historic
+rates files, whose urls are configured, are first downloaded to local files,
+which a reference cache keeps between runs, and Currency.setup is given those
+files instead of the urls so that it can be set up again cheaply with another
+retriever. With a reference cache, everything Currency reads, including each
+primary rate, is saved to a folder in the cache. Starting offline, Currency
+reads only from that folder so no rates are looked up online and a rate that
+was never saved is an error.
+"""
+import logging
+from os import makedirs
+from os.path import abspath, exists, join
+from pathlib import Path
+
+from hdx.location.currency import Currency, CurrencyError
+from hdx.utilities.downloader import DownloadError
+from hdx.utilities.retriever import Retrieve
+
+from .referencecache import get_source_key
+
+logger = logging.getLogger(__name__)
+
+# Configuration key, which is also the Currency.setup url parameter, filename
+# and description of each secondary rates file
+SECONDARY_RATES = (
+    ("secondary_rates_url", "secondary_rates.json", "secondary current exchange rates"),
+    (
+        "secondary_historic_url",
+        "historic_rates.csv",
+        "secondary historic exchange rates",
+    ),
+)
+# Folder of the files Currency reads, in the temporary folder when downloading
+# the secondary rates and in the reference cache when saving everything
+CURRENCY_FOLDER = "currency_rates"
+
+
+class CurrencyRates:
+    # Reference cache which saves what Currency reads
+    cache = None
+    # Currency.setup argument of each secondary rates file ie. the file url of
+    # its local copy or its url if it could not be downloaded
+    secondary_rates_urls = dict()
+    # Contents hash of each local copy of the secondary rates or its url
+    sources = tuple()
+
+    @staticmethod
+    def download_secondary_rates(retriever, url, filename, logstr):
+        """Returns the path of a local copy of secondary rates or None if they
+        could not be downloaded. They are downloaded to a folder of their own
+        so that Currency.setup never overwrites the file it is reading."""
+        folder = join(retriever.temp_dir, CURRENCY_FOLDER)
+        makedirs(folder, exist_ok=True)
+        secondary_retriever = Retrieve(
+            retriever.downloader,
+            retriever.fallback_dir,
+            retriever.saved_dir,
+            folder,
+            save=False,
+            use_saved=retriever.use_saved,
+            delete=False,
+        )
+        try:
+            return secondary_retriever.download_file(url, filename, logstr)
+        except (DownloadError, OSError):
+            logger.exception(f"Error downloading {logstr}!")
+            return None
+
+    @classmethod
+    def get_currency_retriever(cls, retriever):
+        """Returns the retriever Currency reads with. With a reference cache,
+        it saves what it reads to a folder in the cache or, offline, reads only
+        from that folder."""
+        if cls.cache is None or retriever.use_saved:
+            return retriever
+        folder = join(cls.cache.cache_dir, CURRENCY_FOLDER)
+        offline = cls.cache.offline
+        if offline:
+            for _, filename, logstr in SECONDARY_RATES:
+                if not exists(join(folder, filename)):
+                    raise FileNotFoundError(
+                        f"No cached {logstr} in {folder} to run offline!"
+                    )
+        makedirs(folder, exist_ok=True)
+        return Retrieve(
+            retriever.downloader,
+            retriever.fallback_dir,
+            folder,
+            retriever.temp_dir,
+            save=not offline,
+            use_saved=offline,
+            delete=False,
+        )
+
+    @classmethod
+    def setup_currency(cls, retriever, configuration, cache=None):
+        """Set up Currency falling back from historic to current to static rates
+        from local copies of the secondary rates at the urls in the lookups
+        configuration which, with a reference cache, are taken from it if they
+        were cached"""
+        cls.cache = cache
+        secondary_rates_urls = dict()
+        sources = list()
+        for argument, filename, logstr in SECONDARY_RATES:
+            url = configuration[argument]
+
+            def download():
+                return cls.download_secondary_rates(retriever, url, filename, logstr)
+
+            if cache is None:
+                path = download()
+            else:
+                path = cache.load_file(f"currency_{filename}", (url,), download)
+            if path is None:
+                secondary_rates_urls[argument] = url
+                sources.append(url)
+            else:
+                secondary_rates_urls[argument] = Path(abspath(path)).as_uri()
+                sources.append(get_source_key(path))
+        cls.secondary_rates_urls = secondary_rates_urls
+        cls.sources = tuple(sources)
+        cls.set_retriever(retriever)
+
+    @classmethod
+    def set_retriever(cls, retriever):
+        """Set up Currency again from the local copies of its secondary rates to
+        look up primary rates with retriever"""
+        Currency.setup(
+            retriever=cls.get_currency_retriever(retriever),
+            fallback_historic_to_current=True,
+            fallback_current_to_static=True,
+            **cls.secondary_rates_urls,
+        )
+
+    @classmethod
+    def get_historic_value_in_usd(cls, value, currency, date):
+        """USD value of the value in local currency on a date. Offline, a rate
+        that was never saved is a CurrencyError like any other missing rate."""
+        try:
+            return Currency.get_historic_value_in_usd(value, currency, date)
+        except FileNotFoundError:
+            if cls.cache is None or not cls.cache.offline:
+                raise
+            raise CurrencyError(
+                f"No cached rate for currency {currency} on date "
+                f"{date.isoformat()} to run offline!"
+            )
@@ -0,0 +1,141 @@
+"""Paginated D-Portal download
+
+The activities of a D-Portal query are downloaded a page at a time by
+wrapping the query in the configured page query which adds LIMIT and OFFSET.
+Each page is a complete D-Portal XML file which is checkpointed once it has
+been fully downloaded so that a failed download resumes from the first page
+that is missing. A manifest of the query and page size the pages were
+downloaded for is kept with them and pages for any other query, which includes
+the D-Portal parameters and incremental cutoff, or page size are discarded
+rather than resumed from. Pages are handed on as soon as they arrive while the next page
+is downloaded in the background.
+"""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from os import makedirs, remove, replace
+from os.path import exists, join, splitext
+from shutil import copyfile
+from urllib.parse import quote
+
+from .prefilter import ACTIVITY_START
+
+logger = logging.getLogger(__name__)
+
+
+def count_activities(path):
+    with open(path, "rb") as file:
+        return len(ACTIVITY_START.findall(file.read()))
+
+
+class DPortalPages:
+    """Iterating yields the path of each page of the query's activities in
+    turn. The pages are kept in the checkpoint folder until removed."""
+
+    def __init__(
+        self, retriever, url, query, page_query, page_size, filename, checkpoint_dir
+    ):
+        self.retriever = retriever
+        self.url = url
+        self.query = query
+        self.page_query = page_query
+        self.page_size = page_size
+        self.filename_root, self.filename_extension = splitext(filename)
+        self.checkpoint_dir = checkpoint_dir
+        self.paths = list()
+
+    def get_filename(self, page):
+        return f"{self.filename_root}_{page:05d}{self.filename_extension}"
+
+    def get_manifest_path(self):
+        return join(self.checkpoint_dir, f"{self.filename_root}_manifest.json")
+
+    def get_manifest(self):
+        return {
+            "url": self.url,
+            "query": self.query,
+            "page_query": self.page_query,
+            "page_size": self.page_size,
+        }
+
+    def get_checkpointed_paths(self):
+        pattern = f"{self.filename_root}_*{self.filename_extension}"
+        return glob(join(self.checkpoint_dir, pattern))
+
+    def check_manifest(self):
+        """Discards checkpointed pages unless they were downloaded for the same
+        query and page size and records the query and page size of the pages"""
+        manifest = self.get_manifest()
+        manifest_path = self.get_manifest_path()
+        try:
+            with open(manifest_path) as file:
+                checkpointed_manifest = json.load(file)
+        except (FileNotFoundError, ValueError):
+            checkpointed_manifest = None
+        if checkpointed_manifest == manifest:
+            return
+        if self.get_checkpointed_paths():
+            logger.warning(
+                f"Discarding D-Portal activities pages in {self.checkpoint_dir} "
+                "downloaded for a different query or page size"
+            )
+            self.remove()
+        with open(manifest_path, "w") as file:
+            json.dump(manifest, file, indent=2)
+
+    def get_url(self, page):
+        query = self.page_query.format(
+            self.query, self.page_size, page * self.page_size
+        )
+        return self.url % quote(query)
+
+    def download_page(self, page):
+        """Returns the path of the page and the number of activities in it,
+        downloading it unless it was checkpointed"""
+        filename = self.get_filename(page)
+        if self.retriever.use_saved:
+            path = join(self.retriever.saved_dir, filename)
+            logger.info(f"Using saved D-Portal activities page {page} in {path}")
+            return path, count_activities(path)
+        path = join(self.checkpoint_dir, filename)
+        if exists(path):
+            logger.info(f"Using checkpointed D-Portal activities page {page}")
+            return path, count_activities(path)
+        logger.info(f"Downloading D-Portal activities page {page} into {path}")
+        # Pages are only renamed into place once complete
+        temp_path = f"{path}.part"
+        self.retriever.downloader.download_file(
+            self.get_url(page), path=temp_path, overwrite=True
+        )
+        replace(temp_path, path)
+        if self.retriever.save:
+            copyfile(path, join(self.retriever.saved_dir, filename))
+        return path, count_activities(path)
+
+    def __iter__(self):
+        makedirs(self.checkpoint_dir, exist_ok=True)
+        if not self.retriever.use_saved:
+            self.check_manifest()
+        self.paths = list()
+        with ThreadPoolExecutor(1) as executor:
+            page = 0
+            future = executor.submit(self.download_page, page)
+            while future:
+                path, no_activities = future.result()
+                # A page that isn't full is the last one
+                if no_activities < self.page_size:
+                    future = None
+                else:
+                    page += 1
+                    future = executor.submit(self.download_page, page)
+                self.paths.append(path)
+                yield path
+
+    def remove(self):
+        """Removes the checkpointed pages and their manifest"""
+        for path in self.get_checkpointed_paths():
+            remove(path)
+        manifest_path = self.get_manifest_path()
+        if exists(manifest_path):
+            remove(manifest_path)
@@ -18,9 +18,5 @@ class EbolaChecks(BaseChecks):
 
         self.add_scope_check(check_scope)
 
-    def has_desired_text(self, narrativetext):
-        """Check a dict of different-language text for the string "EBOLA" (case-insensitive)"""
-        for lang, text in narrativetext.narratives.items():
-            if "ebola" in text.lower():
-                return True
-        return False
+        # Check for the string "EBOLA" in text
+        self.desired_words.add("ebola")
@@ -0,0 +1,160 @@
+import logging
+from os.path import exists, join
+
+import hxl
+from hdx.utilities.loader import load_json
+from hdx.utilities.saver import save_json
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILENAME = "exclusions.json"
+IDENTIFIER_SETS = (
+    "skip_activities",
+    "skip_reporting_orgs",
+    "allow_activities",
+    "org_ref_spurious",
+)
+
+
+class IdentifierSet:
+    """Hashed set of identifiers, which are matched exactly even if they end
+    in *, and of prefixes that each match a family of identifiers eg. the
+    prefix XM-DAC-41 matches XM-DAC-41114"""
+
+    def __init__(self, identifiers=tuple(), prefixes=tuple()):
+        self.identifiers = set(identifiers)
+        self.prefixes = set()
+        self.prefix_lengths = tuple()
+        for prefix in prefixes:
+            self.add_prefix(prefix)
+
+    def add(self, identifier):
+        self.identifiers.add(identifier)
+
+    def add_prefix(self, prefix):
+        self.prefixes.add(prefix)
+        self.prefix_lengths = tuple(sorted({len(prefix) for prefix in self.prefixes}))
+
+    def __contains__(self, identifier):
+        if identifier in self.identifiers:
+            return True
+        if not self.prefixes or not isinstance(identifier, str):
+            return False
+        for length in self.prefix_lengths:
+            if identifier[:length] in self.prefixes:
+                return True
+        return False
+
+    def __len__(self):
+        return len(self.identifiers) + len(self.prefixes)
+
+    def __iter__(self):
+        """Iterates over the identifiers but not the prefixes"""
+        yield from sorted(self.identifiers)
+
+    def get_prefixes(self):
+        return sorted(self.prefixes)
+
+
+class ExclusionRegistry:
+    """Indexed activities and orgs to skip, activities to allow over the
+    threshold and spurious org refs from the three HXL sheets"""
+
+    def __init__(self):
+        self.skip_activities = IdentifierSet()
+        self.skip_reporting_orgs = IdentifierSet()
+        self.skip_reporting_orgs_children = dict()
+        self.allow_activities = IdentifierSet()
+        self.org_ref_spurious = IdentifierSet()
+
+    @staticmethod
+    def add_row(row, tag, identifier_set, name):
+        """Adds the identifier in the row's column with the tag and the prefix
+        in its column with the tag and the +prefix attribute. Prefixes are
+        logged as each matches a family of identifiers."""
+        identifier = row.get(f"{tag}-prefix")
+        if identifier:
+            identifier_set.add(identifier)
+        prefix = row.get(f"{tag}+prefix")
+        if prefix:
+            logger.info(f"Using {name} prefix {prefix}")
+            identifier_set.add_prefix(prefix)
+
+    def read_sheets(self, configuration):
+        for row in hxl.data(configuration["skipped_url"]):
+            self.add_row(
+                row, "#activity+code", self.skip_activities, "skipped activity"
+            )
+            self.add_row(
+                row,
+                "#org+reporting+id",
+                self.skip_reporting_orgs,
+                "skipped reporting org",
+            )
+            org_id = row.get("#org+reporting_children+id")
+            hierarchy = row.get("#org+reporting_children+hierarchy")
+            if org_id and hierarchy:
+                self.skip_reporting_orgs_children[org_id] = hierarchy
+        for row in hxl.data(configuration["allowed_url"]):
+            self.add_row(
+                row, "#activity+code", self.allow_activities, "allowed activity"
+            )
+        for row in hxl.data(configuration["spurious_url"]):
+            self.add_row(
+                row, "#org+reporting+id", self.org_ref_spurious, "spurious org ref"
+            )
+
+    def get_snapshot(self):
+        snapshot = {
+            "skip_reporting_orgs_children": self.skip_reporting_orgs_children,
+        }
+        for name in IDENTIFIER_SETS:
+            identifier_set = getattr(self, name)
+            snapshot[name] = list(identifier_set)
+            snapshot[f"{name}_prefixes"] = identifier_set.get_prefixes()
+        return snapshot
+
+    def set_snapshot(self, snapshot):
+        self.skip_reporting_orgs_children = snapshot["skip_reporting_orgs_children"]
+        for name in IDENTIFIER_SETS:
+            # Snapshots saved before prefixes were added have none
+            identifier_set = IdentifierSet(
+                snapshot[name], snapshot.get(f"{name}_prefixes", tuple())
+            )
+            setattr(self, name, identifier_set)
+
+    @classmethod
+    def read(cls, configuration, retriever=None, cache=None):
+        """Read the HXL sheets once. If the retriever is using saved data and a
+        snapshot of the sheets was saved, it is used instead. Otherwise, the
+        snapshot is taken from the reference cache if one is given. If the
+        retriever is saving data, a snapshot is saved."""
+        registry = cls()
+        snapshot_path = None
+        if retriever is not None:
+            snapshot_path = join(retriever.saved_dir, SNAPSHOT_FILENAME)
+            if retriever.use_saved and exists(snapshot_path):
+                logger.info(f"Using saved exclusions from {snapshot_path}")
+                registry.set_snapshot(load_json(snapshot_path))
+                return registry
+        if cache is None:
+            registry.read_sheets(configuration)
+        else:
+
+            def read_snapshot():
+                registry.read_sheets(configuration)
+                return registry.get_snapshot()
+
+            snapshot = cache.load(
+                "exclusions",
+                (
+                    configuration["skipped_url"],
+                    configuration["allowed_url"],
+                    configuration["spurious_url"],
+                ),
+                read_snapshot,
+            )
+            registry.set_snapshot(snapshot)
+        if retriever is not None and retriever.save:
+            save_json(registry.get_snapshot(), snapshot_path)
+        return registry
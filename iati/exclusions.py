@@ -1,5 +1,7 @@
-from hdx.location.currency import Currency, CurrencyError
+from hdx.location.currency import CurrencyError
 
+from .currencyrates import CurrencyRates
+from .keywordmatcher import KeywordMatcher
 from .lookups import Lookups
 from .utilities import get_date_with_fallback
 
@@ -13,7 +15,7 @@ class Exclusions:
         self.excluded_aid_types = None
         self.relevant_sectors = None
         self.relevant_countries = None
-        self.relevant_words = None
+        self.relevant_words = KeywordMatcher()
 
     @staticmethod
     def specific_exclusions(dactivity):
@@ -79,12 +81,7 @@ class Exclusions:
             return False
         if not title_or_desc:
             return False
-        for lang, text in title_or_desc.narratives.items():
-            text_lower = text.lower()
-            for word in self.relevant_words:
-                if word in text_lower:
-                    return False
-        return True
+        return not self.relevant_words.matches(title_or_desc)
 
     # Prefilters either full activities and transactions that cannot be valued
     # Does not filter transactions other than those that cannot be valued as that must
@@ -110,7 +107,7 @@ class Exclusions:
             country_in_list = True
         else:
             country_in_list = False
-        if not do_checks or self.relevant_words is None:
+        if not do_checks or not self.relevant_words:
             text_in_narrative = True
         else:
             text_in_narrative = False
@@ -235,7 +232,7 @@ class Exclusions:
             value = dtransaction.value
             try:
                 # Convert the transaction value to USD
-                usd_value = Currency.get_historic_value_in_usd(
+                usd_value = CurrencyRates.get_historic_value_in_usd(
                     value,
                     dtransaction.currency,
                     dtransaction.valuation_date,
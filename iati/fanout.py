@@ -0,0 +1,144 @@
+"""Single download multi-theme fan-out
+
+Themes overlap so rather than downloading and parsing each theme's activities
+separately, the activities selected by any theme's D-Portal query are
+downloaded once. The much smaller lists of activity identifiers that each
+theme's query returns say which themes each activity belongs to,
+identifiers being stripped of surrounding whitespace on both sides. Each
+activity is parsed once and prefiltered with the checks of every theme it
+belongs to. The small activities of each theme that remain after
+prefiltering go to that theme's writer, giving what separate runs of the
+themes would.
+
+A local file of activities has no queries, so its activities are routed to
+every theme whose checks find that it belongs to the theme, which only
+approximates the themes' queries.
+"""
+import logging
+from urllib.parse import quote
+
+import diterator
+
+from .iterparse import iterparse_activities
+from .lookups import Lookups
+from .normalise import normalise_identifier
+from .prefilter import PrefilterCounts
+from .smalldactivity import create_small_dactivity
+
+logger = logging.getLogger(__name__)
+
+
+def get_theme_query(whattorun, dportal_params=""):
+    dportal_configuration = Lookups.configuration["dportal"]
+    return dportal_configuration[f"{whattorun}_query"].format(dportal_params)
+
+
+def get_themes_query(themes, dportal_params=""):
+    """Returns the query for the activities selected by any of the themes'
+    queries"""
+    dportal_configuration = Lookups.configuration["dportal"]
+    aids_query = dportal_configuration["aids_query"]
+    return dportal_configuration["themes_query"].format(
+        " UNION ".join(
+            aids_query.format(get_theme_query(whattorun, dportal_params))
+            for whattorun in themes
+        )
+    )
+
+
+def read_theme_members(retriever, themes, dportal_params=""):
+    """Returns the identifiers of the activities selected by each theme's
+    query by theme"""
+    dportal_configuration = Lookups.configuration["dportal"]
+    aids_query = dportal_configuration["aids_query"]
+    theme_members = dict()
+    for whattorun in themes:
+        query = aids_query.format(get_theme_query(whattorun, dportal_params))
+        _, iterator = retriever.get_tabular_rows(
+            dportal_configuration["aids_url"] % quote(query),
+            dict_form=True,
+            filename=f"dportal_{whattorun}_aids.csv",
+            logstr=f"D-Portal {whattorun} activity identifiers",
+        )
+        theme_members[whattorun] = {
+            normalise_identifier(row["aid"]) for row in iterator
+        }
+    return theme_members
+
+
+def prefilter_fanout(
+    dportal_paths, theme_checks, writers, iterparse, theme_members=None
+):
+    """
+    Reads the activities of the XML files once, prefiltering each with the
+    checks of every theme it belongs to and writing the small activity that
+    remains to the writer of that theme. An activity belongs to the themes
+    whose members it is in or, without theme_members, to the themes whose
+    checks find it belongs to them. Transactions are left out of the small
+    activity rather than removed from the activity as they may be prefiltered
+    out for one theme but not another. Returns the number of small activities
+    written for each theme.
+    """
+    theme_counts = {whattorun: PrefilterCounts() for whattorun in theme_checks}
+    theme_written = {whattorun: 0 for whattorun in theme_checks}
+    no_activities = 0
+    no_unselected_activities = 0
+    for dportal_path in dportal_paths:
+        if iterparse:
+            xmliterator = iterparse_activities(dportal_path)
+        else:
+            xmliterator = diterator.XMLIterator(dportal_path)
+        while True:
+            try:
+                dactivity = next(xmliterator)
+            except StopIteration:
+                break
+            except Exception as ex:
+                logger.exception(ex)
+                continue
+            no_activities += 1
+            if no_activities % 1000 == 0:
+                logger.info(f"Read {no_activities} activities")
+            identifier = normalise_identifier(dactivity.identifier)
+            selected = False
+            for whattorun, checks in theme_checks.items():
+                if theme_members is not None:
+                    if identifier not in theme_members[whattorun]:
+                        continue
+                counts = theme_counts[whattorun]
+                Lookups.checks = checks
+                try:
+                    if theme_members is None and not checks.is_theme_activity(
+                        dactivity
+                    ):
+                        continue
+                    selected = True
+                    counts.no_query_activities += 1
+                    exclude, removed_transactions = checks.exclude_activity(dactivity)
+                    if exclude:
+                        counts.no_removed_activities += 1
+                        continue
+                    counts.no_removed_transactions += len(removed_transactions)
+                    removed_transactions = set(removed_transactions)
+                    dtransactions = [
+                        dtransaction
+                        for i, dtransaction in enumerate(dactivity.transactions)
+                        if i not in removed_transactions
+                    ]
+                    small_dactivity = create_small_dactivity(dactivity, dtransactions)
+                except Exception as ex:
+                    logger.exception(ex)
+                    continue
+                writers[whattorun].write(small_dactivity)
+                theme_written[whattorun] += 1
+            if not selected:
+                no_unselected_activities += 1
+            del dactivity
+        del xmliterator
+    logger.info(f"Read {no_activities} activities for {len(theme_checks)} themes")
+    if no_unselected_activities:
+        logger.info(f"{no_unselected_activities} activities belonged to no theme")
+    for whattorun, counts in theme_counts.items():
+        logger.info(f"{whattorun}:")
+        counts.log()
+    return theme_written
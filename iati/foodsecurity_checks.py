@@ -47,13 +47,8 @@ class FoodSecurityChecks(BaseChecks):
             ),
             "2": ("311", "312", "313"),
         }
-
-    def has_desired_text(self, narrativetext):
-        # Check a dict of different-language text for the string "Food Security" or "Food Insecurity" (case-insensitive)
-        for lang, text in narrativetext.narratives.items():
-            if any(x in text.lower() for x in ("food security", "food insecurity")):
-                return True
-        return False
+        # Check for the string "Food Security" or "Food Insecurity" in text
+        self.desired_words.add("food security", "food insecurity")
 
     def should_skip_transaction(self, dactivity, dtransaction, transaction_date):
         if not self.is_date_in_range(transaction_date):
@@ -2,23 +2,27 @@ from iati import BaseSectorLookups
 
 
 class FoodSecuritySectorLookups(BaseSectorLookups):
-    def __init__(self, retriever, configuration):
-        super().__init__(retriever, configuration, sector_data="foodsecurity")
-        self.default_lookup = BaseSectorLookups(retriever, configuration)
-        sector_info = self.sector_info
-        self.sector_info = dict()
-        for info in sector_info["data"]:
-            self.sector_info[info["code"]] = info["name"]
+    # Prefer 5-digit codes to 3-digit
+    preferred_vocabulary = "1"
+    other_vocabulary = "2"
 
-    def get_sector_group_name(self, code):
-        """Look up a group name for a 5-digit sector code."""
-        if code in self.sector_info:
-            return self.sector_info[code]
-        return self.default_lookup.get_sector_group_name(code)
+    def __init__(self, retriever, configuration, cache=None):
+        self.default_lookup = BaseSectorLookups(retriever, configuration, cache=cache)
+        super().__init__(
+            retriever, configuration, sector_data="foodsecurity", cache=cache
+        )
 
     @staticmethod
-    def get_vocabulary_code(sectors):
-        # Prefer 5-digit codes to 3-digit
-        if "1" in [sector.vocabulary for sector in sectors]:
-            return "1"
-        return "2"
+    def read_sector_info(retriever, url):
+        sector_info = retriever.download_json(url)
+        return {info["code"]: info["name"] for info in sector_info["data"]}
+
+    def build_sector_group_names(self):
+        """Map from sector codes to food security sector names falling back on
+        the default group names"""
+        sector_group_names = dict(self.default_lookup.sector_group_names)
+        sector_group_names.update(self.sector_info)
+        return sector_group_names
+
+    def resolve_sector_group_name(self, code):
+        return self.default_lookup.get_sector_group_name(code)
@@ -0,0 +1,167 @@
+"""Streaming HXLated CSV and JSON output
+
+Writes the same files as hdx.utilities.saver.save_hxlated_output from rows
+given one at a time so that the rows never need to be held in memory at once.
+"""
+import csv
+import json
+from os.path import join
+
+from hdx.utilities.saver import match_template_variables
+
+
+def dumps(value):
+    return json.dumps(value, indent=None, separators=(",", ":"))
+
+
+class HXLatedWriter:
+    """Writer for rows without header or HXL hashtags whose headers, hashtags,
+    output files and metadata are defined in the configuration. Keyword
+    arguments are used to pass in any variables needed by the metadata."""
+
+    def __init__(self, configuration, output_dir="", **kwargs):
+        headers = list(configuration["input"]["headers"])
+        hxltags = list(configuration["input"]["hxltags"])
+        expressions = dict()
+        for process in configuration.get("process", []):
+            headers.append(process["header"])
+            hxltag = process["hxltag"]
+            hxltags.append(hxltag)
+            expressions[hxltag] = process["expression"]
+        for hxltag, expression in expressions.items():
+            for i, input_hxltag in enumerate(hxltags):
+                expression = expression.replace(input_hxltag, f"inrow[{i}]")
+            expressions[hxltag] = compile(expression, hxltag, "eval")
+        self.expressions = expressions
+        self.hxltags = hxltags
+        hxltag_to_header = dict(zip(hxltags, headers))
+
+        csv_configuration = configuration["output"].get("csv")
+        if csv_configuration:
+            csv_hxltags = csv_configuration.get("hxltags", hxltags)
+            self.csv_columns = self.get_columns(csv_hxltags)
+            self.csv_file = open(
+                join(output_dir, csv_configuration["filename"]),
+                "w",
+                encoding="utf-8",
+                newline="\n",
+            )
+            self.output_csv = csv.writer(self.csv_file)
+            self.output_csv.writerow(
+                [hxltag_to_header[hxltag] for hxltag in csv_hxltags]
+            )
+            self.output_csv.writerow(csv_hxltags)
+        else:
+            self.csv_file = None
+            self.output_csv = None
+
+        json_configuration = configuration["output"].get("json")
+        if json_configuration:
+            data_key = json_configuration.get("data")
+            self.json_columns = self.get_columns(
+                json_configuration.get("hxltags", hxltags)
+            )
+            metadata_configuration = json_configuration.get("metadata")
+            if metadata_configuration:
+                metadata = dict()
+                for metadata_name, value in metadata_configuration.items():
+                    if isinstance(value, str):
+                        template_string, match_string = match_template_variables(
+                            value
+                        )
+                        if template_string:
+                            value = kwargs.get(match_string)
+                    if value is None:
+                        continue
+                    metadata[metadata_name] = value
+                metadata_json = dumps(metadata)
+            else:
+                metadata_json = None
+            self.output_json = open(
+                join(output_dir, json_configuration["filename"]), "w"
+            )
+            if metadata_json:
+                metadata_key = metadata_configuration.get("key", "metadata")
+                if data_key is None:
+                    data_key = "data"
+                self.output_json.write(
+                    f'{{"{metadata_key}":{metadata_json},"{data_key}":[\n'
+                )
+            elif data_key is None:
+                self.output_json.write("[\n")
+            else:
+                self.output_json.write(f'{{"{data_key}":[\n')
+            self.data_key = data_key
+        else:
+            self.output_json = None
+            self.data_key = None
+        # Each JSON row ends with ",\n" except the last so a row is held back
+        # until the next one arrives
+        self.pending_json = None
+        self.no_rows = 0
+
+    def get_columns(self, file_hxltags):
+        """Returns the hxltag and either the expression or the input row index
+        for each output column"""
+        columns = list()
+        for file_hxltag in file_hxltags:
+            expression = self.expressions.get(file_hxltag)
+            if expression:
+                columns.append((file_hxltag, expression, None))
+            else:
+                index = self.hxltags.index(file_hxltag)
+                columns.append((file_hxltag, None, index))
+        return columns
+
+    @staticmethod
+    def get_outrow(inrow, columns):
+        outrow = dict()
+        for hxltag, expression, index in columns:
+            if expression:
+                outrow[hxltag] = eval(expression, None, {"inrow": inrow})
+            else:
+                outrow[hxltag] = inrow[index]
+        return outrow
+
+    def write(self, row):
+        if isinstance(row, dict):
+            row = list(row.values())
+        if self.output_csv:
+            self.output_csv.writerow(self.get_outrow(row, self.csv_columns).values())
+        if self.output_json:
+            if self.pending_json is not None:
+                self.output_json.write(f"{self.pending_json},\n")
+            self.pending_json = dumps(self.get_outrow(row, self.json_columns))
+        self.no_rows += 1
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def close(self):
+        if self.output_json:
+            if self.pending_json is None:
+                self.output_json.write("]")
+            else:
+                self.output_json.write(f"{self.pending_json}\n]")
+            if self.data_key is not None:
+                self.output_json.write("}")
+            self.output_json.close()
+            self.output_json = None
+        if self.csv_file:
+            self.csv_file.close()
+            self.csv_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def save_hxlated_rows(configuration, rows, output_dir="", **kwargs):
+    """Save rows from an iterable with the header and HXL hashtags defined in
+    the configuration. Keyword arguments are used to pass in any variables
+    needed by the metadata defined in the configuration."""
+    with HXLatedWriter(configuration, output_dir, **kwargs) as writer:
+        writer.write_rows(rows)
@@ -0,0 +1,374 @@
+"""Incremental runs
+
+The state of a run is kept per activity: its last-updated-datetime, a hash of
+its prefiltered small activity, the encoded small activity itself and the
+flows and split transaction rows it contributed. The next run downloads only
+the activities updated since the latest last-updated-datetime seen, replaces
+the state of those activities and rebuilds the outputs from the state,
+reprocessing only the activities whose contributions may have changed.
+
+Contributions depend upon lookups built from all activities and upon currency
+rates so they are reused only if the org lookup tables and the secondary rates
+come out the same as in the run that stored them. Otherwise the stored
+activities are processed again without downloading them again. Everything else
+an activity's prefiltering depends upon, like the configuration and the
+exclusions, is summed up in a context hash. If it changes, all activities are
+downloaded again.
+
+An activity edited so that the query no longer selects it is not among the
+activities updated since the last run. So each run also reads the much
+smaller list of the identifiers of all the activities the query selects and
+removes the state of those no longer in it.
+
+Prefiltering also depends upon today's date since dates after today are out of
+range. Once a date is no longer after today that stays so, so the raw XML of
+the activities with any date after today is kept in the state and those
+activities are prefiltered again on every run in case a new day has brought
+their dates into range.
+"""
+import hashlib
+import logging
+import pickle
+from os import makedirs, replace
+from os.path import dirname, exists, join
+from xml.etree.ElementTree import iterparse, tostring
+
+from .compactstore import decode_activity, encode_activity
+from .currencyrates import CurrencyRates
+from .iterparse import get_text
+from .lookups import Lookups
+from .normalise import normalise_identifier
+from .processing import ProcessCounts, process_record
+from .utilities import parse_iati_date
+
+logger = logging.getLogger(__name__)
+
+STATE_FILENAME = "state.pickle"
+STATE_VERSION = 2
+DATED_FILENAME = "dated_activities.xml"
+DATED_XML_HEADER = b'<?xml version="1.0" encoding="UTF-8"?>\n<iati-activities>\n'
+DATED_XML_FOOTER = b"\n</iati-activities>"
+# Activity start dates by type
+START_DATE_TYPES = ("1", "2")
+
+
+def get_hash(value):
+    return hashlib.sha256(
+        pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    ).hexdigest()
+
+
+def get_context(whattorun, startdate):
+    """Hash of everything other than the activities, today's date, the org
+    lookup tables and currency rates that prefiltering and processing depend
+    upon"""
+    return get_hash(
+        (
+            STATE_VERSION,
+            whattorun,
+            startdate,
+            repr(dict(Lookups.configuration)),
+            list(Lookups.skip_activities),
+            Lookups.skip_activities.get_prefixes(),
+            list(Lookups.skip_reporting_orgs),
+            Lookups.skip_reporting_orgs.get_prefixes(),
+            Lookups.skip_reporting_orgs_children,
+            list(Lookups.allow_activities),
+            Lookups.allow_activities.get_prefixes(),
+            list(Lookups.org_ref_spurious),
+            Lookups.org_ref_spurious.get_prefixes(),
+            Lookups.sector_lookups.sector_info,
+        )
+    )
+
+
+def get_lookups_hash():
+    """Hash of the org lookup tables, which doesn't depend upon the order in
+    which they were filled, and of the secondary currency rates files"""
+    return get_hash(
+        (
+            tuple(
+                sorted(table.items())
+                for table in (
+                    Lookups.org_ref_to_name,
+                    Lookups.org_ref_to_type,
+                    Lookups.org_names_to_ref,
+                    Lookups.org_names_to_type,
+                )
+            ),
+            CurrencyRates.sources,
+        )
+    )
+
+
+def get_prefilter_dates(element):
+    """Yields the dates of an activity element that prefiltering compares with
+    today ie. its start dates and its transactions' dates and value dates"""
+    for date_element in element.iterfind("activity-date"):
+        if date_element.get("type") in START_DATE_TYPES:
+            yield date_element.get("iso-date")
+    for transaction_element in element.iterfind("transaction"):
+        date_element = transaction_element.find("transaction-date")
+        if date_element is not None:
+            yield date_element.get("iso-date")
+        value_element = transaction_element.find("value")
+        if value_element is not None:
+            yield value_element.get("value-date")
+
+
+def is_dated_after(element, today):
+    """Check if any date of an activity element that prefiltering compares with
+    today is after today"""
+    for date in get_prefilter_dates(element):
+        if not date:
+            continue
+        date = parse_iati_date(date)
+        if date and date > today:
+            return True
+    return False
+
+
+def read_last_updated(dportal_paths, today):
+    """Returns the last-updated-datetime of each activity in the D-Portal XML
+    files by normalised identifier and the XML of those with any date after
+    today by normalised identifier. Later activities replace earlier ones with
+    the same identifier."""
+    last_updated = dict()
+    dated = dict()
+    for dportal_path in dportal_paths:
+        for _, element in iterparse(dportal_path):
+            if element.tag == "iati-activity":
+                identifier = normalise_identifier(
+                    get_text(element.find("iati-identifier"))
+                )
+                last_updated[identifier] = element.get("last-updated-datetime")
+                if is_dated_after(element, today):
+                    element.tail = None
+                    dated[identifier] = tostring(element)
+                else:
+                    dated.pop(identifier, None)
+                element.clear()
+    return last_updated, dated
+
+
+class StateWriter:
+    """Collects the encoded small activities remaining after prefiltering with
+    the errors raised prefiltering each of them"""
+
+    def __init__(self):
+        self.records = list()
+
+    def write(self, dactivity, errors):
+        self.records.append((encode_activity(dactivity), list(errors)))
+
+    def close(self):
+        pass
+
+
+class ActivityState:
+    __slots__ = ["last_updated", "content_hash", "record", "errors", "contribution"]
+
+    def __init__(self, last_updated, record, errors):
+        self.last_updated = last_updated
+        self.content_hash = get_hash(record)
+        self.record = record
+        self.errors = errors
+        self.contribution = None
+
+
+class IncrementalState:
+    """State of the activities of a run which serves as the store of small
+    activities to process"""
+
+    def __init__(self, state_dir, context):
+        self.path = join(state_dir, STATE_FILENAME)
+        self.context = context
+        self.lookups_hash = None
+        self.last_updated = None
+        self.activity_states = dict()
+        # Raw XML of the activities with any date after today by identifier
+        self.dated_activities = dict()
+        # Activities read this run whose errors have already been raised
+        self.read_identifiers = set()
+
+    @classmethod
+    def load(cls, state_dir, context, full_refresh=False):
+        """Loads the state saved in the folder if it was saved with the same
+        context. Otherwise, or for a full refresh, returns an empty state so all
+        activities are read."""
+        state = cls(state_dir, context)
+        if full_refresh:
+            logger.info("Full refresh of incremental state so reading all activities")
+            return state
+        if not exists(state.path):
+            logger.info("No incremental state so reading all activities")
+            return state
+        with open(state.path, "rb") as file:
+            saved = pickle.load(file)
+        if saved[0] != STATE_VERSION or saved[1] != context:
+            logger.info("Incremental state context changed so reading all activities")
+            return state
+        (
+            _,
+            _,
+            state.lookups_hash,
+            state.last_updated,
+            state.activity_states,
+            state.dated_activities,
+        ) = saved
+        logger.info(
+            f"Reading activities updated since {state.last_updated} into "
+            f"incremental state of {len(state.activity_states)} activities"
+        )
+        return state
+
+    def save(self):
+        makedirs(dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as file:
+            pickle.dump(
+                (
+                    STATE_VERSION,
+                    self.context,
+                    self.lookups_hash,
+                    self.last_updated,
+                    self.activity_states,
+                    self.dated_activities,
+                ),
+                file,
+                pickle.HIGHEST_PROTOCOL,
+            )
+        replace(temp_path, self.path)
+
+    def retain(self, identifiers):
+        """Removes the state of the activities whose normalised identifiers are
+        not among the identifiers, those of the activities the query selects"""
+        removed = [
+            identifier
+            for identifier in self.activity_states
+            if identifier not in identifiers
+        ]
+        for identifier in removed:
+            del self.activity_states[identifier]
+        self.dated_activities = {
+            identifier: xml
+            for identifier, xml in self.dated_activities.items()
+            if identifier in identifiers
+        }
+        logger.info(
+            f"Removed {len(removed)} activities no longer selected by the query "
+            "from incremental state"
+        )
+
+    def write_dated_activities(self, folder):
+        """Writes the activities with any date after the today of the run that
+        stored them to an XML file in the folder to be prefiltered again before
+        the D-Portal XML files. Returns a tuple of its path or an empty tuple if
+        there are none."""
+        if not self.dated_activities:
+            return tuple()
+        path = join(folder, DATED_FILENAME)
+        with open(path, "wb") as file:
+            file.write(DATED_XML_HEADER)
+            file.write(b"\n".join(self.dated_activities.values()))
+            file.write(DATED_XML_FOOTER)
+        logger.info(
+            f"Reading again {len(self.dated_activities)} activities with dates after today"
+        )
+        return (path,)
+
+    def update(self, dportal_paths, records, today):
+        """Replaces the state of the activities read from the XML files, which
+        are those written by write_dated_activities followed by the D-Portal
+        ones, with the encoded small activities remaining after prefiltering,
+        which are given with the errors raised prefiltering them as of today.
+        Activities that no longer pass prefiltering are removed. Changed
+        activities keep their place so that the activities are processed in
+        the order a full run would read them and new activities go to the
+        end."""
+        last_updated, self.dated_activities = read_last_updated(dportal_paths, today)
+        self.read_identifiers = set(last_updated)
+        new_states = dict()
+        for record, errors in records:
+            identifier = normalise_identifier(record[0])
+            new_states[identifier] = ActivityState(
+                last_updated.get(identifier), record, errors
+            )
+        no_unchanged = 0
+        no_removed = 0
+        for identifier in last_updated:
+            old_state = self.activity_states.get(identifier)
+            if old_state is None:
+                continue
+            new_state = new_states.get(identifier)
+            if new_state is None:
+                del self.activity_states[identifier]
+                no_removed += 1
+            elif new_state.content_hash == old_state.content_hash:
+                old_state.last_updated = new_state.last_updated
+                old_state.errors = new_state.errors
+                del new_states[identifier]
+                no_unchanged += 1
+        # Replacing the state of a changed activity keeps its place
+        self.activity_states.update(new_states)
+        dates = [date for date in last_updated.values() if date]
+        if self.last_updated:
+            dates.append(self.last_updated)
+        if dates:
+            self.last_updated = max(dates)
+        logger.info(
+            f"Incremental state has {len(new_states)} new or changed, {no_unchanged} "
+            f"unchanged and {no_removed} removed activities out of "
+            f"{len(self.activity_states)}"
+        )
+
+    def records(self):
+        for activity_state in self.activity_states.values():
+            yield activity_state.record
+
+    def __iter__(self):
+        for record in self.records():
+            yield decode_activity(record)
+
+    def process(self, flows, transactions):
+        """Adds the contribution of each activity to the flows and transactions
+        accumulators in activity order, processing the activities whose stored
+        contributions can't be reused"""
+        lookups_hash = get_lookups_hash()
+        if lookups_hash != self.lookups_hash:
+            logger.info("Org lookups or rates changed so processing all activities")
+            for activity_state in self.activity_states.values():
+                activity_state.contribution = None
+            self.lookups_hash = lookups_hash
+        errors_on_exit = Lookups.checks.errors_on_exit
+        # Prefiltering errors of activities not read this run are raised again
+        for identifier, activity_state in self.activity_states.items():
+            if identifier not in self.read_identifiers:
+                for error in activity_state.errors:
+                    errors_on_exit.add(error)
+        counts = ProcessCounts()
+        no_reused = 0
+        for activity_state in self.activity_states.values():
+            contribution = activity_state.contribution
+            if contribution is None:
+                contribution = process_record(activity_state.record)
+                activity_state.contribution = contribution
+            else:
+                no_reused += 1
+            (
+                activity_flows,
+                rows,
+                activity_counts,
+                used_reporting_orgs,
+                errors,
+            ) = contribution
+            for error in errors:
+                errors_on_exit.add(error)
+            flows.merge(activity_flows)
+            for row in rows:
+                transactions.append(row)
+            Lookups.used_reporting_orgs.update(used_reporting_orgs)
+            counts.add(activity_counts)
+        logger.info(f"Reused the stored contributions of {no_reused} activities")
+        counts.log(flows, transactions)
+        return flows, transactions
@@ -0,0 +1,324 @@
+"""Incremental extraction of activities from D-Portal XML
+
+An alternative to diterator that runs ElementTree's iterparse over the XML and
+clears each activity once it has been handled instead of building a minidom
+tree and evaluating XPath for every field. ElementActivity and
+ElementTransaction give the checks classes the same values as the diterator
+wrappers with coded items, orgs and narratives already flattened.
+"""
+import logging
+import re
+from functools import cached_property
+from xml.etree.ElementTree import iterparse
+
+from diterator.wrappers import is_truthy, lower, upper
+
+from .smallcodeditem import SmallCodedItem
+from .smallnarrativetext import SmallNarrativeText
+from .smallorganisation import SmallOrganisation
+
+logger = logging.getLogger(__name__)
+
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+# The string values XPath converts to numbers
+XPATH_NUMBER = re.compile(r"[ \t\r\n]*-?(\d+(\.\d*)?|\.\d+)[ \t\r\n]*$")
+
+
+def get_text(element):
+    """Text directly inside an element ignoring any child elements"""
+    if element is None:
+        return None
+    text = element.text or ""
+    for child in element:
+        if child.tail:
+            text += child.tail
+    return text
+
+
+def get_child_attribute(element, tag, attribute):
+    """Attribute of the first child with the given tag which has it"""
+    for child in element.iterfind(tag):
+        value = child.get(attribute)
+        if value is not None:
+            return value
+    return None
+
+
+def get_narrative(element, default_language):
+    if element is None:
+        return None
+    narratives = dict()
+    for node in element.iterfind("narrative"):
+        lang = node.get(XML_LANG)
+        if not lang:
+            lang = default_language
+        narratives[lang] = get_text(node)
+    narrativetext = SmallNarrativeText.__new__(SmallNarrativeText)
+    if default_language in narratives:
+        narrativetext.defaulttext = narratives[default_language]
+    elif "en" in narratives:
+        narrativetext.defaulttext = narratives["en"]
+    elif narratives:
+        narrativetext.defaulttext = next(iter(narratives.values()))
+    else:
+        narrativetext.defaulttext = ""
+    narrativetext.narratives = narratives
+    return narrativetext
+
+
+def get_organisation(element, default_language):
+    if element is None:
+        return None
+    return SmallOrganisation(
+        get_narrative(element, default_language),
+        element.get("ref"),
+        element.get("role"),
+        element.get("type"),
+    )
+
+
+def get_coded_item(element):
+    return SmallCodedItem.get(
+        element.get("code"),
+        element.get("type"),
+        element.get("vocabulary"),
+        element.get("percentage"),
+    )
+
+
+class PolicyMarker:
+    __slots__ = ["code", "vocabulary", "significance"]
+
+    def __init__(self, element):
+        self.code = element.get("code")
+        self.vocabulary = element.get("vocabulary")
+        self.significance = element.get("significance")
+
+
+class ElementActivity:
+    """Activity read from an iati-activity element with the properties of
+    diterator's Activity that are used by the checks and small activities"""
+
+    def __init__(self, element):
+        self.node = element
+        self.default_language = lower(element.get(XML_LANG, ""))
+
+    def get_coded_items(self, tag):
+        return [get_coded_item(element) for element in self.node.iterfind(tag)]
+
+    def get_activity_date(self, date_type):
+        for element in self.node.iterfind("activity-date"):
+            value = element.get("type")
+            if value is None or not XPATH_NUMBER.match(value):
+                continue
+            if float(value) != date_type:
+                continue
+            iso_date = element.get("iso-date")
+            if iso_date is not None:
+                return iso_date
+        return None
+
+    @cached_property
+    def identifier(self):
+        return get_text(self.node.find("iati-identifier"))
+
+    @cached_property
+    def reporting_org(self):
+        return get_organisation(self.node.find("reporting-org"), self.default_language)
+
+    @cached_property
+    def secondary_reporter(self):
+        return is_truthy(
+            get_child_attribute(self.node, "reporting-org", "secondary-reporter")
+        )
+
+    @cached_property
+    def hierarchy(self):
+        return self.node.get("hierarchy")
+
+    @cached_property
+    def humanitarian(self):
+        return is_truthy(self.node.get("humanitarian"))
+
+    @cached_property
+    def default_currency(self):
+        return upper(self.node.get("default-currency"))
+
+    @cached_property
+    def title(self):
+        return get_narrative(self.node.find("title"), self.default_language)
+
+    @cached_property
+    def description(self):
+        return get_narrative(self.node.find("description"), self.default_language)
+
+    @cached_property
+    def participating_orgs(self):
+        return [
+            get_organisation(element, self.default_language)
+            for element in self.node.iterfind("participating-org")
+        ]
+
+    @cached_property
+    def participating_orgs_by_role(self):
+        role_map = dict()
+        for org in self.participating_orgs:
+            role_map.setdefault(org.role, []).append(org)
+        return role_map
+
+    @cached_property
+    def start_date_planned(self):
+        return self.get_activity_date(1)
+
+    @cached_property
+    def start_date_actual(self):
+        return self.get_activity_date(2)
+
+    @cached_property
+    def sectors(self):
+        return self.get_coded_items("sector")
+
+    @cached_property
+    def recipient_countries(self):
+        return self.get_coded_items("recipient-country")
+
+    @cached_property
+    def recipient_regions(self):
+        return self.get_coded_items("recipient-region")
+
+    @cached_property
+    def default_aid_types(self):
+        return self.get_coded_items("default-aid-type")
+
+    @cached_property
+    def tags(self):
+        return self.get_coded_items("tag")
+
+    @cached_property
+    def humanitarian_scopes(self):
+        return self.get_coded_items("humanitarian-scope")
+
+    @cached_property
+    def policy_markers(self):
+        return [
+            PolicyMarker(element) for element in self.node.iterfind("policy-marker")
+        ]
+
+    @cached_property
+    def transactions(self):
+        return [
+            ElementTransaction(element, self)
+            for element in self.node.iterfind("transaction")
+        ]
+
+    def remove_transactions(self, indices):
+        transactions = self.transactions
+        for i in sorted(indices, reverse=True):
+            self.node.remove(transactions[i].node)
+            del transactions[i]
+
+
+class ElementTransaction:
+    """Transaction read from a transaction element with the properties of
+    diterator's Transaction that are used by the checks and small transactions.
+    As with diterator, sectors, countries, regions and aid types fall back on
+    those of the activity."""
+
+    def __init__(self, element, activity):
+        self.node = element
+        self.activity = activity
+
+    def get_coded_items(self, tag):
+        return [get_coded_item(element) for element in self.node.iterfind(tag)]
+
+    @cached_property
+    def type(self):
+        return get_child_attribute(self.node, "transaction-type", "code")
+
+    @cached_property
+    def date(self):
+        return get_child_attribute(self.node, "transaction-date", "iso-date")
+
+    @cached_property
+    def value(self):
+        s = get_text(self.node.find("value"))
+        try:
+            return float(s)
+        except (TypeError, ValueError):
+            logger.warning(
+                'Malformed monetary value "%s" in transaction for activity "%s", treating as 0.0',
+                s,
+                self.activity.identifier,
+            )
+            return 0
+
+    @cached_property
+    def currency(self):
+        currency = get_child_attribute(self.node, "value", "currency")
+        if currency:
+            return currency
+        return self.activity.default_currency
+
+    @cached_property
+    def value_date(self):
+        return get_child_attribute(self.node, "value", "value-date")
+
+    @cached_property
+    def humanitarian(self):
+        return is_truthy(self.node.get("humanitarian"))
+
+    @cached_property
+    def description(self):
+        return get_narrative(
+            self.node.find("description"), self.activity.default_language
+        )
+
+    @cached_property
+    def provider_org(self):
+        return get_organisation(
+            self.node.find("provider-org"), self.activity.default_language
+        )
+
+    @cached_property
+    def receiver_org(self):
+        return get_organisation(
+            self.node.find("receiver-org"), self.activity.default_language
+        )
+
+    @cached_property
+    def sectors(self):
+        return self.get_coded_items("sector") or self.activity.sectors
+
+    @cached_property
+    def recipient_countries(self):
+        return (
+            self.get_coded_items("recipient-country")
+            or self.activity.recipient_countries
+        )
+
+    @cached_property
+    def recipient_regions(self):
+        return (
+            self.get_coded_items("recipient-region") or self.activity.recipient_regions
+        )
+
+    @cached_property
+    def aid_types(self):
+        return self.get_coded_items("aid-type") or self.activity.default_aid_types
+
+
+def iterparse_activities(filename_or_stream):
+    """Yields an ElementActivity for each iati-activity element, clearing it
+    once the next is requested"""
+    root = None
+    for event, element in iterparse(filename_or_stream, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            continue
+        if element.tag != "iati-activity":
+            continue
+        yield ElementActivity(element)
+        element.clear()
+        if root is not element:
+            root.clear()
@@ -0,0 +1,58 @@
+"""Multi-keyword matching of narratives
+
+Checks classes declare the terms they look for in titles and descriptions
+into a KeywordMatcher which compiles them into a single pattern so that all
+terms are matched in one pass over each lowercased narrative. The pattern is
+a regular expression alternation of the literal terms rather than a pure
+Python Aho-Corasick automaton as the latter steps through the text a character
+at a time in Python and measures many times slower than the C regex engine for
+the handful of terms a theme has. Lowercasing a narrative costs more than
+matching it, so small narrative texts keep their lowercased narratives.
+"""
+import re
+
+
+def get_lowered_narratives(narrativetext):
+    """Small narrative texts keep their lowercased narratives while those of
+    diterator's narrative texts, which are made afresh each time, are
+    lowercased as needed"""
+    if hasattr(narrativetext, "get_lowered_narratives"):
+        return narrativetext.get_lowered_narratives()
+    return (text.lower() for text in narrativetext.narratives.values())
+
+
+class KeywordMatcher:
+    """Case-insensitive matching of any of a set of terms"""
+
+    def __init__(self, *terms):
+        self.terms = list()
+        self.pattern = None
+        self.add(*terms)
+
+    def add(self, *terms):
+        for term in terms:
+            term = term.lower()
+            if term not in self.terms:
+                self.terms.append(term)
+        self.pattern = None
+
+    def __len__(self):
+        return len(self.terms)
+
+    def search(self, text_lower):
+        """Whether the lowercased text contains any of the terms"""
+        if self.pattern is None:
+            self.pattern = re.compile(
+                "|".join(re.escape(term) for term in self.terms)
+            )
+        return self.pattern.search(text_lower) is not None
+
+    def matches(self, narrativetext):
+        """Whether any narrative of the narrative text contains any of the
+        terms"""
+        if not self.terms:
+            return False
+        for text_lower in get_lowered_narratives(narrativetext):
+            if self.search(text_lower):
+                return True
+        return False
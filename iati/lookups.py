@@ -1,30 +1,47 @@
 import logging
-import re
+from functools import lru_cache
 
-import hxl
 from hdx.location.country import Country
 from hdx.utilities.loader import load_json
 
-logger = logging.getLogger(__name__)
-
+from .exclusionregistry import ExclusionRegistry, IdentifierSet
+from .normalise import clean_region, clean_string
 
-def clean_string(s):
-    # Normalise one or more whitespaces to a single space and remove any punctuation at the start/end except
-    # for any trailing full stop
-    s = re.sub(r"(\W)\1+", r"\1", s.strip())
-    s = re.sub(r"\s", " ", s)
-    s = re.sub(r"^\W?([\w &]*)[^a-zA-Z0-9_\.]?$", r"\1", s)
-    return s.strip()
+logger = logging.getLogger(__name__)
 
 
-def clean_region(region):
-    region = region.replace("unspecified", "")
-    region = region.replace("regional", "")
-    return clean_string(region)
+@lru_cache(maxsize=65536)
+def clean_ref_name_type(ref, name, org_type):
+    """Cleaned ref, names and type of an org from its raw ref, name as a tuple
+    of its text and narratives and type. The names are a tuple as the result
+    is shared by every caller."""
+    if ref is not None:
+        ref = clean_string(str(ref)).lower()
+    other_names = list()
+    orig_name = None
+    org_name = None
+    if name:
+        text, narratives = name
+        orig_name = clean_string(text)
+        for key, value in narratives:
+            value = clean_string(value)
+            if value:
+                if key.lower() == "en":
+                    org_name = value
+                else:
+                    other_names.append(value)
+    names = list()
+    if org_name:
+        names.append(org_name)
+    if orig_name and orig_name not in names:
+        names.append(orig_name)
+    if other_names:
+        [names.append(x) for x in other_names if x not in names]
+    return ref, tuple(names), org_type or None
 
 
 class Lookups:
-    org_ref_spurious = list()
+    org_ref_spurious = IdentifierSet()
     org_ref_to_name = dict()
     org_ref_to_type = dict()
     org_names_to_ref = dict()
@@ -35,17 +52,22 @@ class Lookups:
     default_expenditure_org_name = None
     sector_lookups = None
     region_code_to_name = dict()
+    country_region_names = dict()
+    unknown_country_region_codes = dict()
     default_country_region = None
-    skip_activities = list()
-    skip_reporting_orgs = list()
+    skip_activities = IdentifierSet()
+    skip_reporting_orgs = IdentifierSet()
     skip_reporting_orgs_children = dict()
-    allow_activities = list()
+    allow_activities = IdentifierSet()
     configuration = None
     checks = None
+    org_info_cache = dict()
+    org_info_cache_hits = 0
+    org_info_cache_misses = 0
 
     @classmethod
     def clear(cls):
-        cls.org_ref_spurious = list()
+        cls.org_ref_spurious = IdentifierSet()
         cls.org_ref_to_name = dict()
         cls.org_ref_to_type = dict()
         cls.org_names_to_ref = dict()
@@ -56,57 +78,100 @@ class Lookups:
         cls.default_expenditure_org_name = None
         cls.sector_lookups = None
         cls.region_code_to_name = dict()
+        cls.country_region_names = dict()
+        cls.unknown_country_region_codes = dict()
         cls.default_country_region = None
-        cls.skip_activities = list()
-        cls.skip_reporting_orgs = list()
+        cls.skip_activities = IdentifierSet()
+        cls.skip_reporting_orgs = IdentifierSet()
         cls.skip_reporting_orgs_children = dict()
-        cls.allow_activities = list()
+        cls.allow_activities = IdentifierSet()
         cls.configuration = None
         cls.checks = None
+        cls.org_info_cache = dict()
+        cls.org_info_cache_hits = 0
+        cls.org_info_cache_misses = 0
 
-    @classmethod
-    def setup(cls):
-        logger.info("Reading in lookups data")
-        configuration = cls.configuration["lookups"]
+    @staticmethod
+    def read_tables(configuration):
+        """Map from IATI identifiers to organisation names and from region codes
+        to region names"""
+        org_ref_to_name = dict()
+        org_names_to_ref = dict()
+        region_code_to_name = dict()
         org_data = load_json(configuration["org_data"])
-        """ Map from IATI identifiers to organisation names """
         # Prime with org identifiers from code4iati
         for entry in org_data["data"]:
             code = clean_string(entry["code"]).lower()
             name = clean_string(entry["name"])
-            cls.org_ref_to_name[code] = name
-            cls.org_names_to_ref[name.lower()] = code
+            org_ref_to_name[code] = name
+            org_names_to_ref[name.lower()] = code
         region_data = load_json(configuration["region_data"])
-        """ Map from region codes to region names """
         # Prime with region codes from code4iati
         for entry in region_data["data"]:
             code = clean_string(entry["code"]).lower()
             name = clean_region(entry["name"])
-            cls.region_code_to_name[code] = name
+            region_code_to_name[code] = name
+        return {
+            "org_ref_to_name": org_ref_to_name,
+            "org_names_to_ref": org_names_to_ref,
+            "region_code_to_name": region_code_to_name,
+        }
+
+    @staticmethod
+    def read_country_region_names(region_code_to_name):
+        """Map from ISO2 country codes to country short names and from region
+        codes to region names marked as having no country. Countries take
+        precedence over regions."""
+        country_region_names = {
+            code: f"{name} (no country specified)"
+            for code, name in region_code_to_name.items()
+        }
+        for iso2 in Country.countriesdata()["iso2iso3"]:
+            if len(iso2) != 2:
+                continue
+            name = Country.get_country_name_from_iso2(iso2, shortname=True)
+            if name:
+                country_region_names[iso2] = name
+        return country_region_names
+
+    @classmethod
+    def setup(cls, retriever=None, cache=None):
+        logger.info("Reading in lookups data")
+        configuration = cls.configuration["lookups"]
+        if cache is None:
+            tables = cls.read_tables(configuration)
+        else:
+            tables = cache.load(
+                "lookups",
+                (configuration["org_data"], configuration["region_data"]),
+                lambda: cls.read_tables(configuration),
+            )
+        cls.org_ref_to_name.update(tables["org_ref_to_name"])
+        cls.org_names_to_ref.update(tables["org_names_to_ref"])
+        cls.region_code_to_name.update(tables["region_code_to_name"])
+        Country.set_ocha_url(configuration["country_data"])
+        if cache is None:
+            country_region_names = cls.read_country_region_names(
+                cls.region_code_to_name
+            )
+        else:
+            country_region_names = cache.load(
+                "country_region_names",
+                (configuration["country_data"], configuration["region_data"]),
+                lambda: cls.read_country_region_names(cls.region_code_to_name),
+            )
+        cls.country_region_names.update(country_region_names)
         cls.default_org_id = configuration["default_org_id"]
         cls.default_org_name = configuration["default_org_name"]
         cls.default_expenditure_org_name = configuration["default_expenditure_org_name"]
 
         cls.default_country_region = configuration["default_country_region"]
-        for row in hxl.data(configuration["skipped_url"]):
-            activity_id = row.get("#activity+code")
-            if activity_id:
-                cls.skip_activities.append(activity_id)
-            org_id = row.get("#org+reporting+id")
-            if org_id:
-                cls.skip_reporting_orgs.append(org_id)
-            org_id = row.get("#org+reporting_children+id")
-            hierarchy = row.get("#org+reporting_children+hierarchy")
-            if org_id and hierarchy:
-                cls.skip_reporting_orgs_children[org_id] = hierarchy
-        for row in hxl.data(configuration["allowed_url"]):
-            activity_id = row.get("#activity+code")
-            if activity_id:
-                cls.allow_activities.append(activity_id)
-        for row in hxl.data(configuration["spurious_url"]):
-            org_id = row.get("#org+reporting+id")
-            if org_id:
-                cls.org_ref_spurious.append(org_id)
+        registry = ExclusionRegistry.read(configuration, retriever, cache)
+        cls.skip_activities = registry.skip_activities
+        cls.skip_reporting_orgs = registry.skip_reporting_orgs
+        cls.skip_reporting_orgs_children = registry.skip_reporting_orgs_children
+        cls.allow_activities = registry.allow_activities
+        cls.org_ref_spurious = registry.org_ref_spurious
 
     @classmethod
     def skip_activity(cls, activityid):
@@ -130,38 +195,23 @@ class Lookups:
 
     @staticmethod
     def get_cleaned_ref_name_type(org):
-        ref = (
-            None
-            if org is None or org.ref is None
-            else clean_string(str(org.ref)).lower()
-        )
-        other_names = list()
-        orig_name = None
-        org_name = None
-        org_type = None
-        if org:
-            if org.name:
-                orig_name = clean_string(str(org.name))
-                for key, value in org.name.narratives.items():
-                    value = clean_string(value)
-                    if value:
-                        if key.lower() == "en":
-                            org_name = value
-                        else:
-                            other_names.append(value)
-            if org.type:
-                org_type = org.type
-        names = list()
-        if org_name:
-            names.append(org_name)
-        if orig_name and orig_name not in names:
-            names.append(orig_name)
-        if other_names:
-            [names.append(x) for x in other_names if x not in names]
-        return ref, names, org_type
+        """Cleaned ref, names and type of an org, which are cached against its
+        raw ref, name narratives and type as the same orgs are repeated across
+        many activities and transactions"""
+        if org is None:
+            return clean_ref_name_type(None, None, None)
+        name = org.name
+        if name:
+            name = (str(name), tuple(name.narratives.items()))
+        else:
+            name = None
+        return clean_ref_name_type(org.ref, name, org.type)
 
     @classmethod
     def add_to_org_lookup(cls, org, is_participating_org=False):
+        # The org info cache depends upon the tables this may change
+        if cls.org_info_cache:
+            cls.org_info_cache.clear()
         ref, names, org_type = cls.get_cleaned_ref_name_type(org)
         for name in names:
             lower_name = name.lower()
@@ -194,12 +244,33 @@ class Lookups:
         """Standardise organisation names
         For now, use the first name found for an identifier.
         Later, we can reference the registry.
+        Results are cached by cleaned ref, names and type until the org lookup
+        tables next change.
         """
+        ref, names, org_type = cls.get_cleaned_ref_name_type(org)
+        key = (ref, names, org_type, reporting_org, expenditure)
+        cached = cls.org_info_cache.get(key)
+        if cached is None:
+            cls.org_info_cache_misses += 1
+            cached = cls.resolve_org_info(
+                ref, names, org_type, reporting_org, expenditure
+            )
+            cls.org_info_cache[key] = cached
+        else:
+            cls.org_info_cache_hits += 1
+        org_info, used_reporting_org = cached
+        if used_reporting_org:
+            cls.used_reporting_orgs.add(used_reporting_org)
+        return dict(org_info)
+
+    @classmethod
+    def resolve_org_info(cls, ref, names, org_type, reporting_org, expenditure):
+        """Returns the org info for cleaned ref, names and type along with the
+        (ref, name) to add to the used reporting orgs if any"""
         if expenditure:
             default_org_name = cls.default_expenditure_org_name
         else:
             default_org_name = cls.default_org_name
-        ref, names, org_type = cls.get_cleaned_ref_name_type(org)
 
         refs = list()
         if ref:
@@ -239,11 +310,12 @@ class Lookups:
         else:
             name = default_org_name
 
+        used_reporting_org = None
         preferred_type = None
         if ref and ref != cls.default_org_id:
             if reporting_org:
                 if name != default_org_name:
-                    cls.used_reporting_orgs.add((ref, name))
+                    used_reporting_org = (ref, name)
             elif ref in cls.org_ref_spurious and name and name != default_org_name:
                 ref = cls.org_names_to_ref.get(name.lower())
             if ref:
@@ -252,7 +324,17 @@ class Lookups:
             preferred_type = cls.org_names_to_type.get(name.lower())
         if preferred_type:
             org_type = preferred_type
-        return {"id": ref, "name": name, "type": org_type}
+        return {"id": ref, "name": name, "type": org_type}, used_reporting_org
+
+    @classmethod
+    def log_org_info_cache_stats(cls):
+        total = cls.org_info_cache_hits + cls.org_info_cache_misses
+        if total == 0:
+            return
+        hit_rate = 100 * cls.org_info_cache_hits / total
+        logger.info(
+            f"Org info cache: {cls.org_info_cache_hits} hits, {cls.org_info_cache_misses} misses ({hit_rate:.1f}% hit rate)"
+        )
 
     # This can be used to get a list of org refs to check to see if they should be added to the manual list
     # @classmethod
@@ -281,11 +363,40 @@ class Lookups:
             del dactivity
 
     @classmethod
-    def get_country_region_name(cls, code):
+    def resolve_country_region_name(cls, code):
         countryname = Country.get_country_name_from_iso2(code, shortname=True)
         if countryname:
             return countryname
         regionname = cls.region_code_to_name.get(code)
         if regionname:
             return f"{regionname} (no country specified)"
+        return None
+
+    @classmethod
+    def get_country_region_name(cls, code):
+        """Country or region name from the names resolved at setup. Codes not
+        among them are resolved once, unknown codes being kept as None, and
+        unknown codes are counted."""
+        country_region_names = cls.country_region_names
+        name = country_region_names.get(code)
+        if name is not None:
+            return name
+        if code not in country_region_names:
+            name = cls.resolve_country_region_name(code)
+            country_region_names[code] = name
+            if name:
+                return name
+        unknown = cls.unknown_country_region_codes
+        unknown[code] = unknown.get(code, 0) + 1
         return cls.default_country_region
+
+    @classmethod
+    def log_unknown_country_region_codes(cls):
+        unknown = cls.unknown_country_region_codes
+        if not unknown:
+            return
+        codes = ", ".join(
+            f"{code} ({count})"
+            for code, count in sorted(unknown.items(), key=lambda x: -x[1])
+        )
+        logger.info(f"Unknown country or region codes: {codes}")
@@ -1,37 +1,429 @@
 import logging
+from itertools import chain
 from os import remove
-from os.path import join
+from os.path import getsize, join
 from urllib.parse import quote
 
-import diterator
-from hdx.location.currency import Currency
 from hdx.utilities.dateparse import parse_date
-from hdx.utilities.saver import save_hxlated_output
+from hdx.utilities.errors_onexit import ErrorsOnExit
 
 from . import checks, sector_lookups
-from .activity import Activity
+from .accumulators import Flows, SpillingTransactions, Transactions
 from .calculatesplits import CalculateSplits
+from .compactstore import CompactReader, CompactWriter, MemoryStore
+from .currencyrates import CurrencyRates
+from .dportalpages import DPortalPages
+from .fanout import get_themes_query, prefilter_fanout, read_theme_members
+from .hxloutput import save_hxlated_rows
+from .incremental import IncrementalState, StateWriter, get_context
 from .lookups import Lookups
-from .smalldactivity import create_small_dactivity
+from .prefilter import prefilter_activities
+from .processing import process_activities
+from .runreport import RunReport
+from .utilities import forked_process_map
 
 logger = logging.getLogger(__name__)
 
+PREFILTERED_XML_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<iati-activities xmlns:ns0="http://d-portal.org/xmlns/dstore" '
+    'xmlns:ns1="http://d-portal.org/xmlns/iati-activities" '
+    'xmlns:ns2="xml" version="2.03">\n'
+)
+PREFILTERED_XML_FOOTER = "\n</iati-activities>"
+COMPACT_FILENAME = "prefiltered.dat"
+CHECKPOINT_FOLDER = "dportal_pages"
 
-def retrieve_dportal(retriever, whattorun, dportal_params=""):
+
+def get_dportal_query(whattorun, dportal_params="", changed_since=None):
     """
-    Downloads activity data from D-Portal. Filters them and returns a
-    list of activities.
+    Returns the filename and query for downloading activity data from D-Portal.
+    If changed_since is given, only activities last updated since then are
+    queried.
     """
     dportal_configuration = Lookups.configuration["dportal"]
     filename = dportal_configuration["filename"]
-    url = dportal_configuration["url"] % quote(
-        dportal_configuration[f"{whattorun}_query"].format(dportal_params)
-    )
+    query = dportal_configuration[f"{whattorun}_query"].format(dportal_params)
+    if changed_since:
+        filename = dportal_configuration["changed_filename"]
+        query = dportal_configuration["changed_query"].format(query, changed_since)
+    return filename, query
+
+
+def retrieve_dportal(retriever, whattorun, dportal_params="", changed_since=None):
+    """
+    Downloads activity data from D-Portal. Filters them and returns a
+    list of activities.
+    """
+    filename, query = get_dportal_query(whattorun, dportal_params, changed_since)
+    url = Lookups.configuration["dportal"]["url"] % quote(query)
     return filename, retriever.download_file(
         url, filename, "D-Portal activities", False
     )
 
 
+def get_checkpoint_dir(checkpoint_dir, output_dir):
+    """
+    Returns the folder of checkpointed D-Portal pages which, unless given,
+    is one in the output folder.
+    """
+    if checkpoint_dir:
+        return checkpoint_dir
+    return join(output_dir, CHECKPOINT_FOLDER)
+
+
+def get_dportal_pages(
+    retriever,
+    whattorun,
+    dportal_params="",
+    changed_since=None,
+    page_size=1000,
+    checkpoint_dir="",
+):
+    """
+    Returns the pages of activity data from D-Portal which are downloaded as
+    they are iterated over.
+    """
+    filename, query = get_dportal_query(whattorun, dportal_params, changed_since)
+    dportal_configuration = Lookups.configuration["dportal"]
+    return DPortalPages(
+        retriever,
+        dportal_configuration["url"],
+        query,
+        dportal_configuration["page_query"],
+        page_size,
+        filename,
+        checkpoint_dir,
+    )
+
+
+def setup_reference_data(configuration, retriever, themes, reference_cache=None):
+    """
+    Sets up the lookups, currency rates and splits shared by all themes and
+    returns the sector lookups of each of the themes. Themes with the same
+    sector lookups class share them.
+    """
+    Lookups.configuration = configuration
+    theme_sector_lookups = dict()
+    sector_lookups_by_class = dict()
+    for whattorun in themes:
+        sector_lookups_class = sector_lookups[whattorun]
+        if sector_lookups_class not in sector_lookups_by_class:
+            sector_lookups_by_class[sector_lookups_class] = sector_lookups_class(
+                retriever, configuration["lookups"], cache=reference_cache
+            )
+        theme_sector_lookups[whattorun] = sector_lookups_by_class[sector_lookups_class]
+    Lookups.setup(retriever, reference_cache)
+    CurrencyRates.setup_currency(
+        retriever, configuration["lookups"], reference_cache
+    )
+    CalculateSplits.setup()
+    return theme_sector_lookups
+
+
+def start_themes(run_theme, themes, workers=1):
+    """
+    Runs run_theme for each of the themes, at most workers at a time, in
+    processes which inherit the reference data already set up. run_theme
+    returns the errors of its theme. Returns the errors of all themes.
+    """
+    logger.info(f"Running {', '.join(themes)} with {workers} workers")
+    errors = list()
+    for theme_errors in forked_process_map(
+        run_theme, [(whattorun,) for whattorun in themes], workers
+    ):
+        errors.extend(theme_errors)
+    return errors
+
+
+def process_store(
+    configuration,
+    today,
+    output_dir,
+    store,
+    report,
+    no_activities=None,
+    state=None,
+    workers=1,
+    sort_max_rows=None,
+    sort_max_mb=None,
+):
+    """
+    Adds the orgs of the small activities in the store to the lookups,
+    processes the activities and writes the flows, transactions and orgs
+    files, recording each stage in the run report. If there is incremental
+    state, it is the store.
+    """
+    #    Lookups.build_reporting_org_blocklist(dactivities)
+    with report.stage("reporting_orgs") as stage:
+        Lookups.add_reporting_orgs(store)
+        stage.items = no_activities
+    logger.info("Added reporting orgs to lookup")
+    with report.stage("participating_orgs") as stage:
+        Lookups.add_participating_orgs(store)
+        stage.items = no_activities
+    logger.info("Added participating orgs to lookup")
+
+    # Build the accumulators from the IATI activities and transactions
+    logger.info("Processing activities")
+    if sort_max_rows or sort_max_mb:
+        # Spill sorted runs of transactions to disk to bound memory
+        transactions = SpillingTransactions(
+            max_rows=sort_max_rows,
+            max_bytes=sort_max_mb * 1024 * 1024 if sort_max_mb else None,
+            spill_dir=output_dir,
+        )
+    else:
+        transactions = Transactions()
+    with report.stage("processing") as stage:
+        if state:
+            flows, transactions = state.process(Flows(), transactions)
+        else:
+            flows, transactions = process_activities(
+                store, workers=workers, transactions=transactions
+            )
+        stage.items = no_activities
+
+    outputs_configuration = configuration["outputs"]
+
+    # Prepare and write flows
+    logger.info(f"Writing flows files to {output_dir}")
+    with report.stage("sort_flows", "rows") as stage:
+        out_flows = flows.get_rows()
+        stage.items = len(out_flows)
+    with report.stage("save_flows", "rows") as stage:
+        save_hxlated_rows(
+            outputs_configuration["flows"],
+            out_flows,
+            output_dir=output_dir,
+            today=today,
+            num_flows=len(out_flows),
+        )
+        stage.items = len(out_flows)
+
+    # Write transactions
+    logger.info(f"Writing transactions files to {output_dir}")
+    # Spilled transactions are merged as they are saved
+    with report.stage("sort_transactions", "rows") as stage:
+        out_transactions = transactions.get_sorted_rows()
+        stage.items = len(out_transactions)
+    with report.stage("save_transactions", "rows") as stage:
+        save_hxlated_rows(
+            outputs_configuration["transactions"],
+            out_transactions,
+            output_dir=output_dir,
+            today=today,
+            num_transactions=len(out_transactions),
+        )
+        stage.items = len(out_transactions)
+
+    # Write orgs
+    logger.info(f"Writing orgs files to {output_dir}")
+    with report.stage("sort_orgs", "rows") as stage:
+        orgs = sorted(Lookups.used_reporting_orgs, key=lambda x: (x[1], x[0]))
+        stage.items = len(orgs)
+    with report.stage("save_orgs", "rows") as stage:
+        save_hxlated_rows(
+            outputs_configuration["orgs"],
+            orgs,
+            output_dir=output_dir,
+            today=today,
+            num_orgs=len(orgs),
+        )
+        stage.items = len(orgs)
+
+
+def load_state(
+    retriever,
+    state_dir,
+    whattorun,
+    dportal_params,
+    startdate,
+    report,
+    full_refresh=False,
+):
+    """
+    Returns the incremental state in state_dir. If activities updated since
+    the last run are to be read, the state of those the theme's query no
+    longer selects is removed.
+    """
+    state = IncrementalState.load(
+        state_dir, get_context(whattorun, startdate), full_refresh
+    )
+    if state.last_updated:
+        with report.stage("theme_members") as stage:
+            identifiers = read_theme_members(
+                retriever, (whattorun,), dportal_params
+            )[whattorun]
+            stage.items = len(identifiers)
+        state.retain(identifiers)
+    return state
+
+
+def download_activities(
+    retriever,
+    output_dir,
+    whattorun,
+    dportal_params,
+    report,
+    changed_since=None,
+    page_size=None,
+    checkpoint_dir=None,
+):
+    """
+    Returns the filename of the downloaded D-Portal activities, the D-Portal
+    pages if page_size is given and the paths to read the activities from.
+    Paginated activities are downloaded as their pages are iterated over.
+    """
+    if page_size:
+        dportal_pages = get_dportal_pages(
+            retriever,
+            whattorun,
+            dportal_params,
+            changed_since,
+            page_size,
+            get_checkpoint_dir(checkpoint_dir, output_dir),
+        )
+        return None, dportal_pages, dportal_pages
+    with report.stage("download", "bytes") as stage:
+        dportal_filename, dportal_path = retrieve_dportal(
+            retriever, whattorun, dportal_params, changed_since
+        )
+        stage.items = getsize(dportal_path)
+    return dportal_filename, None, (dportal_path,)
+
+
+def write_prefiltered(
+    writer,
+    dportal_paths,
+    output_dir,
+    saveprefiltered,
+    workers=1,
+    iterparse=False,
+    with_errors=False,
+):
+    """
+    Prefilters the activities in dportal_paths, writes the small activities,
+    with the errors raised prefiltering each if with_errors is True, with
+    writer and returns how many there were. The prefiltered XML is only kept
+    for inspection so is written only when asked.
+    """
+    if saveprefiltered:
+        xml_writer = open(join(output_dir, "prefiltered.xml"), "w")
+        xml_writer.write(PREFILTERED_XML_HEADER)
+    else:
+        xml_writer = None
+    no_activities = 0
+    for dactivity, xml, errors in prefilter_activities(
+        dportal_paths,
+        save_xml=saveprefiltered,
+        workers=workers,
+        iterparse=iterparse,
+        with_errors=True,
+    ):
+        if xml_writer:
+            xml_writer.write(xml)
+        if with_errors:
+            writer.write(dactivity, errors)
+        else:
+            writer.write(dactivity)
+        no_activities += 1
+        del dactivity
+    if xml_writer:
+        xml_writer.write(PREFILTERED_XML_FOOTER)
+        xml_writer.close()
+    return no_activities
+
+
+def prefilter_to_store(
+    dportal_paths,
+    output_dir,
+    report,
+    stage_name,
+    saveprefiltered,
+    single_pass=False,
+    workers=1,
+    iterparse=False,
+):
+    """
+    Prefilters the activities into the compact store in output_dir or, if
+    single_pass is True, into memory. Returns the store and the number of
+    activities in it.
+    """
+    if single_pass:
+        # Keep the small activities in memory instead of in the compact store
+        writer = store = MemoryStore()
+    else:
+        compact_path = join(output_dir, COMPACT_FILENAME)
+        writer = CompactWriter(compact_path)
+    with report.stage(stage_name) as stage:
+        no_activities = write_prefiltered(
+            writer, dportal_paths, output_dir, saveprefiltered, workers, iterparse
+        )
+        if not single_pass:
+            writer.close()
+            store = CompactReader(compact_path)
+        stage.items = no_activities
+    return store, no_activities
+
+
+def prefilter_to_state(
+    state,
+    dportal_pages,
+    dportal_paths,
+    output_dir,
+    report,
+    stage_name,
+    saveprefiltered,
+    workers=1,
+    iterparse=False,
+):
+    """
+    Prefilters the downloaded activities, after those with dates after the
+    last run's today, into the incremental state, which is then the store.
+    Returns the number of activities in the state.
+    """
+    writer = StateWriter()
+    dated_paths = state.write_dated_activities(output_dir)
+    with report.stage(stage_name) as stage:
+        write_prefiltered(
+            writer,
+            chain(dated_paths, dportal_paths),
+            output_dir,
+            saveprefiltered,
+            workers,
+            iterparse,
+            with_errors=True,
+        )
+        if dportal_pages:
+            dportal_paths = dportal_pages.paths
+        state.update(
+            (*dated_paths, *dportal_paths),
+            writer.records,
+            Lookups.checks.today,
+        )
+        stage.items = len(state.activity_states)
+    for path in dated_paths:
+        remove(path)
+    return len(state.activity_states)
+
+
+def remove_downloads(output_dir, dportal_filename, dportal_pages):
+    """
+    Removes the compact store and the downloaded D-Portal activities or pages
+    """
+    paths = [join(output_dir, COMPACT_FILENAME)]
+    if dportal_pages:
+        dportal_pages.remove()
+    else:
+        paths.append(join(output_dir, dportal_filename))
+    for path in paths:
+        try:
+            remove(path)
+        except FileNotFoundError:
+            pass
+
+
 def start(
     configuration,
     today,
@@ -42,177 +434,253 @@ def start(
     startdate,
     saveprefiltered,
     errors_on_exit,
+    single_pass=False,
+    workers=1,
+    sort_max_rows=None,
+    sort_max_mb=None,
+    iterparse=False,
+    reference_cache=None,
+    state_dir=None,
+    full_refresh=False,
+    page_size=None,
+    checkpoint_dir=None,
+    theme_sector_lookups=None,
+    profile=False,
 ):
     if startdate:
         text = f"removing activities and transactions before {startdate}"
     else:
         text = "with no date filtering"
     logger.info(f"Running {whattorun} {text}")
+    report = RunReport(
+        whattorun, profile_dir=join(output_dir, "profile") if profile else None
+    )
     Lookups.configuration = configuration
     if startdate is not None:
         startdate = parse_date(startdate)
     Lookups.checks = checks[whattorun](parse_date(today), startdate, errors_on_exit)
-    Lookups.sector_lookups = sector_lookups[whattorun](
-        retriever, configuration["lookups"]
-    )
-    dportal_filename, dportal_path = retrieve_dportal(
-        retriever, whattorun, dportal_params
-    )
-    Lookups.setup()
-    Currency.setup(
-        retriever=retriever,
-        fallback_historic_to_current=True,
-        fallback_current_to_static=True,
+    # Sector lookups are given if the reference data has already been set up
+    if theme_sector_lookups is None:
+        with report.stage("reference_data", None):
+            theme_sector_lookups = setup_reference_data(
+                configuration, retriever, (whattorun,), reference_cache
+            )
+    else:
+        CurrencyRates.set_retriever(retriever)
+    Lookups.sector_lookups = theme_sector_lookups[whattorun]
+    if state_dir:
+        state = load_state(
+            retriever,
+            state_dir,
+            whattorun,
+            dportal_params,
+            startdate,
+            report,
+            full_refresh,
+        )
+        changed_since = state.last_updated
+    else:
+        state = None
+        changed_since = None
+    dportal_filename, dportal_pages, dportal_paths = download_activities(
+        retriever,
+        output_dir,
+        whattorun,
+        dportal_params,
+        report,
+        changed_since,
+        page_size,
+        checkpoint_dir,
     )
-    CalculateSplits.setup()
 
     # Build org name lookup
     logger.info("Reading activities")
-    xmliterator = diterator.XMLIterator(dportal_path)
-    prefiltered_path = join(output_dir, "prefiltered.xml")
-    writer = open(prefiltered_path, "w")
-    writer.write(
-        '<?xml version="1.0" encoding="UTF-8"?>\n<iati-activities xmlns:ns0="http://d-portal.org/xmlns/dstore" xmlns:ns1="http://d-portal.org/xmlns/iati-activities" xmlns:ns2="xml" version="2.03">\n'
-    )
-    no_query_activities = 0
-    no_removed_activities = 0
-    no_removed_transactions = 0
-
-    while True:
-        try:
-            dactivity = next(xmliterator)
-            no_query_activities += 1
-            if no_query_activities % 1000 == 0:
-                logger.info(f"Read {no_query_activities} activities")
-            exclude, removed_transactions = Lookups.checks.exclude_activity(dactivity)
-            if exclude:
-                del dactivity
-                no_removed_activities += 1
-                continue
-            no_removed_transactions += len(removed_transactions)
-            activity_node = dactivity.node
-            transaction_nodes = dactivity.get_nodes("transaction")
-            for i in removed_transactions:
-                activity_node.removeChild(transaction_nodes[i])
-            writer.write(activity_node.toxml())
-            del dactivity
-        except StopIteration:
-            break
-        except Exception as ex:
-            logger.exception(ex)
-    writer.write("\n</iati-activities>")
-    writer.close()
-    del xmliterator  # Maybe this helps garbage collector?
-    logger.info(f"D-Portal returned {no_query_activities} activities")
-    if no_removed_activities == 0:
-        logger.info(f"Activity Prefiltering did not remove any activities")
+    # Paginated downloads happen while activities are prefiltered
+    stage_name = "download_and_prefilter" if dportal_pages else "prefilter"
+    if state:
+        store = state
+        no_activities = prefilter_to_state(
+            state,
+            dportal_pages,
+            dportal_paths,
+            output_dir,
+            report,
+            stage_name,
+            saveprefiltered,
+            workers,
+            iterparse,
+        )
     else:
-        logger.info(f"Activity Prefiltering removed {no_removed_activities} activities")
-        no_remaining = no_query_activities - no_removed_activities
-        logger.info(f"{no_remaining} activities after Activity Prefiltering")
-    logger.info(
-        f"Activity Prefiltering removed {no_removed_transactions} transactions from within remaining activities"
+        store, no_activities = prefilter_to_store(
+            dportal_paths,
+            output_dir,
+            report,
+            stage_name,
+            saveprefiltered,
+            single_pass,
+            workers,
+            iterparse,
+        )
+    process_store(
+        configuration,
+        today,
+        output_dir,
+        store,
+        report,
+        no_activities=no_activities,
+        state=state,
+        workers=workers,
+        sort_max_rows=sort_max_rows,
+        sort_max_mb=sort_max_mb,
     )
+    if state:
+        state.save()
+    report.save(output_dir)
+    remove_downloads(output_dir, dportal_filename, dportal_pages)
 
-    xmliterator = diterator.XMLIterator(prefiltered_path)
-    #    Lookups.build_reporting_org_blocklist(dactivities)
-    Lookups.add_reporting_orgs(xmliterator)
-    logger.info("Added reporting orgs to lookup")
-    del xmliterator  # Maybe this helps garbage collector?
-    xmliterator = diterator.XMLIterator(prefiltered_path)
-    Lookups.add_participating_orgs(xmliterator)
-    logger.info("Added participating orgs to lookup")
-    del xmliterator  # Maybe this helps garbage collector?
 
-    # Build the accumulators from the IATI activities and transactions
-    logger.info("Processing activities")
-    xmliterator = diterator.XMLIterator(prefiltered_path)
-    flows = dict()
-    transactions = list()
-    no_unvaluable_activities = 0
-    no_unvaluable_transactions = 0
-    no_skipped_transactions = 0
-    no_incoming_transactions = 0
-    for i, full_dactivity in enumerate(xmliterator):
-        dactivity = create_small_dactivity(full_dactivity)
-        del full_dactivity
-        (
-            no_valued_transactions,
-            unvaluable_transactions,
-        ) = Lookups.checks.exclude_transactions(dactivity)
-        if no_valued_transactions == 0:
-            no_unvaluable_activities += 1
-            continue
-        no_unvaluable_transactions += unvaluable_transactions
-        activity = Activity(dactivity)
-        skipped, incoming = activity.process(flows, transactions)
-        no_skipped_transactions += skipped
-        no_incoming_transactions += incoming
-        if i % 1000 == 0:
-            logger.info(f"Processed {i} activities")
-    del xmliterator
-    logger.info(
-        f"Processing found {no_unvaluable_activities} activities with no transactions that could be valued"
-    )
-    logger.info(
-        f"Processing found {no_unvaluable_transactions} transactions that could not be valued from within remaining activities"
+def start_fanout(
+    configuration,
+    today,
+    retriever,
+    output_dirs,
+    dportal_params,
+    startdate,
+    errors_on_exit,
+    workers=1,
+    sort_max_rows=None,
+    sort_max_mb=None,
+    iterparse=False,
+    reference_cache=None,
+    page_size=None,
+    checkpoint_dir=None,
+    activities_path=None,
+    theme_workers=1,
+    profile=False,
+):
+    """
+    Runs the themes of output_dirs, which maps each theme to its output folder,
+    from one download of the activities selected by any of their queries or
+    from a local file of activities. Each activity is read once and
+    prefiltered for each theme whose query selected it or, for a local file,
+    whose checks find it belongs to the theme. The themes are then processed,
+    at most theme_workers at a time. The stages shared by the themes are
+    recorded in each theme's run report before its own.
+    """
+    themes = list(output_dirs)
+    if startdate:
+        text = f"removing activities and transactions before {startdate}"
+    else:
+        text = "with no date filtering"
+    logger.info(f"Running {', '.join(themes)} from one download {text}")
+    # The shared stages are profiled into the first theme's profile folder
+    report = RunReport(
+        "_".join(themes),
+        profile_dir=join(output_dirs[themes[0]], "profile") if profile else None,
     )
-    logger.info(f"Processed {len(flows)} flows")
-    logger.info(f"Processed {len(transactions)} transactions")
-    logger.info(f"{no_skipped_transactions} transactions were skipped")
-    logger.info(f"{no_incoming_transactions} incoming transactions (no net value)")
-
-    outputs_configuration = configuration["outputs"]
+    if startdate is not None:
+        startdate = parse_date(startdate)
+    with report.stage("reference_data", None):
+        theme_sector_lookups = setup_reference_data(
+            configuration, retriever, themes, reference_cache
+        )
+    # Each theme's errors are kept apart until its processing has finished
+    theme_errors_on_exit = {whattorun: ErrorsOnExit() for whattorun in themes}
+    theme_checks = {
+        whattorun: checks[whattorun](
+            parse_date(today), startdate, theme_errors_on_exit[whattorun]
+        )
+        for whattorun in themes
+    }
+    if activities_path:
+        logger.warning(
+            f"Activities in {activities_path} are routed to themes by their checks "
+            "rather than their queries so outputs may differ from separate runs!"
+        )
+        theme_members = None
+    else:
+        with report.stage("theme_members") as stage:
+            theme_members = read_theme_members(retriever, themes, dportal_params)
+            stage.items = len(set().union(*theme_members.values()))
+    dportal_configuration = configuration["dportal"]
+    dportal_filename = dportal_configuration["themes_filename"]
+    dportal_pages = None
+    if activities_path:
+        dportal_paths = (activities_path,)
+    else:
+        query = get_themes_query(themes, dportal_params)
+        if page_size:
+            dportal_pages = DPortalPages(
+                retriever,
+                dportal_configuration["url"],
+                query,
+                dportal_configuration["page_query"],
+                page_size,
+                dportal_filename,
+                get_checkpoint_dir(checkpoint_dir, output_dirs[themes[0]]),
+            )
+            dportal_paths = dportal_pages
+        else:
+            with report.stage("download", "bytes") as stage:
+                dportal_path = retriever.download_file(
+                    dportal_configuration["url"] % quote(query),
+                    dportal_filename,
+                    "D-Portal activities",
+                    False,
+                )
+                stage.items = getsize(dportal_path)
+            dportal_paths = (dportal_path,)
 
-    # Prepare and write flows
-    logger.info(f"Writing flows files to {output_dir}")
-    out_flows = [
-        flows[key]["row"] + [int(round(flows[key]["value"]))] for key in sorted(flows)
-    ]
-    save_hxlated_output(
-        outputs_configuration["flows"],
-        out_flows,
-        includes_header=False,
-        includes_hxltags=False,
-        output_dir=output_dir,
-        today=today,
-        num_flows=len(out_flows),
-    )
+    logger.info("Reading activities")
+    compact_paths = {
+        whattorun: join(output_dirs[whattorun], COMPACT_FILENAME)
+        for whattorun in themes
+    }
+    writers = {
+        whattorun: CompactWriter(compact_path)
+        for whattorun, compact_path in compact_paths.items()
+    }
+    # Paginated downloads happen while activities are prefiltered
+    stage_name = "download_and_prefilter" if dportal_pages else "prefilter"
+    with report.stage(stage_name) as stage:
+        theme_written = prefilter_fanout(
+            dportal_paths, theme_checks, writers, iterparse, theme_members
+        )
+        for writer in writers.values():
+            writer.close()
+        stage.items = sum(theme_written.values())
 
-    # Write transactions
-    logger.info(f"Writing transactions files to {output_dir}")
-    out_transactions = sorted(
-        transactions,
-        key=lambda x: (x[0], x[2], x[3], x[4], x[5], x[6], x[7], x[8], x[9], x[10]),
-    )
-    save_hxlated_output(
-        outputs_configuration["transactions"],
-        out_transactions,
-        includes_header=False,
-        includes_hxltags=False,
-        output_dir=output_dir,
-        today=today,
-        num_transactions=len(out_transactions),
-    )
+    def process_theme(whattorun):
+        logger.info(f"Processing {whattorun}")
+        Lookups.checks = theme_checks[whattorun]
+        Lookups.sector_lookups = theme_sector_lookups[whattorun]
+        output_dir = output_dirs[whattorun]
+        theme_report = RunReport(
+            whattorun, profile_dir=join(output_dir, "profile") if profile else None
+        )
+        theme_report.stages.extend(report.stages)
+        compact_path = compact_paths[whattorun]
+        process_store(
+            configuration,
+            today,
+            output_dir,
+            CompactReader(compact_path),
+            theme_report,
+            no_activities=theme_written[whattorun],
+            workers=workers,
+            sort_max_rows=sort_max_rows,
+            sort_max_mb=sort_max_mb,
+        )
+        theme_report.save(output_dir)
+        remove(compact_path)
+        return theme_errors_on_exit[whattorun].errors
 
-    # Write orgs
-    logger.info(f"Writing orgs files to {output_dir}")
-    orgs = sorted(Lookups.used_reporting_orgs, key=lambda x: (x[1], x[0]))
-    save_hxlated_output(
-        outputs_configuration["orgs"],
-        orgs,
-        includes_header=False,
-        includes_hxltags=False,
-        output_dir=output_dir,
-        today=today,
-        num_orgs=len(orgs),
-    )
-    if not saveprefiltered:
+    for error in start_themes(process_theme, themes, theme_workers):
+        errors_on_exit.add(error)
+    if dportal_pages:
+        dportal_pages.remove()
+    elif not activities_path:
         try:
-            remove(prefiltered_path)
+            remove(join(retriever.temp_dir, dportal_filename))
         except FileNotFoundError:
             pass
-    try:
-        remove(join(output_dir, dportal_filename))
-    except FileNotFoundError:
-        pass
@@ -0,0 +1,46 @@
+"""Normalisation of org names, org refs, region names and activity identifiers"""
+import re
+from functools import lru_cache
+
+REPEATED_NON_WORD = re.compile(r"(\W)\1+")
+WHITESPACE = re.compile(r"\s")
+OUTER_PUNCTUATION = re.compile(r"^\W?([\w &]*)[^a-zA-Z0-9_\.]?$")
+
+
+def is_clean(s):
+    """Check if a stripped string is made up only of ASCII letters, digits and
+    underscores separated by single spaces, which clean_string leaves unchanged"""
+    if not s.isascii() or "  " in s:
+        return False
+    return s.replace(" ", "").replace("_", "a").isalnum()
+
+
+@lru_cache(maxsize=65536)
+def clean_stripped_string(s):
+    s = REPEATED_NON_WORD.sub(r"\1", s)
+    s = WHITESPACE.sub(" ", s)
+    s = OUTER_PUNCTUATION.sub(r"\1", s)
+    return s.strip()
+
+
+def clean_string(s):
+    # Normalise one or more whitespaces to a single space and remove any punctuation at the start/end except
+    # for any trailing full stop
+    s = s.strip()
+    if is_clean(s):
+        return s
+    return clean_stripped_string(s)
+
+
+def clean_region(region):
+    region = region.replace("unspecified", "")
+    region = region.replace("regional", "")
+    return clean_string(region)
+
+
+def normalise_identifier(identifier):
+    """Strip an activity identifier of surrounding whitespace so that it is
+    keyed the same whichever source it was read from"""
+    if identifier is None:
+        return ""
+    return identifier.strip()
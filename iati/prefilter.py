@@ -0,0 +1,235 @@
+"""Activity prefiltering of the D-Portal XML
+
+Activities can be checked serially or, since each activity is checked
+independently, in a pool of worker processes fed with chunks of raw activity
+XML split out of the D-Portal file without parsing it.
+"""
+import logging
+import re
+from io import BytesIO
+
+import diterator
+
+from .compactstore import decode_activity, encode_activity
+from .iterparse import ElementActivity, iterparse_activities
+from .lookups import Lookups
+from .smalldactivity import create_small_dactivity
+from .utilities import ordered_pool_map
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_START = re.compile(rb"<iati-activity[\s>]")
+ACTIVITY_END = b"</iati-activity>"
+ROOT_END = b"\n</iati-activities>"
+READ_SIZE = 1024 * 1024
+
+
+class PrefilterCounts:
+    def __init__(self):
+        self.no_query_activities = 0
+        self.no_removed_activities = 0
+        self.no_removed_transactions = 0
+
+    def add(self, counts):
+        self.no_query_activities += counts.no_query_activities
+        self.no_removed_activities += counts.no_removed_activities
+        self.no_removed_transactions += counts.no_removed_transactions
+
+    def log(self):
+        logger.info(f"D-Portal returned {self.no_query_activities} activities")
+        if self.no_removed_activities == 0:
+            logger.info(f"Activity Prefiltering did not remove any activities")
+        else:
+            logger.info(
+                f"Activity Prefiltering removed {self.no_removed_activities} activities"
+            )
+            no_remaining = self.no_query_activities - self.no_removed_activities
+            logger.info(f"{no_remaining} activities after Activity Prefiltering")
+        logger.info(
+            f"Activity Prefiltering removed {self.no_removed_transactions} transactions from within remaining activities"
+        )
+
+
+class ActivityChunker:
+    """Splits D-Portal XML into chunks of raw iati-activity elements without
+    parsing it. The header holds everything before the first activity ie. the
+    XML declaration and iati-activities start tag."""
+
+    def __init__(self, path, activities_per_chunk):
+        self.activities_per_chunk = activities_per_chunk
+        self.file = open(path, "rb")
+        buffer = b""
+        while True:
+            match = ACTIVITY_START.search(buffer)
+            if match:
+                self.header = buffer[: match.start()]
+                self.buffer = buffer[match.start() :]
+                return
+            block = self.file.read(READ_SIZE)
+            if not block:
+                self.header = buffer
+                self.buffer = b""
+                return
+            buffer += block
+
+    def __iter__(self):
+        buffer = self.buffer
+        self.buffer = None
+        position = 0
+        no_activities = 0
+        while True:
+            index = buffer.find(ACTIVITY_END, position)
+            if index == -1:
+                block = self.file.read(READ_SIZE)
+                if not block:
+                    break
+                buffer += block
+                continue
+            position = index + len(ACTIVITY_END)
+            no_activities += 1
+            if no_activities == self.activities_per_chunk:
+                yield buffer[:position]
+                buffer = buffer[position:]
+                position = 0
+                no_activities = 0
+        if no_activities:
+            yield buffer[:position]
+        self.file.close()
+
+
+def prefilter_activity(dactivity):
+    """Returns the number of transactions removed from the activity or None if
+    the whole activity is excluded"""
+    exclude, removed_transactions = Lookups.checks.exclude_activity(dactivity)
+    if exclude:
+        return None
+    if isinstance(dactivity, ElementActivity):
+        dactivity.remove_transactions(removed_transactions)
+    else:
+        activity_node = dactivity.node
+        transaction_nodes = dactivity.get_nodes("transaction")
+        for i in removed_transactions:
+            activity_node.removeChild(transaction_nodes[i])
+    return len(removed_transactions)
+
+
+def prefilter_stream(
+    filename_or_stream, counts, save_xml, log_progress=True, iterparse=False
+):
+    """Yields a small activity, if save_xml is True the prefiltered XML and the
+    errors raised prefiltering it for each activity remaining after
+    prefiltering. Activities are read with diterator or, if iterparse is True,
+    with ElementTree's iterparse."""
+    errors = Lookups.checks.errors_on_exit.errors
+    if iterparse:
+        xmliterator = iterparse_activities(filename_or_stream)
+    else:
+        xmliterator = diterator.XMLIterator(filename_or_stream)
+    while True:
+        no_errors = len(errors)
+        try:
+            dactivity = next(xmliterator)
+            counts.no_query_activities += 1
+            if log_progress and counts.no_query_activities % 1000 == 0:
+                logger.info(f"Read {counts.no_query_activities} activities")
+            no_removed_transactions = prefilter_activity(dactivity)
+            if no_removed_transactions is None:
+                del dactivity
+                counts.no_removed_activities += 1
+                continue
+            counts.no_removed_transactions += no_removed_transactions
+        except StopIteration:
+            break
+        except Exception as ex:
+            logger.exception(ex)
+            continue
+        xml = dactivity.node.toxml() if save_xml else None
+        yield create_small_dactivity(dactivity), xml, errors[no_errors:]
+        del dactivity
+    del xmliterator  # Maybe this helps garbage collector?
+
+
+def prefilter_chunk(header, chunk, save_xml, iterparse):
+    """Runs in a worker process. Returns the encoded small activities remaining
+    after prefiltering with their XML and errors along with the counts and all
+    errors raised."""
+    errors = Lookups.checks.errors_on_exit.errors
+    no_errors = len(errors)
+    counts = PrefilterCounts()
+    stream = BytesIO(b"".join((header, chunk, ROOT_END)))
+    results = [
+        (encode_activity(dactivity), xml, activity_errors)
+        for dactivity, xml, activity_errors in prefilter_stream(
+            stream, counts, save_xml, False, iterparse
+        )
+    ]
+    new_errors = errors[no_errors:]
+    del errors[no_errors:]
+    return results, counts, new_errors
+
+
+def get_chunks(dportal_paths, save_xml, activities_per_chunk, iterparse):
+    for dportal_path in dportal_paths:
+        chunker = ActivityChunker(dportal_path, activities_per_chunk)
+        for chunk in chunker:
+            yield chunker.header, chunk, save_xml, iterparse
+
+
+def prefilter_parallel(
+    dportal_paths, counts, save_xml, workers, activities_per_chunk, iterparse
+):
+    errors_on_exit = Lookups.checks.errors_on_exit
+    for results, chunk_counts, errors in ordered_pool_map(
+        prefilter_chunk,
+        get_chunks(dportal_paths, save_xml, activities_per_chunk, iterparse),
+        workers,
+    ):
+        for error in errors:
+            errors_on_exit.add(error)
+        no_read = counts.no_query_activities
+        counts.add(chunk_counts)
+        if no_read // 1000 != counts.no_query_activities // 1000:
+            logger.info(f"Read {counts.no_query_activities} activities")
+        for record, xml, activity_errors in results:
+            yield decode_activity(record), xml, activity_errors
+
+
+def prefilter_activities(
+    dportal_paths,
+    save_xml=False,
+    workers=1,
+    activities_per_chunk=100,
+    iterparse=False,
+    with_errors=False,
+):
+    """
+    Reads D-Portal activities from a file or an iterable of files eg. the pages
+    of a paginated download and yields a small activity and, if save_xml is
+    True, the prefiltered XML for each activity remaining after prefiltering.
+    If with_errors is True, the errors raised prefiltering each activity are
+    yielded after them. Transactions that were prefiltered out are removed.
+    """
+    if isinstance(dportal_paths, str):
+        dportal_paths = (dportal_paths,)
+    if save_xml and iterparse:
+        logger.warning("Saving prefiltered XML so reading activities with diterator")
+        iterparse = False
+    counts = PrefilterCounts()
+    if workers > 1:
+        results = prefilter_parallel(
+            dportal_paths, counts, save_xml, workers, activities_per_chunk, iterparse
+        )
+    else:
+        results = (
+            result
+            for dportal_path in dportal_paths
+            for result in prefilter_stream(
+                dportal_path, counts, save_xml, iterparse=iterparse
+            )
+        )
+    for dactivity, xml, errors in results:
+        if with_errors:
+            yield dactivity, xml, errors
+        else:
+            yield dactivity, xml
+    counts.log()
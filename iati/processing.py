@@ -0,0 +1,165 @@
+"""Processing of small activities into the flows and transactions accumulators
+
+Activities can be processed serially or sharded by activity across a pool of
+worker processes whose accumulators are merged back in activity order.
+"""
+import logging
+
+from .accumulators import Flows, Transactions
+from .activity import Activity
+from .compactstore import decode_activity
+from .lookups import Lookups
+from .utilities import chunked, ordered_pool_map
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessCounts:
+    def __init__(self):
+        self.no_activities = 0
+        self.no_unvaluable_activities = 0
+        self.no_unvaluable_transactions = 0
+        self.no_skipped_transactions = 0
+        self.no_incoming_transactions = 0
+        self.org_info_cache_hits = 0
+        self.org_info_cache_misses = 0
+        self.unknown_country_region_codes = dict()
+
+    def add(self, counts):
+        self.no_activities += counts.no_activities
+        self.no_unvaluable_activities += counts.no_unvaluable_activities
+        self.no_unvaluable_transactions += counts.no_unvaluable_transactions
+        self.no_skipped_transactions += counts.no_skipped_transactions
+        self.no_incoming_transactions += counts.no_incoming_transactions
+        self.org_info_cache_hits += counts.org_info_cache_hits
+        self.org_info_cache_misses += counts.org_info_cache_misses
+        for code, count in counts.unknown_country_region_codes.items():
+            self.unknown_country_region_codes[code] = (
+                self.unknown_country_region_codes.get(code, 0) + count
+            )
+
+    def log(self, flows, transactions):
+        logger.info(
+            f"Processing found {self.no_unvaluable_activities} activities with no transactions that could be valued"
+        )
+        logger.info(
+            f"Processing found {self.no_unvaluable_transactions} transactions that "
+            "could not be valued from within remaining activities"
+        )
+        logger.info(f"Processed {len(flows)} flows")
+        logger.info(f"Processed {len(transactions)} transactions")
+        logger.info(f"{self.no_skipped_transactions} transactions were skipped")
+        logger.info(
+            f"{self.no_incoming_transactions} incoming transactions (no net value)"
+        )
+
+
+def process_activity(dactivity, flows, transactions, counts):
+    counts.no_activities += 1
+    (
+        no_valued_transactions,
+        unvaluable_transactions,
+    ) = Lookups.checks.exclude_transactions(dactivity)
+    if no_valued_transactions == 0:
+        counts.no_unvaluable_activities += 1
+        return
+    counts.no_unvaluable_transactions += unvaluable_transactions
+    activity = Activity(dactivity)
+    skipped, incoming = activity.process(flows, transactions)
+    counts.no_skipped_transactions += skipped
+    counts.no_incoming_transactions += incoming
+
+
+def process_chunk(records):
+    """Runs in a worker process. Returns the accumulators for the encoded small
+    activities along with the counts, the reporting orgs used and any errors
+    raised."""
+    errors = Lookups.checks.errors_on_exit.errors
+    no_errors = len(errors)
+    Lookups.used_reporting_orgs = set()
+    Lookups.org_info_cache_hits = 0
+    Lookups.org_info_cache_misses = 0
+    Lookups.unknown_country_region_codes = dict()
+    flows = Flows(keep_values=True)
+    transactions = Transactions()
+    counts = ProcessCounts()
+    for record in records:
+        process_activity(decode_activity(record), flows, transactions, counts)
+    counts.org_info_cache_hits = Lookups.org_info_cache_hits
+    counts.org_info_cache_misses = Lookups.org_info_cache_misses
+    counts.unknown_country_region_codes = Lookups.unknown_country_region_codes
+    new_errors = errors[no_errors:]
+    del errors[no_errors:]
+    return flows, transactions, counts, Lookups.used_reporting_orgs, new_errors
+
+
+def process_record(record):
+    """Returns the contribution of an encoded small activity to the
+    accumulators ie. its flows, split transaction rows, counts, reporting orgs
+    used and any errors raised"""
+    errors = Lookups.checks.errors_on_exit.errors
+    no_errors = len(errors)
+    used_reporting_orgs = Lookups.used_reporting_orgs
+    Lookups.used_reporting_orgs = set()
+    flows = Flows(keep_values=True)
+    rows = list()
+    counts = ProcessCounts()
+    process_activity(decode_activity(record), flows, rows, counts)
+    contribution = (
+        flows,
+        rows,
+        counts,
+        Lookups.used_reporting_orgs,
+        errors[no_errors:],
+    )
+    del errors[no_errors:]
+    Lookups.used_reporting_orgs = used_reporting_orgs
+    return contribution
+
+
+def process_activities(
+    store, workers=1, activities_per_chunk=100, transactions=None
+):
+    """
+    Builds the flows and transactions accumulators from the small activities in
+    the store. Split transactions are added to the given transactions
+    accumulator, by default one held in memory.
+    """
+    flows = Flows()
+    if transactions is None:
+        transactions = Transactions()
+    counts = ProcessCounts()
+    if workers > 1:
+        errors_on_exit = Lookups.checks.errors_on_exit
+        for (
+            chunk_flows,
+            chunk_transactions,
+            chunk_counts,
+            used_reporting_orgs,
+            errors,
+        ) in ordered_pool_map(
+            process_chunk,
+            ((chunk,) for chunk in chunked(store.records(), activities_per_chunk)),
+            workers,
+        ):
+            for error in errors:
+                errors_on_exit.add(error)
+            flows.merge(chunk_flows)
+            transactions.extend(chunk_transactions)
+            Lookups.used_reporting_orgs.update(used_reporting_orgs)
+            no_processed = counts.no_activities
+            counts.add(chunk_counts)
+            if no_processed // 1000 != counts.no_activities // 1000:
+                logger.info(f"Processed {counts.no_activities} activities")
+        Lookups.org_info_cache_hits += counts.org_info_cache_hits
+        Lookups.org_info_cache_misses += counts.org_info_cache_misses
+        Lookups.unknown_country_region_codes = counts.unknown_country_region_codes
+    else:
+        for dactivity in store.activities():
+            process_activity(dactivity, flows, transactions, counts)
+            if counts.no_activities % 1000 == 0:
+                logger.info(f"Processed {counts.no_activities} activities")
+    counts.log(flows, transactions)
+    Lookups.log_org_info_cache_stats()
+    Lookups.log_unknown_country_region_codes()
+    return flows, transactions
@@ -0,0 +1,127 @@
+"""Local snapshot cache of reference data
+
+The lookup tables built from the org and region files, the exclusion sheets,
+the sector maps are stored already normalised as pickles so that a run can
+start without downloading or parsing them again. The secondary exchange rates
+files are stored as they were downloaded and copied out to be read.
+Each entry is named after a hash of its sources as given, eg. their paths and
+urls, followed by a hash of the cache version and its sources where a local
+file source is identified by a hash of its contents so that entries are
+invalidated when the file or the cache format changes. Writing an entry
+removes only the entries it supersedes, those for the same sources, so that
+runs with other sources can share the cache folder. Entries with remote
+sources are used until they are older than the time to live after which they
+are read again and, if their contents have not changed, kept with a refreshed
+time. In offline mode, entries are used whatever their age and a missing
+entry is an error.
+"""
+import hashlib
+import logging
+import pickle
+from glob import glob
+from os import getpid, makedirs, remove, replace, utime
+from os.path import exists, getmtime, join
+from time import time
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def get_source_key(source):
+    """Returns the contents hash of a local file or the url otherwise"""
+    if exists(source):
+        with open(source, "rb") as file:
+            return "sha256:" + hashlib.sha256(file.read()).hexdigest()
+    return source
+
+
+class ReferenceCache:
+    def __init__(self, cache_dir, ttl=DEFAULT_TTL, offline=False):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.offline = offline
+        makedirs(cache_dir, exist_ok=True)
+
+    def get_prefix(self, name, sources):
+        """Returns the start of the path of every entry for the sources"""
+        digest = hashlib.sha256(repr((name, tuple(sources))).encode("utf-8"))
+        return join(self.cache_dir, f"{name}-{digest.hexdigest()[:16]}")
+
+    def get_path(self, name, sources):
+        source_keys = [get_source_key(source) for source in sources]
+        is_remote = any(key == source for key, source in zip(source_keys, sources))
+        digest = hashlib.sha256(
+            repr((CACHE_VERSION, name, source_keys)).encode("utf-8")
+        ).hexdigest()
+        prefix = self.get_prefix(name, sources)
+        return f"{prefix}-{digest[:16]}.pickle", is_remote
+
+    def load(self, name, sources, read):
+        """Returns the cached value for the sources, calling read to get it if
+        the cache does not have it or it has expired. read can return None if
+        the value should not be cached eg. because a download failed."""
+        path, is_remote = self.get_path(name, sources)
+        if exists(path):
+            age = time() - getmtime(path)
+            if self.offline or not is_remote or age < self.ttl:
+                logger.info(f"Using cached {name} from {path}")
+                with open(path, "rb") as file:
+                    return pickle.load(file)
+        elif self.offline:
+            raise FileNotFoundError(
+                f"No cached {name} in {self.cache_dir} to run offline!"
+            )
+        value = read()
+        if value is None:
+            return None
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if exists(path):
+            with open(path, "rb") as file:
+                unchanged = file.read() == data
+            if unchanged:
+                logger.info(f"Revalidated cached {name}")
+                utime(path)
+                return value
+        # Write then rename so that concurrent runs never read a partial entry
+        temp_path = f"{path}.{getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        replace(temp_path, path)
+        # Entries for other sources are left for the runs that use them
+        for stale_path in glob(f"{self.get_prefix(name, sources)}-*.pickle"):
+            if stale_path != path:
+                try:
+                    remove(stale_path)
+                except FileNotFoundError:
+                    pass
+        logger.info(f"Cached {name} in {path}")
+        return value
+
+    def load_file(self, name, sources, read):
+        """Returns the path of a copy in the cache folder, named name, of the
+        cached file for the sources, calling read to get the path of the file
+        if the cache does not have it or it has expired. read can return None
+        if the file should not be cached in which case None is returned."""
+
+        def read_contents():
+            path = read()
+            if path is None:
+                return None
+            with open(path, "rb") as file:
+                return file.read()
+
+        contents = self.load(name, sources, read_contents)
+        if contents is None:
+            return None
+        path = join(self.cache_dir, name)
+        if exists(path):
+            with open(path, "rb") as file:
+                if file.read() == contents:
+                    return path
+        temp_path = f"{path}.{getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(contents)
+        replace(temp_path, path)
+        return path
@@ -0,0 +1,177 @@
+"""Per-stage run report
+
+Each stage of a run records its wall time, CPU time of the process and of the
+worker processes that finished during it, the peak resident set size so far,
+how much the stage raised that peak and the number of items it handled, from
+which its throughput follows. The peak so far carries over from earlier
+stages, so memory regressions are found from each stage's growth of the peak. The
+report is written as JSON next to the outputs so that the stage which
+regresses as a theme's query grows can be seen.
+
+When profiling, each stage is also run under cProfile and tracemalloc, and its
+hot paths by cumulative time and its largest allocations are dumped to the
+profile folder.
+"""
+import cProfile
+import json
+import logging
+import pstats
+import sys
+import tracemalloc
+from datetime import datetime, timezone
+from os import makedirs, times
+from os.path import join
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+REPORT_FILENAME = "run_report.json"
+NO_PROFILE_LINES = 40
+NO_ALLOCATION_LINES = 25
+
+
+def get_peak_rss_mb(children=False):
+    """Peak resident set size of the process or of its largest finished child"""
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux gives KB and macOS bytes
+    if sys.platform == "darwin":
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+
+class Stage:
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = None
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.child_cpu_seconds = None
+        self.peak_rss_mb = None
+        self.rss_growth_mb = None
+        self.child_peak_rss_mb = None
+        self.traced_peak_mb = None
+
+    def to_dict(self):
+        stage = {
+            "name": self.name,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "cpu_seconds": round(self.cpu_seconds, 3),
+            "child_cpu_seconds": round(self.child_cpu_seconds, 3),
+            "peak_rss_mb": self.peak_rss_mb,
+            "rss_growth_mb": self.rss_growth_mb,
+            "child_peak_rss_mb": self.child_peak_rss_mb,
+            "items": self.items,
+            "unit": self.unit,
+        }
+        if self.items is not None and self.wall_seconds > 0:
+            stage["items_per_second"] = round(self.items / self.wall_seconds, 1)
+        if self.traced_peak_mb is not None:
+            stage["traced_peak_mb"] = self.traced_peak_mb
+        return stage
+
+
+class RunReport:
+    def __init__(self, name, profile_dir=None):
+        self.name = name
+        self.profile_dir = profile_dir
+        self.started = datetime.now(timezone.utc).isoformat()
+        self.stages = list()
+        if profile_dir:
+            makedirs(profile_dir, exist_ok=True)
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    def stage(self, name, unit="activities"):
+        """Context manager timing a stage. Set the items attribute of the stage
+        it gives to the number of items handled."""
+        return StageTimer(self, Stage(name, unit))
+
+    def dump_profile(self, stage, profiler, snapshot):
+        prefix = join(self.profile_dir, f"{len(self.stages):02d}_{stage.name}")
+        profiler.dump_stats(f"{prefix}.prof")
+        with open(f"{prefix}_profile.txt", "w") as file:
+            stats = pstats.Stats(profiler, stream=file)
+            stats.sort_stats("cumulative").print_stats(NO_PROFILE_LINES)
+        with open(f"{prefix}_allocations.txt", "w") as file:
+            for statistic in snapshot.statistics("lineno")[:NO_ALLOCATION_LINES]:
+                file.write(f"{statistic}\n")
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started": self.started,
+            "wall_seconds": round(sum(stage.wall_seconds for stage in self.stages), 3),
+            "cpu_seconds": round(sum(stage.cpu_seconds for stage in self.stages), 3),
+            "child_cpu_seconds": round(
+                sum(stage.child_cpu_seconds for stage in self.stages), 3
+            ),
+            "peak_rss_mb": get_peak_rss_mb(),
+            "stages": [stage.to_dict() for stage in self.stages],
+        }
+
+    def save(self, output_dir):
+        path = join(output_dir, REPORT_FILENAME)
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+        logger.info(f"Wrote run report to {path}")
+
+
+class StageTimer:
+    def __init__(self, report, stage):
+        self.report = report
+        self.stage = stage
+        self.profiler = None
+
+    def __enter__(self):
+        if self.report.profile_dir:
+            tracemalloc.reset_peak()
+            self.profiler = cProfile.Profile()
+        self.start_peak_rss_mb = get_peak_rss_mb()
+        self.start_times = times()
+        self.start_wall = perf_counter()
+        if self.profiler:
+            self.profiler.enable()
+        return self.stage
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profiler:
+            self.profiler.disable()
+        stage = self.stage
+        stage.wall_seconds = perf_counter() - self.start_wall
+        end_times = times()
+        # The clock ticks of os.times can differ by a rounding error
+        stage.cpu_seconds = max(
+            end_times.user
+            + end_times.system
+            - self.start_times.user
+            - self.start_times.system,
+            0.0,
+        )
+        stage.child_cpu_seconds = max(
+            end_times.children_user
+            + end_times.children_system
+            - self.start_times.children_user
+            - self.start_times.children_system,
+            0.0,
+        )
+        stage.peak_rss_mb = get_peak_rss_mb()
+        if stage.peak_rss_mb is not None:
+            stage.rss_growth_mb = round(stage.peak_rss_mb - self.start_peak_rss_mb, 1)
+        stage.child_peak_rss_mb = get_peak_rss_mb(children=True)
+        if self.profiler:
+            _, traced_peak = tracemalloc.get_traced_memory()
+            stage.traced_peak_mb = round(traced_peak / 1024 / 1024, 1)
+            self.report.dump_profile(stage, self.profiler, tracemalloc.take_snapshot())
+        if exc_type is None:
+            self.report.stages.append(stage)
+            items = "" if stage.items is None else f" {stage.items} {stage.unit} in"
+            logger.info(f"Stage {stage.name}:{items} {stage.wall_seconds:.1f}s")
@@ -0,0 +1,25 @@
+from weakref import WeakValueDictionary
+
+
+class SmallCodedItem:
+    """Flattened code, type, vocabulary and percentage of a sector, country,
+    region etc. Items are never modified so identical ones are shared while
+    any of them is in use."""
+
+    __slots__ = ["code", "type", "vocabulary", "percentage", "__weakref__"]
+    interned = WeakValueDictionary()
+
+    def __init__(self, code, item_type, vocabulary, percentage):
+        self.code = code
+        self.type = item_type
+        self.vocabulary = vocabulary
+        self.percentage = percentage
+
+    @classmethod
+    def get(cls, code, item_type, vocabulary, percentage):
+        key = (code, item_type, vocabulary, percentage)
+        item = cls.interned.get(key)
+        if item is None:
+            item = cls(code, item_type, vocabulary, percentage)
+            cls.interned[key] = item
+        return item
@@ -16,7 +16,7 @@ class SmallDActivity:
         "transactions",
     ]
 
-    def __init__(self, dactivity, activity_is_strict):
+    def __init__(self, dactivity, activity_is_strict, dtransactions=None):
         self.identifier = dactivity.identifier
         self.reporting_org = flatten(dactivity.reporting_org)
         self.sectors = flatten(dactivity.sectors)
@@ -25,12 +25,16 @@ class SmallDActivity:
         self.recipient_regions = flatten(dactivity.recipient_regions)
         self.participating_orgs = flatten(dactivity.participating_orgs)
         self.participating_orgs_by_role = flatten(dactivity.participating_orgs_by_role)
+        if dtransactions is None:
+            dtransactions = dactivity.transactions
         self.transactions = [
             create_small_transaction(dactivity, activity_is_strict, dtransaction)
-            for dtransaction in dactivity.transactions
+            for dtransaction in dtransactions
         ]
 
 
-def create_small_dactivity(dactivity):
+def create_small_dactivity(dactivity, dtransactions=None):
+    """Creates a small activity from the activity with its transactions or
+    the given ones eg. those remaining after prefiltering"""
     activity_is_strict = Lookups.checks.get_activity_is_strict(dactivity)
-    return SmallDActivity(dactivity, activity_is_strict)
+    return SmallDActivity(dactivity, activity_is_strict, dtransactions)
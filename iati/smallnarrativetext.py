@@ -2,7 +2,7 @@ import iati.utilities as flatten
 
 
 class SmallNarrativeText:
-    __slots__ = ["defaulttext", "narratives"]
+    __slots__ = ["defaulttext", "narratives", "lowered_narratives"]
 
     def __init__(self, narrativetext):
         self.defaulttext = str(narrativetext)
@@ -10,3 +10,14 @@ class SmallNarrativeText:
 
     def __str__(self):
         return self.defaulttext
+
+    def get_lowered_narratives(self):
+        """Lowercased narratives, kept for the text checks of the title and
+        description which are repeated for each transaction"""
+        try:
+            return self.lowered_narratives
+        except AttributeError:
+            self.lowered_narratives = [
+                text.lower() for text in self.narratives.values()
+            ]
+            return self.lowered_narratives
@@ -0,0 +1,10 @@
+class SmallOrganisation:
+    """Flattened name, ref, role and type of an organisation"""
+
+    __slots__ = ["name", "ref", "role", "type"]
+
+    def __init__(self, name, ref, role, org_type):
+        self.name = name
+        self.ref = ref
+        self.role = role
+        self.type = org_type
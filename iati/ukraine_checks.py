@@ -6,7 +6,7 @@ class UkraineChecks(BaseChecks):
         super().__init__(today, start_date, errors_on_exit)
         self.include_scope = True
         self.excluded_aid_types = ("A01", "A02", "F01")
-        self.relevant_words = ("ukraine", "ukrainian")
+        self.relevant_words.add("ukraine", "ukrainian")
 
         # Check if the Ukraine code is present
         def check_scope(scope):
@@ -1,8 +1,21 @@
+import re
+from collections import deque
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import islice
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from traceback import format_exc
+
 from dateutil.parser import ParserError
 from diterator.wrappers import CodedItem, NarrativeText, Organisation
 from hdx.utilities.dateparse import parse_date
 
+from .smallcodeditem import SmallCodedItem
 from .smallnarrativetext import SmallNarrativeText
+from .smallorganisation import SmallOrganisation
+
+ISO_DATE = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}")
 
 
 def flatten(obj):
@@ -13,45 +26,108 @@ def flatten(obj):
     elif isinstance(obj, NarrativeText):
         return SmallNarrativeText(obj)
     elif isinstance(obj, CodedItem):
-        return type(
-            "",
-            (object,),
-            {
-                "code": obj.code,
-                "type": obj.type,
-                "vocabulary": obj.vocabulary,
-                "percentage": obj.percentage,
-            },
-        )()
+        return SmallCodedItem.get(obj.code, obj.type, obj.vocabulary, obj.percentage)
     elif isinstance(obj, Organisation):
-        return type(
-            "",
-            (object,),
-            {
-                "name": flatten(obj.name),
-                "ref": obj.ref,
-                "role": obj.role,
-                "type": obj.type,
-            },
-        )()
+        return SmallOrganisation(flatten(obj.name), obj.ref, obj.role, obj.type)
     else:
         return obj
 
 
-def get_date_with_fallback(date1, date2):
-    output_date = date1
-    if output_date:
+@lru_cache(maxsize=65536)
+def parse_iati_date(string):
+    """Parse a date string as parse_date does returning None if it cannot be
+    parsed. Plain YYYY-MM-DD dates are handled without dateutil."""
+    if ISO_DATE.fullmatch(string):
         try:
-            output_date = parse_date(output_date)
-        except ParserError:
-            output_date = None
-    if not output_date:
-        output_date = date2
-        if output_date:
-            try:
-                output_date = parse_date(output_date)
-            except ParserError:
-                output_date = None
-        else:
-            output_date = None
+            return datetime(
+                int(string[:4]), int(string[5:7]), int(string[8:]), tzinfo=timezone.utc
+            )
+        except ValueError:
+            # Leave any out of range dates to dateutil
+            pass
+    try:
+        return parse_date(string)
+    except ParserError:
+        return None
+
+
+def get_date_with_fallback(date1, date2):
+    output_date = None
+    if date1:
+        output_date = parse_iati_date(date1)
+    if not output_date and date2:
+        output_date = parse_iati_date(date2)
     return output_date
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def ordered_pool_map(function, args_iterable, workers):
+    """Runs function over args_iterable in a pool of worker processes, yielding
+    the results in submission order. Workers are forked so that they inherit
+    the lookups and checks set up so far. The number of tasks in flight is
+    bounded so that args_iterable is consumed no faster than results are."""
+    with get_context("fork").Pool(workers) as pool:
+        pending = deque()
+        for args in args_iterable:
+            pending.append(pool.apply_async(function, args))
+            if len(pending) > 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def _send_result(writer, function, args):
+    try:
+        result = function(*args), None
+    except Exception:
+        result = None, format_exc()
+    writer.send(result)
+    writer.close()
+
+
+def forked_process_map(function, args_list, workers):
+    """Runs function for each of args_list in a process of its own, at most
+    workers at a time, returning the results in order. Processes are forked so
+    that each inherits the state set up so far but none sees the changes made
+    by another. Once all have finished, a RuntimeError is raised if any
+    failed."""
+    context = get_context("fork")
+    results = [None] * len(args_list)
+    failures = list()
+    running = dict()
+
+    def finish():
+        for reader in wait(list(running)):
+            index, process = running.pop(reader)
+            try:
+                results[index], failure = reader.recv()
+            except EOFError:
+                # The process died before sending its result
+                process.join()
+                failure = f"Process exited with code {process.exitcode}"
+            reader.close()
+            process.join()
+            if failure:
+                failures.append(f"{args_list[index]} failed:\n{failure}")
+
+    for index, args in enumerate(args_list):
+        while len(running) >= workers:
+            finish()
+        reader, writer = context.Pipe(duplex=False)
+        process = context.Process(target=_send_result, args=(writer, function, args))
+        process.start()
+        writer.close()
+        running[reader] = index, process
+    while running:
+        finish()
+    if failures:
+        raise RuntimeError("\n".join(failures))
+    return results
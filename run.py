@@ -12,7 +12,9 @@ from hdx.utilities.easy_logging import setup_logging
 from hdx.utilities.errors_onexit import ErrorsOnExit
 from hdx.utilities.retriever import Retrieve
 
-from iati.main import start
+from iati import checks
+from iati.main import setup_reference_data, start, start_fanout, start_themes
+from iati.referencecache import ReferenceCache
 
 setup_logging()
 logger = logging.getLogger()
@@ -45,15 +47,141 @@ def parse_args():
         help="Parameters for DPortal query (eg. limit X, offset Y)",
     )
     parser.add_argument(
-        "-wh", "--what", default="covid", help="What to run eg. covid, ebola"
+        "-wh",
+        "--what",
+        default=None,
+        help="What to run eg. covid, ebola or several eg. covid,ebola. Defaults to "
+        "covid or, with --fanout or --activities_file, all",
     )
     parser.add_argument(
         "-df", "--date_filter", default=None, help="Start date of date filter"
     )
     parser.add_argument(
-        "-sp", "--save_prefiltered", default=False, action="store_true", help="Save prefiltered DPortal XML"
+        "-sp",
+        "--save_prefiltered",
+        default=False,
+        action="store_true",
+        help="Save prefiltered DPortal XML",
+    )
+    parser.add_argument(
+        "-1p",
+        "--single_pass",
+        default=False,
+        action="store_true",
+        help="Parse DPortal XML only once",
+    )
+    parser.add_argument(
+        "-wk",
+        "--workers",
+        default=1,
+        type=int,
+        help="Number of worker processes to use",
+    )
+    parser.add_argument(
+        "-sr",
+        "--sort_max_rows",
+        default=None,
+        type=int,
+        help="Maximum transactions to sort in memory",
+    )
+    parser.add_argument(
+        "-sm",
+        "--sort_max_mb",
+        default=None,
+        type=int,
+        help="Maximum MB of transactions to sort in memory",
+    )
+    parser.add_argument(
+        "-ip",
+        "--iterparse",
+        default=False,
+        action="store_true",
+        help="Read DPortal XML with iterparse instead of diterator",
+    )
+    parser.add_argument(
+        "-cd", "--cache_dir", default=None, help="Reference data cache folder"
+    )
+    parser.add_argument(
+        "-ct",
+        "--cache_ttl",
+        default=24,
+        type=float,
+        help="Hours before cached reference data is downloaded again",
+    )
+    parser.add_argument(
+        "-ol",
+        "--offline",
+        default=False,
+        action="store_true",
+        help="Run only from cached reference data and exchange rates",
+    )
+    parser.add_argument(
+        "-st",
+        "--state_dir",
+        default=None,
+        help="Incremental state folder. Only activities updated since the last run are downloaded",
+    )
+    parser.add_argument(
+        "-fr",
+        "--full_refresh",
+        default=False,
+        action="store_true",
+        help="Download all activities into the incremental state",
+    )
+    parser.add_argument(
+        "-ps",
+        "--page_size",
+        default=None,
+        type=int,
+        help="Download DPortal activities in pages of this size",
+    )
+    parser.add_argument(
+        "-cp",
+        "--checkpoint_dir",
+        default=None,
+        help="Folder of downloaded DPortal pages to resume from. Defaults to one in "
+        "the output folder, which is not kept between runs",
+    )
+    parser.add_argument(
+        "-tw",
+        "--theme_workers",
+        default=None,
+        type=int,
+        help="Number of themes to run at once. Defaults to all themes",
+    )
+    parser.add_argument(
+        "-fo",
+        "--fanout",
+        default=False,
+        action="store_true",
+        help="Download the activities of all themes at once and read each activity once",
+    )
+    parser.add_argument(
+        "-af",
+        "--activities_file",
+        default=None,
+        help="Read the activities of all themes from this IATI XML file instead of "
+        "downloading them. Themes are found by their checks not their queries",
+    )
+    parser.add_argument(
+        "-pf",
+        "--profile",
+        default=False,
+        action="store_true",
+        help="Profile each stage into a profile folder in the output folder",
     )
     args = parser.parse_args()
+    if args.offline and not args.cache_dir:
+        parser.error("--offline needs --cache_dir")
+    if args.fanout or args.activities_file:
+        if args.state_dir:
+            parser.error(
+                "--state_dir cannot be used with --fanout or --activities_file"
+            )
+        if args.save_prefiltered:
+            parser.error(
+                "--save_prefiltered cannot be used with --fanout or --activities_file"
+            )
     return args
 
 
@@ -66,36 +194,133 @@ def main(
     whattorun,
     startdate,
     saveprefiltered,
+    single_pass,
+    workers,
+    sort_max_rows,
+    sort_max_mb,
+    iterparse,
+    cache_dir,
+    cache_ttl,
+    offline,
+    state_dir,
+    full_refresh,
+    page_size,
+    checkpoint_dir,
+    theme_workers,
+    fanout,
+    activities_file,
+    profile,
     **ignore,
 ):
     logger.info(f"##### {lookup} version {VERSION:.1f} ####")
     configuration = Configuration.read()
-    with ErrorsOnExit() as errors_on_exit:
-        output_dir = f"{output_dir}_{whattorun}"
-        rmtree(output_dir, ignore_errors=True)
-        mkdir(output_dir)
+    if cache_dir:
+        reference_cache = ReferenceCache(
+            cache_dir, ttl=cache_ttl * 60 * 60, offline=offline
+        )
+    else:
+        reference_cache = None
+    today = datetime.utcnow().isoformat()
+    if whattorun:
+        themes = whattorun.split(",")
+    elif fanout or activities_file:
+        themes = list(checks)
+    else:
+        themes = ["covid"]
+    for whattorun in themes:
+        theme_output_dir = f"{output_dir}_{whattorun}"
+        rmtree(theme_output_dir, ignore_errors=True)
+        mkdir(theme_output_dir)
+
+    def get_retriever(downloader, whattorun):
+        return Retrieve(
+            downloader,
+            configuration["fallback_dir"],
+            f"{saved_dir}_{whattorun}",
+            f"{output_dir}_{whattorun}",
+            save,
+            use_saved,
+        )
+
+    def run_theme(whattorun, errors_on_exit, theme_sector_lookups=None):
         with Download() as downloader:
-            retriever = Retrieve(
-                downloader,
-                configuration["fallback_dir"],
-                f"{saved_dir}_{whattorun}",
-                output_dir,
-                save,
-                use_saved,
-            )
-            today = datetime.utcnow().isoformat()
             start(
                 configuration,
                 today,
-                retriever,
-                output_dir,
+                get_retriever(downloader, whattorun),
+                f"{output_dir}_{whattorun}",
                 dportal_params,
                 whattorun,
                 startdate,
                 saveprefiltered,
                 errors_on_exit,
+                single_pass=single_pass,
+                workers=workers,
+                sort_max_rows=sort_max_rows,
+                sort_max_mb=sort_max_mb,
+                iterparse=iterparse,
+                reference_cache=reference_cache,
+                state_dir=f"{state_dir}_{whattorun}" if state_dir else None,
+                full_refresh=full_refresh,
+                page_size=page_size,
+                checkpoint_dir=(
+                    f"{checkpoint_dir}_{whattorun}" if checkpoint_dir else None
+                ),
+                theme_sector_lookups=theme_sector_lookups,
+                profile=profile,
             )
 
+    with ErrorsOnExit() as errors_on_exit:
+        if fanout or activities_file:
+            # One download or file of activities is read once for all themes
+            with Download() as downloader:
+                start_fanout(
+                    configuration,
+                    today,
+                    get_retriever(downloader, themes[0]),
+                    {whattorun: f"{output_dir}_{whattorun}" for whattorun in themes},
+                    dportal_params,
+                    startdate,
+                    errors_on_exit,
+                    workers=workers,
+                    sort_max_rows=sort_max_rows,
+                    sort_max_mb=sort_max_mb,
+                    iterparse=iterparse,
+                    reference_cache=reference_cache,
+                    page_size=page_size,
+                    checkpoint_dir=(
+                        f"{checkpoint_dir}_{'_'.join(themes)}"
+                        if checkpoint_dir
+                        else None
+                    ),
+                    activities_path=activities_file,
+                    theme_workers=theme_workers or len(themes),
+                    profile=profile,
+                )
+            return
+        if len(themes) == 1:
+            run_theme(themes[0], errors_on_exit)
+            return
+        # Reference data is set up once, saved with the first theme, and
+        # inherited by the processes running the themes
+        with Download() as downloader:
+            theme_sector_lookups = setup_reference_data(
+                configuration,
+                get_retriever(downloader, themes[0]),
+                themes,
+                reference_cache,
+            )
+
+        def run_forked_theme(whattorun):
+            theme_errors_on_exit = ErrorsOnExit()
+            run_theme(whattorun, theme_errors_on_exit, theme_sector_lookups)
+            return theme_errors_on_exit.errors
+
+        for error in start_themes(
+            run_forked_theme, themes, theme_workers or len(themes)
+        ):
+            errors_on_exit.add(error)
+
 
 if __name__ == "__main__":
     args = parse_args()
@@ -113,4 +338,20 @@ if __name__ == "__main__":
         whattorun=args.what,
         startdate=args.date_filter,
         saveprefiltered=args.save_prefiltered,
+        single_pass=args.single_pass,
+        workers=args.workers,
+        sort_max_rows=args.sort_max_rows,
+        sort_max_mb=args.sort_max_mb,
+        iterparse=args.iterparse,
+        cache_dir=args.cache_dir,
+        cache_ttl=args.cache_ttl,
+        offline=args.offline,
+        state_dir=args.state_dir,
+        full_refresh=args.full_refresh,
+        page_size=args.page_size,
+        checkpoint_dir=args.checkpoint_dir,
+        theme_workers=args.theme_workers,
+        fanout=args.fanout,
+        activities_file=args.activities_file,
+        profile=args.profile,
     )
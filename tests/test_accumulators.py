@@ -0,0 +1,91 @@
+from random import Random
+
+from hdx.utilities.path import temp_dir
+
+from iati.accumulators import SpillingTransactions, Transactions
+
+
+def make_rows(seed, no_rows):
+    random = Random(seed)
+    rows = list()
+    for _ in range(no_rows):
+        rows.append(
+            [
+                f"2021-{random.randint(1, 3):02d}",
+                random.choice(("org-1", "org-2", "org-3")),
+                random.choice(("Org A", "Org B")),
+                random.choice(("10", "22")),
+                random.choice(("Health", "Education", "Agriculture")),
+                random.choice(("Afghanistan", "Somalia")),
+                random.randint(0, 1),
+                random.randint(0, 1),
+                random.choice(("commitments", "spending")),
+                f"ACT-{random.randint(1, 5)}",
+                random.randint(-10, 10),
+                random.randint(-10, 10),
+            ]
+        )
+    return rows
+
+
+def original_sort(rows):
+    return sorted(
+        rows,
+        key=lambda x: (x[0], x[2], x[3], x[4], x[5], x[6], x[7], x[8], x[9], x[10]),
+    )
+
+
+class TestTransactions:
+    def test_sorted_rows(self):
+        rows = make_rows(1, 2000)
+        transactions = Transactions()
+        for row in rows[:1200]:
+            transactions.append(row)
+        other = Transactions()
+        for row in rows[1200:]:
+            other.append(row)
+        transactions.extend(other)
+        assert len(transactions) == 2000
+        sorted_rows = transactions.get_sorted_rows()
+        expected = original_sort(rows)
+        assert len(sorted_rows) == 2000
+        assert list(sorted_rows) == expected
+        assert sorted_rows[0] == expected[0]
+        assert sorted_rows[-1] == expected[-1]
+        assert list(sorted_rows[:-1]) == expected[:-1]
+
+    def test_fallbacks(self):
+        rows = make_rows(2, 100)
+        rows[5][0] = "2020-12"
+        rows[5][3] = None
+        rows[7][11] = 10**20
+        rows[9][10] = -(10**20)
+        transactions = Transactions()
+        for row in rows:
+            transactions.append(row)
+        # None org types are only compared with other org types if everything
+        # before them is the same
+        assert list(transactions.get_sorted_rows()) == original_sort(rows)
+
+    def test_spilling(self):
+        rows = make_rows(3, 2000)
+        expected = original_sort(rows)
+        with temp_dir("TestSpillingTransactions") as tempdir:
+            transactions = SpillingTransactions(max_rows=37, spill_dir=tempdir)
+            for row in rows[:1000]:
+                transactions.append(row)
+            other = Transactions()
+            for row in rows[1000:]:
+                other.append(row)
+            transactions.extend(other)
+            assert len(transactions.runs) == 28
+            sorted_rows = transactions.get_sorted_rows()
+            assert len(sorted_rows) == 2000
+            assert list(sorted_rows) == expected
+
+            transactions = SpillingTransactions(max_bytes=4000, spill_dir=tempdir)
+            transactions.check_every = 10
+            for row in rows:
+                transactions.append(row)
+            assert len(transactions.runs) > 1
+            assert list(transactions.get_sorted_rows()) == expected
@@ -0,0 +1,86 @@
+import filecmp
+from os.path import join
+
+from hdx.utilities.dateparse import parse_date
+from hdx.utilities.errors_onexit import ErrorsOnExit
+from hdx.utilities.loader import load_yaml
+from hdx.utilities.path import temp_dir
+
+from benchmarks.pipeline import compare
+from benchmarks.synthetic import SyntheticActivities
+from iati import checks
+from iati.lookups import Lookups
+from iati.prefilter import prefilter_activities
+
+
+class TestBenchmarks:
+    def test_synthetic_activities(self):
+        parameters = {
+            "no_activities": 20,
+            "transactions_per_activity": 3,
+            "countries_per_transaction": 2,
+            "sectors_per_transaction": 1,
+            "no_orgs": 10,
+        }
+        Lookups.clear()
+        Lookups.configuration = load_yaml(
+            join("tests", "config", "project_configuration.yml")
+        )
+        Lookups.checks = checks["covid"](
+            parse_date("2022-12-05"), parse_date("2020-01-01"), ErrorsOnExit()
+        )
+        with temp_dir("test_synthetic", delete_if_exists=True) as folder:
+            path = join(folder, "dportal.xml")
+            SyntheticActivities(**parameters).write(path)
+            other_path = join(folder, "dportal_other.xml")
+            SyntheticActivities(**parameters).write(other_path)
+            assert filecmp.cmp(path, other_path, shallow=False)
+            dactivities = [
+                dactivity
+                for dactivity, _ in prefilter_activities(path, iterparse=True)
+            ]
+        # The activities all pass the covid checks
+        assert len(dactivities) == 20
+        dactivity = dactivities[0]
+        assert len(dactivity.transactions) == 3
+        dtransaction = dactivity.transactions[0]
+        # The COVID-19 title makes the activity strict
+        assert dtransaction.is_strict == 1
+        assert len(dtransaction.recipient_countries) + len(
+            dtransaction.recipient_regions
+        ) == 2
+        assert len(dtransaction.sectors) == 1
+        names = {str(dactivity.reporting_org.name) for dactivity in dactivities}
+        assert len(names) <= 10
+        Lookups.clear()
+
+    def test_compare(self):
+        baseline = {
+            "components": {
+                "parse": {"wall_seconds": 2.0, "rss_growth_mb": 100},
+                "lookups": {"wall_seconds": 0.01, "rss_growth_mb": 0},
+                "checks": {"wall_seconds": 1.0, "rss_growth_mb": 2},
+            }
+        }
+        results = {
+            "components": {
+                "parse": {"wall_seconds": 2.4, "rss_growth_mb": 120},
+                "lookups": {"wall_seconds": 0.05, "rss_growth_mb": 12},
+                "checks": {"wall_seconds": 1.0, "rss_growth_mb": 0},
+                "processing": {"wall_seconds": 5.0, "rss_growth_mb": 500},
+            }
+        }
+        assert compare(results, baseline, 0.25, 0.1) == []
+        # A stage's memory regression is not carried over to later stages
+        results["components"]["parse"] = {"wall_seconds": 2.6, "rss_growth_mb": 130}
+        results["components"]["lookups"]["rss_growth_mb"] = 20
+        assert compare(results, baseline, 0.25, 0.1) == [
+            "components parse took 2.60s against 2.00s",
+            "components parse grew memory by 130MB against 100MB",
+            "components lookups grew memory by 20MB against 0MB",
+        ]
+        # Baselines recorded before memory growth are compared on time only
+        del baseline["components"]["parse"]["rss_growth_mb"]
+        assert compare(results, baseline, 0.25, 0.1)[1:] == [
+            "components lookups grew memory by 20MB against 0MB",
+        ]
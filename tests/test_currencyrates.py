@@ -0,0 +1,128 @@
+import shutil
+from datetime import datetime, timezone
+from os.path import join
+from pathlib import Path
+
+import pytest
+from hdx.location.currency import Currency, CurrencyError
+from hdx.utilities.downloader import Download
+from hdx.utilities.loader import load_yaml
+from hdx.utilities.path import temp_dir
+from hdx.utilities.retriever import Retrieve
+
+from iati.currencyrates import CURRENCY_FOLDER, CurrencyRates
+from iati.referencecache import ReferenceCache
+
+
+class TestCurrencyRates:
+    @pytest.fixture
+    def currency(self, monkeypatch):
+        """Currency with a rate for GBP on one date and no rates offline"""
+        calls = list()
+
+        def get_historic_value_in_usd(value, currency, date):
+            calls.append((currency, date))
+            if currency == "GBP" and date == datetime(2020, 6, 1, tzinfo=timezone.utc):
+                return value / 0.8
+            if currency == "EUR":
+                raise FileNotFoundError("No saved rate")
+            raise CurrencyError(f"Failed to get rate for currency {currency}!")
+
+        monkeypatch.setattr(
+            Currency, "get_historic_value_in_usd", get_historic_value_in_usd
+        )
+        yield calls
+        CurrencyRates.cache = None
+
+    def test_get_historic_value_in_usd(self, currency):
+        date = datetime(2020, 6, 1, tzinfo=timezone.utc)
+        assert CurrencyRates.get_historic_value_in_usd(80, "GBP", date) == 100
+        # Rates are not memoized so Currency's fallbacks apply on every call
+        CurrencyRates.get_historic_value_in_usd(80, "GBP", date)
+        assert currency == [("GBP", date), ("GBP", date)]
+        with pytest.raises(CurrencyError):
+            CurrencyRates.get_historic_value_in_usd(100, "XOF", date)
+
+    def test_offline_failure(self, currency):
+        date = datetime(2020, 1, 15, tzinfo=timezone.utc)
+        with pytest.raises(FileNotFoundError):
+            CurrencyRates.get_historic_value_in_usd(100, "EUR", date)
+        with temp_dir("test_currency_offline_failure") as folder:
+            CurrencyRates.cache = ReferenceCache(folder, offline=True)
+            # Offline, a rate that was never saved excludes the transaction
+            with pytest.raises(CurrencyError):
+                CurrencyRates.get_historic_value_in_usd(100, "EUR", date)
+
+    def test_setup_currency(self, monkeypatch):
+        setups = list()
+
+        def setup(**kwargs):
+            setups.append(kwargs)
+
+        monkeypatch.setattr(Currency, "setup", setup)
+        configuration = load_yaml(join("tests", "config", "project_configuration.yml"))
+        configuration = configuration["lookups"]
+        with temp_dir("test_setup_currency", delete_if_exists=True) as folder:
+            input_dir = join(folder, "input")
+            shutil.copytree(join("tests", "fixtures", "covid", "input"), input_dir)
+            with open(join(input_dir, "historic_rates.csv"), "w") as file:
+                file.write("Date,Rate,Currency\n2020-01-01,0.9,EUR\n")
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader, folder, input_dir, folder, save=False, use_saved=True
+                )
+                cache_dir = join(folder, "cache")
+                cache = ReferenceCache(cache_dir)
+                CurrencyRates.setup_currency(retriever, configuration, cache)
+                historic_path = join(cache_dir, "currency_historic_rates.csv")
+                expected = {
+                    "retriever": retriever,
+                    "fallback_historic_to_current": True,
+                    "fallback_current_to_static": True,
+                    "secondary_rates_url": Path(
+                        join(cache_dir, "currency_secondary_rates.json")
+                    )
+                    .absolute()
+                    .as_uri(),
+                    "secondary_historic_url": Path(historic_path).absolute().as_uri(),
+                }
+                assert setups == [expected]
+                sources = CurrencyRates.sources
+                # Cached rates are used rather than being downloaded again
+                with open(join(input_dir, "historic_rates.csv"), "w") as file:
+                    file.write("Date,Rate,Currency\n2020-01-01,0.8,EUR\n")
+                CurrencyRates.setup_currency(retriever, configuration, cache)
+                assert setups[1] == expected
+                assert CurrencyRates.sources == sources
+                with open(historic_path) as file:
+                    assert "0.9" in file.read()
+                # Without a cache, they are downloaded again
+                CurrencyRates.setup_currency(retriever, configuration)
+                assert CurrencyRates.sources != sources
+                assert setups[2]["secondary_historic_url"] != (
+                    expected["secondary_historic_url"]
+                )
+        CurrencyRates.cache = None
+
+    def test_offline(self):
+        with temp_dir("test_currency_offline", delete_if_exists=True) as folder:
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader, folder, folder, folder, save=False, use_saved=False
+                )
+                CurrencyRates.cache = ReferenceCache(folder)
+                # Online, everything Currency reads is saved to the cache
+                currency_retriever = CurrencyRates.get_currency_retriever(retriever)
+                assert currency_retriever.save is True
+                assert currency_retriever.saved_dir == join(folder, CURRENCY_FOLDER)
+                CurrencyRates.cache = ReferenceCache(folder, offline=True)
+                with pytest.raises(FileNotFoundError):
+                    CurrencyRates.get_currency_retriever(retriever)
+                for filename in ("secondary_rates.json", "historic_rates.csv"):
+                    with open(join(folder, CURRENCY_FOLDER, filename), "w") as file:
+                        file.write("")
+                # Offline, Currency only reads what was saved
+                currency_retriever = CurrencyRates.get_currency_retriever(retriever)
+                assert currency_retriever.use_saved is True
+                assert currency_retriever.saved_dir == join(folder, CURRENCY_FOLDER)
+        CurrencyRates.cache = None
@@ -0,0 +1,164 @@
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import listdir, remove
+from os.path import join
+from threading import Thread
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from hdx.utilities.downloader import Download, DownloadError
+from hdx.utilities.path import temp_dir
+from hdx.utilities.retriever import Retrieve
+
+from iati.dportalpages import DPortalPages
+
+DPORTAL_PATH = join("tests", "fixtures", "covid", "input", "dportal.xml")
+URL = "http://127.0.0.1:{}/dquery?from=xson&form=xml&sql=%s"
+PAGE_QUERY = "SELECT * FROM ({}) AS activities ORDER BY aid LIMIT {} OFFSET {}"
+PAGE_SIZE = 50
+
+
+def read_activities(path):
+    with open(path, encoding="utf-8") as file:
+        xml = file.read()
+    header = xml[: xml.index("<iati-activity ")]
+    return header, re.findall(r"<iati-activity .*?</iati-activity>", xml, re.S)
+
+
+class DPortalHandler(BaseHTTPRequestHandler):
+    """Stand-in for D-Portal's dquery serving pages of the fixture activities"""
+
+    header, activities = read_activities(DPORTAL_PATH)
+    offsets = list()
+    fail_offsets = set()
+
+    def do_GET(self):
+        sql = parse_qs(urlparse(self.path).query)["sql"][0]
+        limit, offset = re.search(r"LIMIT (\d+) OFFSET (\d+)$", sql).groups()
+        limit = int(limit)
+        offset = int(offset)
+        self.offsets.append(offset)
+        if offset in self.fail_offsets:
+            self.fail_offsets.remove(offset)
+            self.send_error(404)
+            return
+        activities = self.activities[offset : offset + limit]
+        body = f"{self.header}{''.join(activities)}\n</iati-activities>"
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestDPortalPages:
+    @pytest.fixture(scope="class")
+    def url(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), DPortalHandler)
+        thread = Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield URL.format(server.server_address[1])
+        server.shutdown()
+        server.server_close()
+
+    def test_pages(self, url):
+        DPortalHandler.offsets.clear()
+        # Page 3 fails the first time it is requested
+        DPortalHandler.fail_offsets.add(3 * PAGE_SIZE)
+        no_activities = len(DPortalHandler.activities)
+        no_pages = no_activities // PAGE_SIZE + 1
+        with temp_dir("TestDPortalPages", delete_if_exists=True) as tempdir:
+            checkpoint_dir = join(tempdir, "pages")
+            with Download(user_agent="test", rate_limit=None) as downloader:
+                retriever = Retrieve(
+                    downloader, tempdir, tempdir, tempdir, save=False, use_saved=False
+                )
+                pages = DPortalPages(
+                    retriever,
+                    url,
+                    "SELECT * FROM xson",
+                    PAGE_QUERY,
+                    PAGE_SIZE,
+                    "dportal.xml",
+                    checkpoint_dir,
+                )
+                with pytest.raises(DownloadError):
+                    for _ in pages:
+                        pass
+                assert sorted(listdir(checkpoint_dir)) == [
+                    "dportal_00000.xml",
+                    "dportal_00001.xml",
+                    "dportal_00002.xml",
+                    "dportal_manifest.json",
+                ]
+                # The download resumes from the failed page
+                DPortalHandler.offsets.clear()
+                activities = list()
+                for path in pages:
+                    activities.extend(read_activities(path)[1])
+                assert DPortalHandler.offsets == [
+                    offset * PAGE_SIZE
+                    for offset in range(3, no_pages)
+                ]
+                assert len(pages.paths) == no_pages
+                assert activities == DPortalHandler.activities
+                pages.remove()
+                assert listdir(checkpoint_dir) == list()
+
+    def test_changed_query_or_page_size(self, url):
+        no_activities = len(DPortalHandler.activities)
+        with temp_dir("TestDPortalPagesChanged", delete_if_exists=True) as tempdir:
+            checkpoint_dir = join(tempdir, "pages")
+            with Download(user_agent="test", rate_limit=None) as downloader:
+                retriever = Retrieve(
+                    downloader, tempdir, tempdir, tempdir, save=False, use_saved=False
+                )
+
+                def get_activities(query, page_size):
+                    DPortalHandler.offsets.clear()
+                    pages = DPortalPages(
+                        retriever,
+                        url,
+                        query,
+                        PAGE_QUERY,
+                        page_size,
+                        "dportal.xml",
+                        checkpoint_dir,
+                    )
+                    activities = list()
+                    for path in pages:
+                        activities.extend(read_activities(path)[1])
+                    return activities
+
+                assert get_activities("SELECT * FROM xson", PAGE_SIZE) == (
+                    DPortalHandler.activities
+                )
+                # The same query and page size are resumed from the pages
+                assert get_activities("SELECT * FROM xson", PAGE_SIZE) == (
+                    DPortalHandler.activities
+                )
+                assert DPortalHandler.offsets == list()
+                # Pages of 50 would look like a last page with pages of 100
+                page_size = 2 * PAGE_SIZE
+                assert get_activities("SELECT * FROM xson", page_size) == (
+                    DPortalHandler.activities
+                )
+                assert DPortalHandler.offsets == list(
+                    range(0, no_activities + 1, page_size)
+                )
+                # A changed query eg. a new incremental cutoff is downloaded again
+                query = "SELECT * FROM xson WHERE changed"
+                assert get_activities(query, page_size) == DPortalHandler.activities
+                assert DPortalHandler.offsets == list(
+                    range(0, no_activities + 1, page_size)
+                )
+                # Pages without a manifest are not trusted
+                remove(join(checkpoint_dir, "dportal_manifest.json"))
+                assert get_activities(query, page_size) == DPortalHandler.activities
+                assert DPortalHandler.offsets == list(
+                    range(0, no_activities + 1, page_size)
+                )
@@ -0,0 +1,87 @@
+import logging
+from os.path import join
+
+from hdx.utilities.downloader import Download
+from hdx.utilities.path import temp_dir
+from hdx.utilities.retriever import Retrieve
+from hdx.utilities.saver import save_json
+
+from iati.exclusionregistry import (
+    SNAPSHOT_FILENAME,
+    ExclusionRegistry,
+    IdentifierSet,
+)
+
+
+class TestExclusionRegistry:
+    def test_identifier_set(self):
+        identifiers = IdentifierSet(["GB-GOV-1", "XM-DAC-41*", "*"], ["XM-DAC-42"])
+        assert "GB-GOV-1" in identifiers
+        assert "GB-GOV-10" not in identifiers
+        # Identifiers ending in * are only matched exactly as before prefixes
+        assert "XM-DAC-41*" in identifiers
+        assert "XM-DAC-41114" not in identifiers
+        assert "*" in identifiers
+        assert "XM-DAC-42114" in identifiers
+        assert "XM-DAC-42" in identifiers
+        assert "XM-DAC-4" not in identifiers
+        assert "US-EIN-1" not in identifiers
+        assert None not in identifiers
+        assert len(identifiers) == 4
+        assert list(identifiers) == ["*", "GB-GOV-1", "XM-DAC-41*"]
+        assert identifiers.get_prefixes() == ["XM-DAC-42"]
+        identifiers.add("US-EIN-*")
+        assert "US-EIN-1" not in identifiers
+        identifiers.add_prefix("US-EIN-")
+        assert "US-EIN-1" in identifiers
+
+    def test_add_row(self, caplog):
+        identifiers = IdentifierSet()
+        row = {"#org+reporting+id-prefix": "XM-DAC-41*"}
+        with caplog.at_level(logging.INFO):
+            ExclusionRegistry.add_row(row, "#org+reporting+id", identifiers, "org")
+            assert "prefix" not in caplog.text
+            row = {"#org+reporting+id+prefix": "XM-DAC-41"}
+            ExclusionRegistry.add_row(row, "#org+reporting+id", identifiers, "org")
+            assert "Using org prefix XM-DAC-41" in caplog.text
+        assert list(identifiers) == ["XM-DAC-41*"]
+        assert identifiers.get_prefixes() == ["XM-DAC-41"]
+
+    def test_read_saved(self):
+        snapshot = {
+            "skip_activities": ["XM-DAC-701-2-2020003078"],
+            "skip_reporting_orgs": ["CZ-ICO-25755277"],
+            "skip_reporting_orgs_prefixes": ["XM-DAC-41"],
+            "skip_reporting_orgs_children": {"GB-GOV-1": "1"},
+            "allow_activities": ["CH-4-2020002314"],
+            "org_ref_spurious": ["44000", "n/a"],
+            "skip_activities_prefixes": [],
+            "allow_activities_prefixes": [],
+            "org_ref_spurious_prefixes": [],
+        }
+        with temp_dir("TestExclusionRegistry") as tempdir:
+            save_json(snapshot, join(tempdir, SNAPSHOT_FILENAME))
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader, tempdir, tempdir, tempdir, save=False, use_saved=True
+                )
+                # The sheet urls are not needed when using the saved snapshot
+                registry = ExclusionRegistry.read(dict(), retriever)
+        assert registry.get_snapshot() == snapshot
+        assert "XM-DAC-41301" in registry.skip_reporting_orgs
+        assert "XM-DAC-41301" not in registry.skip_activities
+        assert registry.skip_reporting_orgs_children["GB-GOV-1"] == "1"
+
+    def test_read_saved_without_prefixes(self):
+        # Snapshots saved before prefixes were added
+        snapshot = {
+            "skip_activities": [],
+            "skip_reporting_orgs": ["XM-DAC-41*"],
+            "skip_reporting_orgs_children": {},
+            "allow_activities": [],
+            "org_ref_spurious": [],
+        }
+        registry = ExclusionRegistry()
+        registry.set_snapshot(snapshot)
+        assert "XM-DAC-41*" in registry.skip_reporting_orgs
+        assert "XM-DAC-41301" not in registry.skip_reporting_orgs
@@ -0,0 +1,168 @@
+import logging
+import re
+from os.path import join
+
+import diterator
+from hdx.utilities.dateparse import parse_date
+from hdx.utilities.errors_onexit import ErrorsOnExit
+from hdx.utilities.loader import load_yaml
+from hdx.utilities.path import temp_dir
+
+from iati import checks
+from iati.compactstore import MemoryStore, encode_activity
+from iati.fanout import get_themes_query, prefilter_fanout, read_theme_members
+from iati.lookups import Lookups
+from iati.prefilter import prefilter_activities
+
+DPORTAL_PATH = join("tests", "fixtures", "covid", "input", "dportal.xml")
+THEMES = ("covid", "foodsecurity", "ebola")
+
+
+def get_checks(whattorun):
+    return checks[whattorun](
+        parse_date("2022-12-05"), parse_date("2020-01-01"), ErrorsOnExit()
+    )
+
+
+def get_theme_identifiers(whattorun):
+    """Returns the identifiers of the activities that the theme's checks find
+    belong to the theme"""
+    Lookups.checks = get_checks(whattorun)
+    return {
+        dactivity.identifier
+        for dactivity in diterator.XMLIterator(DPORTAL_PATH)
+        if Lookups.checks.is_theme_activity(dactivity)
+    }
+
+
+class AidsRetriever:
+    """Stand-in for a retriever of the activity identifier CSVs"""
+
+    def __init__(self, theme_aids):
+        self.theme_aids = theme_aids
+
+    def get_tabular_rows(self, url, dict_form, filename, logstr):
+        whattorun = filename.split("_")[1]
+        return None, ({"aid": aid} for aid in self.theme_aids[whattorun])
+
+
+class TestFanout:
+    def test_get_themes_query(self):
+        Lookups.clear()
+        Lookups.configuration = {
+            "dportal": {
+                "covid_query": "SELECT covid {}",
+                "ebola_query": "SELECT ebola {}",
+                "aids_query": "SELECT aid FROM ({}) AS activities",
+                "themes_query": "SELECT * FROM xson WHERE aid IN ({})",
+            }
+        }
+        assert (
+            get_themes_query(("covid", "ebola"), "limit 5")
+            == "SELECT * FROM xson WHERE aid IN ("
+            "SELECT aid FROM (SELECT covid limit 5) AS activities UNION "
+            "SELECT aid FROM (SELECT ebola limit 5) AS activities)"
+        )
+
+    def test_prefilter_fanout(self):
+        Lookups.clear()
+        Lookups.configuration = load_yaml(
+            join("tests", "config", "project_configuration.yml")
+        )
+        with open(DPORTAL_PATH) as file:
+            identifiers = re.findall(
+                r"<iati-identifier>(.*?)</iati-identifier>", file.read()
+            )
+        theme_identifiers = {
+            whattorun: get_theme_identifiers(whattorun) for whattorun in THEMES
+        }
+        assert theme_identifiers["covid"]
+        # Without theme members, activities are routed by the themes' checks
+        theme_members = {
+            "covid": set(identifiers),
+            "foodsecurity": set(identifiers[::2]),
+            "ebola": set(),
+        }
+        for members in (None, theme_members):
+            theme_checks = {whattorun: get_checks(whattorun) for whattorun in THEMES}
+            writers = {whattorun: MemoryStore() for whattorun in THEMES}
+            theme_written = prefilter_fanout(
+                (DPORTAL_PATH,), theme_checks, writers, False, members
+            )
+            # Each theme gets what prefiltering its own activities would give
+            for whattorun in THEMES:
+                if members is None:
+                    selected = theme_identifiers[whattorun]
+                else:
+                    selected = members[whattorun]
+                Lookups.checks = get_checks(whattorun)
+                expected = [
+                    encode_activity(dactivity)
+                    for dactivity, _ in prefilter_activities(DPORTAL_PATH)
+                    if dactivity.identifier in selected
+                ]
+                actual = [
+                    encode_activity(dactivity) for dactivity in writers[whattorun]
+                ]
+                assert actual == expected
+                assert theme_written[whattorun] == len(actual)
+            assert writers["covid"].dactivities
+        assert len(writers["ebola"].dactivities) == 0
+        Lookups.clear()
+
+    def test_identifiers(self, caplog):
+        Lookups.clear()
+        Lookups.configuration = load_yaml(
+            join("tests", "config", "project_configuration.yml")
+        )
+        with open(DPORTAL_PATH) as file:
+            xml = file.read()
+        identifiers = re.findall(r"<iati-identifier>(.*?)</iati-identifier>", xml)
+        Lookups.checks = get_checks("covid")
+        identifier = next(
+            dactivity.identifier
+            for dactivity, _ in prefilter_activities(DPORTAL_PATH)
+            if dactivity.identifier != identifiers[0]
+        )
+        # D-Portal's identifiers may have surrounding whitespace as may those in
+        # the XML
+        theme_members = read_theme_members(
+            AidsRetriever(
+                {
+                    "covid": [f" {identifier}\n" for identifier in identifiers[1:]],
+                    "foodsecurity": [],
+                }
+            ),
+            ("covid", "foodsecurity"),
+        )
+        assert theme_members["covid"] == set(identifiers[1:])
+        xml = xml.replace(
+            f"<iati-identifier>{identifier}</iati-identifier>",
+            f"<iati-identifier>\n  {identifier} </iati-identifier>",
+        )
+        with temp_dir("test_fanout_identifiers", delete_if_exists=True) as folder:
+            path = join(folder, "dportal.xml")
+            with open(path, "w") as file:
+                file.write(xml)
+            for iterparse in (False, True):
+                writers = {"covid": MemoryStore(), "foodsecurity": MemoryStore()}
+                with caplog.at_level(logging.INFO):
+                    caplog.clear()
+                    prefilter_fanout(
+                        (path,),
+                        {
+                            "covid": get_checks("covid"),
+                            "foodsecurity": get_checks("foodsecurity"),
+                        },
+                        writers,
+                        iterparse,
+                        theme_members,
+                    )
+                written = [
+                    dactivity.identifier.strip() for dactivity in writers["covid"]
+                ]
+                assert identifier in written
+                assert identifiers[0] not in written
+                # The activities that belong to no theme are counted
+                assert "activities belonged to no theme" in caplog.text
+        Lookups.clear()
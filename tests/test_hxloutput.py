@@ -0,0 +1,88 @@
+import filecmp
+from copy import deepcopy
+from os import mkdir
+from os.path import join
+
+from hdx.utilities.path import temp_dir
+from hdx.utilities.saver import save_hxlated_output
+
+from iati.hxloutput import save_hxlated_rows
+
+
+class TestHXLOutput:
+    configurations = {
+        "metadata": {
+            "input": {
+                "headers": ["Org id", "Org name", "Value"],
+                "hxltags": ["#org+id", "#org+name", "#value"],
+            },
+            "output": {
+                "csv": {"filename": "metadata.csv"},
+                "json": {
+                    "filename": "metadata.json",
+                    "metadata": {
+                        "#date+run": "{{today}}",
+                        "#meta+num": "{{num_rows}}",
+                        "#meta+missing": "{{missing}}",
+                    },
+                    "hxltags": ["#org+id", "#value"],
+                },
+            },
+        },
+        "process": {
+            "input": {
+                "headers": ["Org id", "Org name", "Value"],
+                "hxltags": ["#org+id", "#org+name", "#value"],
+            },
+            "process": [
+                {
+                    "header": "Double value",
+                    "hxltag": "#value+double",
+                    "expression": "#value * 2",
+                }
+            ],
+            "output": {
+                "csv": {
+                    "filename": "process.csv",
+                    "hxltags": ["#org+name", "#value+double"],
+                },
+                "json": {"filename": "process.json", "data": "rows"},
+            },
+        },
+    }
+    rows = [
+        ["org-1", "Org “One”", 10],
+        ["org-2", None, -3],
+        ["org-3", "Org, Three", 0],
+    ]
+
+    def test_save_hxlated_rows(self):
+        with temp_dir("TestHXLOutput") as tempdir:
+            expected_dir = join(tempdir, "expected")
+            mkdir(expected_dir)
+            actual_dir = join(tempdir, "actual")
+            mkdir(actual_dir)
+            for name, configuration in self.configurations.items():
+                # save_hxlated_output modifies the configuration it is given
+                save_hxlated_output(
+                    deepcopy(configuration),
+                    self.rows,
+                    includes_header=False,
+                    output_dir=expected_dir,
+                    today="2021-05-30",
+                    num_rows=len(self.rows),
+                )
+                save_hxlated_rows(
+                    configuration,
+                    iter(self.rows),
+                    output_dir=actual_dir,
+                    today="2021-05-30",
+                    num_rows=len(self.rows),
+                )
+                for extension in ("csv", "json"):
+                    filename = f"{name}.{extension}"
+                    assert filecmp.cmp(
+                        join(expected_dir, filename),
+                        join(actual_dir, filename),
+                        shallow=False,
+                    ), filename
@@ -39,7 +39,19 @@ class TestIATIFoodSecurity:
     def input_dir(self, fixtures_dir):
         return join(fixtures_dir, "input")
 
-    def test_run(self, configuration, fixtures_dir, input_dir):
+    @pytest.mark.parametrize(
+        "single_pass, workers, iterparse",
+        [(False, 1, False), (True, 1, False), (False, 2, False), (False, 1, True)],
+    )
+    def test_run(
+        self,
+        configuration,
+        fixtures_dir,
+        input_dir,
+        single_pass,
+        workers,
+        iterparse,
+    ):
         with ErrorsOnExit() as errors_on_exit:
             with temp_dir(
                 "TestIATIFoodSecurity", delete_on_success=True, delete_on_failure=False
@@ -65,6 +77,9 @@ class TestIATIFoodSecurity:
                         startdate="2021-01-01",
                         saveprefiltered=False,
                         errors_on_exit=errors_on_exit,
+                        single_pass=single_pass,
+                        workers=workers,
+                        iterparse=iterparse,
                     )
                     for filename in ("flows", "transactions", "reporting_orgs"):
                         csv_filename = f"{filename}.csv"
@@ -0,0 +1,383 @@
+import csv
+import filecmp
+import re
+from os import mkdir
+from os.path import join
+from shutil import copytree
+
+import pytest
+from hdx.api.configuration import Configuration
+from hdx.api.locations import Locations
+from hdx.utilities.compare import assert_files_same
+from hdx.utilities.dateparse import parse_date
+from hdx.utilities.downloader import Download
+from hdx.utilities.errors_onexit import ErrorsOnExit
+from hdx.utilities.loader import load_yaml
+from hdx.utilities.path import temp_dir
+from hdx.utilities.retriever import Retrieve
+
+from iati import checks
+from iati.incremental import IncrementalState, StateWriter
+from iati.lookups import Lookups
+from iati.main import start
+from iati.prefilter import prefilter_activities
+
+XML = """<iati-activities>
+{}
+</iati-activities>"""
+ACTIVITY = """<iati-activity last-updated-datetime="{}">
+ <iati-identifier>{}</iati-identifier>
+</iati-activity>"""
+DATED_ACTIVITY = """<iati-activity last-updated-datetime="2021-01-01T00:00:00">
+ <iati-identifier>{}</iati-identifier>
+ <transaction>
+  <transaction-date iso-date="{}"/>
+ </transaction>
+</iati-activity>"""
+TODAY = parse_date("2021-05-30")
+FIXTURES_DIR = join("tests", "fixtures", "covid")
+CHANGED_LAST_UPDATED = "2021-05-29T00:00:00"
+
+
+def write_dportal(folder, activities):
+    path = join(folder, "dportal.xml")
+    with open(path, "w") as file:
+        file.write(
+            XML.format(
+                "\n".join(
+                    ACTIVITY.format(last_updated, identifier)
+                    for identifier, last_updated in activities
+                )
+            )
+        )
+    return path
+
+
+class TestIncrementalState:
+    def test_update(self):
+        with temp_dir("TestIncrementalState") as tempdir:
+            state = IncrementalState.load(tempdir, "context")
+            assert state.last_updated is None
+            dportal_path = write_dportal(
+                tempdir,
+                [
+                    ("A", "2021-01-01T00:00:00"),
+                    ("B", "2021-01-02T00:00:00"),
+                    ("C", "2021-01-01T00:00:00"),
+                    ("D", "2021-01-01T00:00:00"),
+                    ("E", "2021-01-01T00:00:00"),
+                ],
+            )
+            # E is prefiltered out
+            state.update(
+                (dportal_path,),
+                [
+                    (("A", 1), []),
+                    (("B", 1), ["B error"]),
+                    (("C", 1), []),
+                    (("D", 1), []),
+                ],
+                TODAY,
+            )
+            assert list(state.records()) == [
+                ("A", 1),
+                ("B", 1),
+                ("C", 1),
+                ("D", 1),
+            ]
+            assert state.last_updated == "2021-01-02T00:00:00"
+            state.activity_states["A"].contribution = "A contribution"
+            state.activity_states["C"].contribution = "C contribution"
+            state.save()
+
+            assert IncrementalState.load(tempdir, "other").activity_states == dict()
+            assert (
+                IncrementalState.load(
+                    tempdir, "context", full_refresh=True
+                ).last_updated
+                is None
+            )
+            state = IncrementalState.load(tempdir, "context")
+            assert state.last_updated == "2021-01-02T00:00:00"
+            # A is changed, B is prefiltered out, C is unchanged and F is new
+            dportal_path = write_dportal(
+                tempdir,
+                [
+                    ("A", "2021-01-03T00:00:00"),
+                    ("B", "2021-01-03T00:00:00"),
+                    ("C", "2021-01-04T00:00:00"),
+                    ("F", "2021-01-03T00:00:00"),
+                ],
+            )
+            state.update(
+                (dportal_path,),
+                [
+                    (("A", 2), []),
+                    (("C", 1), ["C error"]),
+                    (("F", 1), []),
+                ],
+                TODAY,
+            )
+            assert list(state.records()) == [("A", 2), ("C", 1), ("D", 1), ("F", 1)]
+            assert state.last_updated == "2021-01-04T00:00:00"
+            assert state.read_identifiers == {"A", "B", "C", "F"}
+            activity_states = state.activity_states
+            assert activity_states["A"].contribution is None
+            assert activity_states["C"].contribution == "C contribution"
+            assert activity_states["C"].errors == ["C error"]
+            assert activity_states["C"].last_updated == "2021-01-04T00:00:00"
+
+    def test_identifiers(self):
+        with temp_dir("TestIncrementalStateIdentifiers") as tempdir:
+            # Identifiers may have surrounding whitespace in the XML and in the
+            # small activities
+            state = IncrementalState.load(tempdir, "context")
+            dportal_path = write_dportal(
+                tempdir,
+                [("\n  A ", "2021-01-01T00:00:00"), ("B", "2021-01-01T00:00:00")],
+            )
+            state.update((dportal_path,), [((" A", 1), []), (("B\n", 1), [])], TODAY)
+            assert set(state.activity_states) == {"A", "B"}
+            assert state.activity_states["A"].last_updated == "2021-01-01T00:00:00"
+            state.activity_states["A"].contribution = "A contribution"
+            # A is unchanged and B is prefiltered out
+            dportal_path = write_dportal(
+                tempdir,
+                [("A ", "2021-01-02T00:00:00"), (" B ", "2021-01-02T00:00:00")],
+            )
+            state.update((dportal_path,), [((" A", 1), [])], TODAY)
+            assert list(state.activity_states) == ["A"]
+            assert state.activity_states["A"].contribution == "A contribution"
+
+    def test_retain(self):
+        with temp_dir("TestIncrementalStateRetain") as tempdir:
+            state = IncrementalState.load(tempdir, "context")
+            dportal_path = join(tempdir, "dportal.xml")
+            with open(dportal_path, "w") as file:
+                file.write(
+                    XML.format(
+                        "\n".join(
+                            (
+                                ACTIVITY.format("2021-01-01T00:00:00", "A"),
+                                ACTIVITY.format("2021-01-01T00:00:00", "B"),
+                                DATED_ACTIVITY.format("C", "2021-06-01"),
+                                DATED_ACTIVITY.format("D", "2021-06-01"),
+                            )
+                        )
+                    )
+                )
+            state.update((dportal_path,), [(("A", 1), []), (("B", 1), [])], TODAY)
+            assert list(state.dated_activities) == ["C", "D"]
+            # B and D are no longer selected by the query
+            state.retain({"A", "C"})
+            assert list(state.records()) == [("A", 1)]
+            assert list(state.dated_activities) == ["C"]
+
+    def test_state_writer(self):
+        with open(join(FIXTURES_DIR, "input", "dportal.xml")) as file:
+            xml = file.read()
+        # An activity without a reporting org is excluded with an error
+        xml = re.sub(r"<reporting-org .*?</reporting-org>", "", xml, 1, re.S)
+        error = "Excluding activity with no reporting org"
+        records = dict()
+        with temp_dir("TestStateWriter") as tempdir:
+            dportal_path = join(tempdir, "dportal.xml")
+            with open(dportal_path, "w") as file:
+                file.write(xml)
+            for workers in (1, 2):
+                Lookups.clear()
+                Lookups.configuration = load_yaml(
+                    join("tests", "config", "project_configuration.yml")
+                )
+                errors_on_exit = ErrorsOnExit()
+                Lookups.checks = checks["covid"](
+                    TODAY, parse_date("2020-01-01"), errors_on_exit
+                )
+                writer = StateWriter()
+                for dactivity, _, errors in prefilter_activities(
+                    dportal_path,
+                    workers=workers,
+                    activities_per_chunk=5,
+                    with_errors=True,
+                ):
+                    writer.write(dactivity, errors)
+                assert any(error in x for x in errors_on_exit.errors)
+                # The excluded activity's error is not stored against another
+                for _, errors in writer.records:
+                    assert not any(error in x for x in errors)
+                    assert all(x in errors_on_exit.errors for x in errors)
+                records[workers] = writer.records
+        # Errors stay with their activity whichever worker prefilters it
+        assert records[2] == records[1]
+        Lookups.clear()
+
+    def test_dated_activities(self):
+        with temp_dir("TestIncrementalStateDated") as tempdir:
+            state = IncrementalState.load(tempdir, "context")
+            assert state.write_dated_activities(tempdir) == tuple()
+            dportal_path = join(tempdir, "dportal.xml")
+            with open(dportal_path, "w") as file:
+                file.write(
+                    XML.format(
+                        "\n".join(
+                            (
+                                DATED_ACTIVITY.format("A", "2021-06-01"),
+                                DATED_ACTIVITY.format("B", "2021-05-01"),
+                            )
+                        )
+                    )
+                )
+            # A has a transaction after today so is prefiltered out
+            state.update((dportal_path,), [(("B", 1), [])], TODAY)
+            assert list(state.dated_activities) == ["A"]
+            state.save()
+
+            # A is read again once its transaction is no longer after today
+            state = IncrementalState.load(tempdir, "context")
+            dated_paths = state.write_dated_activities(tempdir)
+            assert len(dated_paths) == 1
+            state.update(dated_paths, [(("A", 1), [])], parse_date("2021-06-02"))
+            assert list(state.records()) == [("B", 1), ("A", 1)]
+            assert state.dated_activities == dict()
+
+
+def modify_activity(activity, identifier, activity_ids):
+    """Doubles the value of the first transaction of the first activity in
+    activity_ids and marks the second as secondary reported so it is
+    prefiltered out"""
+    if identifier == activity_ids[0]:
+        start = activity.index("<transaction")
+        activity = activity[:start] + re.sub(
+            r"(<value[^>]*>)([^<]*)",
+            lambda match: f"{match.group(1)}{float(match.group(2)) * 2}",
+            activity[start:],
+            count=1,
+        )
+    elif identifier == activity_ids[1]:
+        activity = activity.replace(
+            "<reporting-org ", '<reporting-org secondary-reporter="1" ', 1
+        )
+    else:
+        return activity, False
+    activity = re.sub(
+        r'last-updated-datetime="[^"]*"',
+        f'last-updated-datetime="{CHANGED_LAST_UPDATED}"',
+        activity,
+        count=1,
+    )
+    return activity, True
+
+
+class TestIncrementalRun:
+    @pytest.fixture(scope="function")
+    def configuration(self):
+        Configuration._create(
+            hdx_read_only=True,
+            hdx_site="prod",
+            user_agent="test",
+            project_config_yaml=join("tests", "config", "project_configuration.yml"),
+        )
+        Locations.set_validlocations(
+            [
+                {"name": "afg", "title": "Afghanistan"},
+                {"name": "pse", "title": "State of Palestine"},
+            ]
+        )
+        return Configuration.read()
+
+    def test_run(self, configuration):
+        with open(join(FIXTURES_DIR, "transactions.csv")) as file:
+            rows = list(csv.DictReader(file))
+        activity_ids = list(dict.fromkeys(row["Activity id"] for row in rows[1:]))
+        # Change an activity, prefilter out another and edit one out of the query
+        unselected_id = activity_ids[-1]
+        activity_ids = (activity_ids[0], activity_ids[len(activity_ids) // 2])
+        with ErrorsOnExit() as errors_on_exit:
+            with temp_dir(
+                "TestIncrementalRun", delete_on_success=True, delete_on_failure=False
+            ) as tempdir:
+                input_dir = join(tempdir, "input")
+                copytree(join(FIXTURES_DIR, "input"), input_dir)
+                dportal_path = join(input_dir, "dportal.xml")
+                with open(dportal_path) as file:
+                    xml = file.read()
+                parts = re.split(
+                    r"(<iati-activity .*?</iati-activity>)", xml, flags=re.S
+                )
+                changed = list()
+                selected = list()
+                for i in range(1, len(parts), 2):
+                    identifier = re.search(
+                        r"<iati-identifier>(.*?)</iati-identifier>", parts[i], re.S
+                    ).group(1)
+                    if identifier.strip() == unselected_id:
+                        parts[i] = ""
+                        continue
+                    selected.append(identifier)
+                    parts[i], is_changed = modify_activity(
+                        parts[i], identifier.strip(), activity_ids
+                    )
+                    if is_changed:
+                        changed.append(parts[i])
+                assert len(changed) == 2
+                assert len(selected) == len(parts) // 2 - 1
+
+                def run(name, state_dir, full_refresh=False):
+                    output_dir = join(tempdir, name)
+                    mkdir(output_dir)
+                    with Download(user_agent="test") as downloader:
+                        retriever = Retrieve(
+                            downloader,
+                            tempdir,
+                            input_dir,
+                            output_dir,
+                            save=False,
+                            use_saved=True,
+                        )
+                        Lookups.clear()
+                        start(
+                            configuration,
+                            "2021-05-30",
+                            retriever,
+                            output_dir,
+                            dportal_params=None,
+                            whattorun="covid",
+                            startdate="2020-01-01",
+                            saveprefiltered=False,
+                            errors_on_exit=errors_on_exit,
+                            state_dir=join(tempdir, state_dir),
+                            full_refresh=full_refresh,
+                        )
+                    return output_dir
+
+                first_dir = run("first", "state")
+                # The next run downloads only the changed activities
+                with open(dportal_path, "w") as file:
+                    file.write("".join(parts))
+                with open(join(input_dir, "dportal_changed.xml"), "w") as file:
+                    file.write(f"{parts[0]}{''.join(changed)}{parts[-1]}")
+                # The identifiers of the activities the query selects
+                with open(join(input_dir, "dportal_covid_aids.csv"), "w") as file:
+                    writer = csv.writer(file)
+                    writer.writerow(["aid"])
+                    for identifier in selected:
+                        writer.writerow([identifier])
+                incremental_dir = run("incremental", "state")
+                full_dir = run("full", "full_state", full_refresh=True)
+                assert not filecmp.cmp(
+                    join(first_dir, "transactions.csv"),
+                    join(full_dir, "transactions.csv"),
+                    shallow=False,
+                )
+                for filename in ("flows", "transactions", "reporting_orgs"):
+                    csv_filename = f"{filename}.csv"
+                    assert_files_same(
+                        join(full_dir, csv_filename),
+                        join(incremental_dir, csv_filename),
+                    )
+                    json_filename = f"{filename}.json"
+                    assert filecmp.cmp(
+                        join(full_dir, json_filename),
+                        join(incremental_dir, json_filename),
+                        shallow=False,
+                    )
@@ -0,0 +1,91 @@
+from glob import glob
+from os.path import join
+
+import pytest
+from hdx.utilities.dateparse import parse_date
+from hdx.utilities.errors_onexit import ErrorsOnExit
+
+from iati import checks
+from iati.iterparse import iterparse_activities
+from iati.keywordmatcher import KeywordMatcher
+from iati.smallnarrativetext import SmallNarrativeText
+
+TERMS = {
+    "covid": ("covid-19",),
+    "ebola": ("ebola",),
+    "climate": ("climate finance",),
+    "southsudan": (),
+    "ukraine": (),
+    "foodsecurity": ("food security", "food insecurity"),
+}
+
+
+def make_narrative(narratives):
+    narrativetext = SmallNarrativeText.__new__(SmallNarrativeText)
+    narrativetext.defaulttext = next(iter(narratives.values()), "")
+    narrativetext.narratives = narratives
+    return narrativetext
+
+
+def original_has_text(terms, narrativetext):
+    for lang, text in narrativetext.narratives.items():
+        if any(term in text.lower() for term in terms):
+            return True
+    return False
+
+
+def get_narratives():
+    narratives = [
+        make_narrative({"en": "The COVID-19 response", "fr": "Réponse"}),
+        make_narrative({"en": "Food Insecurity in the Sahel"}),
+        make_narrative({"es": "Financiación", "en": "CLIMATE FINANCE"}),
+        make_narrative({"uk": "Допомога Україні", "en": "Ukrainian refugees"}),
+        make_narrative({}),
+    ]
+    for path in glob(join("tests", "fixtures", "*", "input", "dportal.xml")):
+        for dactivity in iterparse_activities(path):
+            for narrativetext in (dactivity.title, dactivity.description):
+                if narrativetext is not None:
+                    narratives.append(narrativetext)
+            for dtransaction in dactivity.transactions:
+                if dtransaction.description is not None:
+                    narratives.append(dtransaction.description)
+    return narratives
+
+
+class TestKeywordMatcher:
+    def test_matcher(self):
+        matcher = KeywordMatcher()
+        assert len(matcher) == 0
+        assert matcher.matches(None) is False
+        matcher.add("Food Security", "food insecurity", "food security")
+        assert matcher.terms == ["food security", "food insecurity"]
+        assert matcher.search("eu food insecurity programme") is True
+        assert matcher.search("food and security") is False
+        matcher.add("a.b")
+        assert matcher.search("axb") is False
+        with pytest.raises(AttributeError):
+            matcher.matches(None)
+
+    def test_checks(self):
+        narratives = get_narratives()
+        today = parse_date("2022-12-05")
+        for whattorun, terms in TERMS.items():
+            theme_checks = checks[whattorun](today, None, ErrorsOnExit())
+            for narrativetext in narratives:
+                expected = original_has_text(terms, narrativetext)
+                assert theme_checks.has_desired_text(narrativetext) is expected
+        ukraine_checks = checks["ukraine"](today, None, ErrorsOnExit())
+        for narrativetext in narratives:
+            expected = not original_has_text(("ukraine", "ukrainian"), narrativetext)
+            assert ukraine_checks.is_irrelevant_text(narrativetext) is expected
+        # Lowercased narratives are kept
+        narrativetext = narratives[0]
+        assert narrativetext.get_lowered_narratives() == [
+            "the covid-19 response",
+            "réponse",
+        ]
+        assert (
+            narrativetext.get_lowered_narratives()
+            is narrativetext.get_lowered_narratives()
+        )
@@ -0,0 +1,57 @@
+from os.path import join
+
+from hdx.location.country import Country
+from hdx.utilities.loader import load_yaml
+
+from iati.lookups import Lookups, clean_ref_name_type
+
+
+def original_get_country_region_name(code):
+    countryname = Country.get_country_name_from_iso2(code, shortname=True)
+    if countryname:
+        return countryname
+    regionname = Lookups.region_code_to_name.get(code)
+    if regionname:
+        return f"{regionname} (no country specified)"
+    return Lookups.default_country_region
+
+
+class TestLookups:
+    def test_get_country_region_name(self):
+        Lookups.clear()
+        configuration = load_yaml(join("tests", "config", "project_configuration.yml"))
+        lookups_configuration = configuration["lookups"]
+        tables = Lookups.read_tables(lookups_configuration)
+        Lookups.region_code_to_name = tables["region_code_to_name"]
+        Lookups.default_country_region = lookups_configuration[
+            "default_country_region"
+        ]
+        Lookups.country_region_names = Lookups.read_country_region_names(
+            Lookups.region_code_to_name
+        )
+        codes = [code for code in Country.countriesdata()["iso2iso3"]]
+        codes.extend(Lookups.region_code_to_name)
+        codes.extend(("af", "XX", "", "999", "XX"))
+        for code in codes:
+            expected = original_get_country_region_name(code)
+            assert Lookups.get_country_region_name(code) == expected
+        assert Lookups.get_country_region_name("PS") == "State of Palestine"
+        assert (
+            Lookups.get_country_region_name("998")
+            == "Developing countries (no country specified)"
+        )
+        # Codes that are not resolved at setup are resolved only once
+        assert Lookups.country_region_names["af"] == "Afghanistan"
+        assert Lookups.country_region_names["XX"] is None
+        assert Lookups.unknown_country_region_codes["XX"] == 2
+        assert Lookups.unknown_country_region_codes["999"] == 1
+        assert "PS" not in Lookups.unknown_country_region_codes
+        Lookups.clear()
+
+    def test_clean_ref_name_type(self):
+        name = ("Org  A.", (("fr", "Org B"), ("EN", " Org A ")))
+        cleaned = clean_ref_name_type(" GB-1 ", name, "10")
+        assert cleaned == ("gb-1", ("Org A", "Org A.", "Org B"), "10")
+        # The cached result is shared so it cannot be changed
+        assert clean_ref_name_type(" GB-1 ", name, "10") is cleaned
+        assert clean_ref_name_type(None, None, "") == (None, tuple(), None)
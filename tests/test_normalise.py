@@ -0,0 +1,62 @@
+import re
+from glob import glob
+from os.path import join
+from xml.etree.ElementTree import iterparse
+
+from hdx.utilities.loader import load_json
+
+from iati.normalise import clean_region, clean_string, is_clean
+
+
+def original_clean_string(s):
+    s = re.sub(r"(\W)\1+", r"\1", s.strip())
+    s = re.sub(r"\s", " ", s)
+    s = re.sub(r"^\W?([\w &]*)[^a-zA-Z0-9_\.]?$", r"\1", s)
+    return s.strip()
+
+
+def get_corpus():
+    corpus = [
+        "",
+        " ",
+        "UNICEF",
+        "  UNICEF  ",
+        "World  Food   Programme",
+        "Save the Children UK.",
+        "-Oxfam-",
+        "'quoted name'",
+        "Médecins Sans Frontières",
+        "GB-COH-213890",
+        "XM-DAC-41122",
+        "Tab\tSeparated\nLines",
+        "...ellipsis...",
+        "A & B",
+        "under_score",
+        "(Brackets)",
+        "Ｆｕｌｌｗｉｄｔｈ",
+        " non-breaking space ",
+    ]
+    for filename in ("IATIOrganisationIdentifier.json", "Region.json"):
+        for entry in load_json(join("data", filename))["data"]:
+            corpus.append(entry["code"])
+            corpus.append(entry["name"])
+    for path in glob(join("tests", "fixtures", "**", "*.xml"), recursive=True):
+        for _, element in iterparse(path):
+            if element.text:
+                corpus.append(element.text)
+            corpus.extend(element.attrib.values())
+            element.clear()
+    return corpus
+
+
+class TestNormalise:
+    def test_clean_string(self):
+        for s in get_corpus():
+            assert clean_string(s) == original_clean_string(s), repr(s)
+            if is_clean(s):
+                assert original_clean_string(s) == s, repr(s)
+
+    def test_clean_region(self):
+        assert clean_region("Africa, regional") == "Africa"
+        assert clean_region("Asia, regional") == "Asia"
+        assert clean_region("Bilateral, unspecified") == "Bilateral"
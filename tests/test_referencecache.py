@@ -0,0 +1,111 @@
+from os import utime
+from os.path import exists, join
+from time import time
+
+import pytest
+from hdx.utilities.path import temp_dir
+
+from iati.lookups import Lookups
+from iati.referencecache import ReferenceCache
+
+URL = "https://example.com/reference.json"
+
+
+class TestReferenceCache:
+    def test_local_source(self):
+        configuration = {
+            "org_data": join("data", "IATIOrganisationIdentifier.json"),
+            "region_data": join("data", "Region.json"),
+        }
+        sources = (configuration["org_data"], configuration["region_data"])
+        with temp_dir("TestReferenceCacheLocal") as tempdir:
+            cache = ReferenceCache(tempdir)
+            tables = cache.load(
+                "lookups", sources, lambda: Lookups.read_tables(configuration)
+            )
+            assert tables == Lookups.read_tables(configuration)
+            assert tables["region_code_to_name"]["998"] == "Developing countries"
+            # Local files are identified by their contents so have no time to live
+            path, _ = cache.get_path("lookups", sources)
+            utime(path, (0, 0))
+            cached = cache.load("lookups", sources, lambda: None)
+            assert cached == tables
+            # A changed file has a new entry which replaces the old one
+            changed_path = join(tempdir, "Region.json")
+            with open(changed_path, "w") as file:
+                file.write('{"data": []}')
+            changed_configuration = dict(configuration, region_data=changed_path)
+            changed_sources = (configuration["org_data"], changed_path)
+            cached = cache.load(
+                "lookups",
+                changed_sources,
+                lambda: Lookups.read_tables(changed_configuration),
+            )
+            assert cached["region_code_to_name"] == dict()
+            changed_entry_path = cache.get_path("lookups", changed_sources)[0]
+            assert changed_entry_path != path
+            # The entry for the other sources is kept
+            assert exists(path)
+            # A changed file for the same sources replaces its old entry
+            with open(changed_path, "w") as file:
+                file.write('{"data": [{"code": "998", "name": "Developing"}]}')
+            cached = cache.load(
+                "lookups",
+                changed_sources,
+                lambda: Lookups.read_tables(changed_configuration),
+            )
+            assert cached["region_code_to_name"] == {"998": "Developing"}
+            assert not exists(changed_entry_path)
+            assert exists(path)
+
+    def test_remote_source(self):
+        reads = list()
+
+        def read():
+            reads.append(1)
+            return {"A": 1}
+
+        with temp_dir("TestReferenceCacheRemote") as tempdir:
+            cache = ReferenceCache(tempdir, ttl=60)
+            assert cache.load("remote", (URL,), read) == {"A": 1}
+            assert cache.load("remote", (URL,), read) == {"A": 1}
+            assert len(reads) == 1
+            # Expired entries are read again and kept with a new time
+            path, is_remote = cache.get_path("remote", (URL,))
+            assert is_remote is True
+            utime(path, (time() - 120, time() - 120))
+            assert cache.load("remote", (URL,), read) == {"A": 1}
+            assert len(reads) == 2
+            assert cache.load("remote", (URL,), read) == {"A": 1}
+            assert len(reads) == 2
+            # Offline, expired entries are still used
+            utime(path, (time() - 120, time() - 120))
+            offline_cache = ReferenceCache(tempdir, ttl=60, offline=True)
+            assert offline_cache.load("remote", (URL,), read) == {"A": 1}
+            assert len(reads) == 2
+            with pytest.raises(FileNotFoundError):
+                offline_cache.load("missing", (URL,), read)
+
+    def test_failed_read(self):
+        with temp_dir("TestReferenceCacheFailed") as tempdir:
+            cache = ReferenceCache(tempdir)
+            assert cache.load("remote", (URL,), lambda: None) is None
+            assert cache.load("remote", (URL,), lambda: {"A": 1}) == {"A": 1}
+
+    def test_load_file(self):
+        with temp_dir("TestReferenceCacheFile") as tempdir:
+            download_path = join(tempdir, "download.json")
+            with open(download_path, "w") as file:
+                file.write('{"A": 1}')
+            cache = ReferenceCache(join(tempdir, "cache"))
+            path = cache.load_file("rates.json", (URL,), lambda: download_path)
+            assert path == join(tempdir, "cache", "rates.json")
+            with open(path) as file:
+                assert file.read() == '{"A": 1}'
+            # The copy is restored from the cache without reading again
+            with open(path, "w") as file:
+                file.write("")
+            assert cache.load_file("rates.json", (URL,), lambda: None) == path
+            with open(path) as file:
+                assert file.read() == '{"A": 1}'
+            assert cache.load_file("failed.json", (URL,), lambda: None) is None
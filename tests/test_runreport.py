@@ -0,0 +1,94 @@
+import json
+import tracemalloc
+from os import listdir
+from os.path import join
+
+import pytest
+from hdx.utilities.path import temp_dir
+
+from iati.runreport import REPORT_FILENAME, RunReport
+from iati.utilities import forked_process_map
+
+
+def build_lists(no_lists):
+    return [list(range(1000)) for _ in range(no_lists)]
+
+
+def grow_memory():
+    report = RunReport("covid")
+    with report.stage("grow"):
+        lists = build_lists(2000)
+    del lists
+    with report.stage("after"):
+        build_lists(10)
+    return [(stage.peak_rss_mb, stage.rss_growth_mb) for stage in report.stages]
+
+
+class TestRunReport:
+    def test_stages(self):
+        report = RunReport("covid")
+        with report.stage("download", "bytes") as stage:
+            stage.items = 2048
+        with report.stage("processing") as stage:
+            build_lists(10)
+            stage.items = 10
+        with report.stage("reference_data", None):
+            pass
+        with pytest.raises(ValueError):
+            with report.stage("failed"):
+                raise ValueError("Failed")
+        assert [stage.name for stage in report.stages] == [
+            "download",
+            "processing",
+            "reference_data",
+        ]
+        with temp_dir("test_runreport", delete_if_exists=True) as folder:
+            report.save(folder)
+            assert listdir(folder) == [REPORT_FILENAME]
+            with open(join(folder, REPORT_FILENAME)) as file:
+                result = json.load(file)
+        assert result["name"] == "covid"
+        download, processing, reference_data = result["stages"]
+        assert download["unit"] == "bytes"
+        assert download["items"] == 2048
+        assert processing["unit"] == "activities"
+        assert processing["items_per_second"] > 0
+        assert reference_data["items"] is None
+        assert "items_per_second" not in reference_data
+        assert "traced_peak_mb" not in processing
+        assert result["wall_seconds"] >= processing["wall_seconds"]
+        assert result["peak_rss_mb"] > 0
+        assert processing["rss_growth_mb"] >= 0
+
+    def test_rss_growth(self):
+        # A new process has not reached the peaks of earlier tests
+        (stages,) = forked_process_map(grow_memory, [tuple()], 1)
+        (grow_peak, grow_growth), (after_peak, after_growth) = stages
+        # The peak so far carries over but the growth of the peak does not
+        assert grow_growth > 20
+        assert after_peak >= grow_peak
+        assert after_growth < grow_growth
+
+    def test_profile(self):
+        with temp_dir("test_runreport_profile", delete_if_exists=True) as folder:
+            profile_dir = join(folder, "profile")
+            report = RunReport("covid", profile_dir=profile_dir)
+            with report.stage("download", "bytes"):
+                pass
+            with report.stage("processing") as stage:
+                build_lists(100)
+                stage.items = 100
+            tracemalloc.stop()
+            assert sorted(listdir(profile_dir)) == [
+                "00_download.prof",
+                "00_download_allocations.txt",
+                "00_download_profile.txt",
+                "01_processing.prof",
+                "01_processing_allocations.txt",
+                "01_processing_profile.txt",
+            ]
+            with open(join(profile_dir, "01_processing_profile.txt")) as file:
+                assert "build_lists" in file.read()
+            with open(join(profile_dir, "01_processing_allocations.txt")) as file:
+                assert "test_runreport.py" in file.read()
+            assert report.stages[1].traced_peak_mb > 0
@@ -0,0 +1,78 @@
+from os.path import join
+
+from hdx.utilities.downloader import Download
+from hdx.utilities.loader import load_yaml
+from hdx.utilities.path import temp_dir
+from hdx.utilities.retriever import Retrieve
+
+from iati import BaseSectorLookups, FoodSecuritySectorLookups
+from iati.smallcodeditem import SmallCodedItem
+
+
+def original_get_sector_group_name(sector_info, default_sector, code):
+    code = code[:3]
+    if code in sector_info:
+        return sector_info[code]["dac-group"]
+    else:
+        return default_sector
+
+
+def original_get_foodsecurity_sector_group_name(lookups, code):
+    if code in lookups.sector_info:
+        return lookups.sector_info[code]
+    return original_get_sector_group_name(
+        lookups.default_lookup.sector_info, lookups.default_sector, code
+    )
+
+
+def make_sectors(*vocabularies):
+    return [
+        SmallCodedItem("12264", None, vocabulary, None) for vocabulary in vocabularies
+    ]
+
+
+class TestSectorLookups:
+    def test_sector_lookups(self):
+        configuration = load_yaml(join("tests", "config", "project_configuration.yml"))
+        configuration = configuration["lookups"]
+        input_dir = join("tests", "fixtures", "foodsecurity", "input")
+        with temp_dir("test_sectorlookups", delete_if_exists=True) as folder:
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader, folder, input_dir, folder, save=False, use_saved=True
+                )
+                lookups = BaseSectorLookups(retriever, configuration)
+                foodsecurity_lookups = FoodSecuritySectorLookups(
+                    retriever, configuration
+                )
+        codes = list(lookups.sector_info)
+        codes.extend(foodsecurity_lookups.sector_info)
+        codes.extend((f"{code}99" for code in lookups.sector_info))
+        codes.extend(("99999", "1", "", "(Unspecified sector)"))
+        for code in codes * 2:
+            assert lookups.get_sector_group_name(code) == (
+                original_get_sector_group_name(
+                    lookups.sector_info, lookups.default_sector, code
+                )
+            )
+            assert foodsecurity_lookups.get_sector_group_name(code) == (
+                original_get_foodsecurity_sector_group_name(foodsecurity_lookups, code)
+            )
+        # The food security sector names take precedence over the groups
+        assert foodsecurity_lookups.get_sector_group_name("12264") != (
+            lookups.get_sector_group_name("12264")
+        )
+        for vocabularies, expected, foodsecurity_expected in (
+            ((), "1", "2"),
+            (("1",), "1", "1"),
+            (("2",), "2", "2"),
+            (("1", "2"), "2", "1"),
+            (("99", "2", "1"), "2", "1"),
+            (("99",), "1", "2"),
+        ):
+            sectors = make_sectors(*vocabularies)
+            assert lookups.get_vocabulary_code(sectors) == expected
+            assert (
+                foodsecurity_lookups.get_vocabulary_code(sectors)
+                == foodsecurity_expected
+            )
@@ -0,0 +1,105 @@
+import gc
+import os
+from glob import glob
+from os.path import join
+from xml.etree.ElementTree import iterparse
+
+import pytest
+from dateutil.parser import ParserError
+from hdx.utilities.dateparse import parse_date
+
+from iati.smallcodeditem import SmallCodedItem
+from iati.utilities import (
+    forked_process_map,
+    get_date_with_fallback,
+    parse_iati_date,
+)
+
+state = list()
+
+
+def append_state(value):
+    state.append(value)
+    if value == "fail":
+        raise ValueError("Failed")
+    if value == "exit":
+        os._exit(3)
+    return os.getpid(), list(state)
+
+
+def original_parse(string):
+    try:
+        return parse_date(string)
+    except ParserError:
+        return None
+
+
+class TestUtilities:
+    def test_parse_iati_date(self):
+        dates = {
+            "2020-05-01",
+            "2020-02-29",
+            "2021-02-29",
+            "2020-13-01",
+            "0000-01-01",
+            "0099-01-01",
+            "2020-05-01T10:11:12",
+            "2020-05-01Z",
+            "2020-5-1",
+            "20200501",
+            " 2020-05-01",
+            "2020-05-01\n",
+            "01/05/2020",
+            "not a date",
+        }
+        for path in glob(join("tests", "fixtures", "*", "input", "dportal.xml")):
+            for _, element in iterparse(path):
+                for attribute in ("iso-date", "value-date"):
+                    value = element.get(attribute)
+                    if value is not None:
+                        dates.add(value)
+                element.clear()
+        for date in dates:
+            expected = original_parse(date)
+            actual = parse_iati_date(date)
+            assert actual == expected, date
+            if expected is not None:
+                assert actual.tzinfo == expected.tzinfo, date
+
+    def test_get_date_with_fallback(self):
+        assert get_date_with_fallback("2020-05-01", "2020-06-01") == parse_date(
+            "2020-05-01"
+        )
+        assert get_date_with_fallback("2020-02-30", "2020-06-01") == parse_date(
+            "2020-06-01"
+        )
+        assert get_date_with_fallback("", "2020-06-01") == parse_date("2020-06-01")
+        assert get_date_with_fallback(None, "bad") is None
+        assert get_date_with_fallback(None, None) is None
+
+    def test_forked_process_map(self):
+        state.append("parent")
+        results = forked_process_map(append_state, [("a",), ("b",), ("c",)], 2)
+        # Each call inherits the parent's state but not that of other calls
+        assert [result[1] for result in results] == [
+            ["parent", "a"],
+            ["parent", "b"],
+            ["parent", "c"],
+        ]
+        assert len({result[0] for result in results} | {os.getpid()}) == 4
+        assert state == ["parent"]
+        with pytest.raises(RuntimeError) as excinfo:
+            forked_process_map(append_state, [("fail",), ("exit",), ("d",)], 3)
+        message = str(excinfo.value)
+        assert "ValueError: Failed" in message
+        assert "Process exited with code 3" in message
+        state.clear()
+
+    def test_small_coded_item(self):
+        item = SmallCodedItem.get("12264", None, "1", 50)
+        assert SmallCodedItem.get("12264", None, "1", 50) is item
+        assert SmallCodedItem.get("12264", None, "1", 25) is not item
+        # Items are only shared while they are in use
+        del item
+        gc.collect()
+        assert ("12264", None, "1", 50) not in SmallCodedItem.interned